@@ -1,4 +1,6 @@
-from lib_comfyui import global_state
+from lib_comfyui import global_state, ipc, torch_utils
+from lib_comfyui.comfyui import type_conversion
+from lib_comfyui.comfyui.iframe_requests import ComfyuiIFrameRequests
 
 
 class StaticProperty(object):
@@ -29,7 +31,13 @@ class FromWebui:
 
     @staticmethod
     def get_node_inputs(void):
-        return global_state.node_inputs
+        input_types = getattr(global_state, "current_workflow_input_types", ())
+        node_inputs = ipc.shared_tensors.resolve(global_state.node_inputs)
+        node_inputs = torch_utils.expand_images(node_inputs, input_types)
+        if getattr(global_state, 'current_workflow_webui_latents', False):
+            node_inputs = type_conversion.webui_latents_to_comfyui(node_inputs, input_types)
+
+        return node_inputs
 
 
 class ToWebui:
@@ -47,7 +55,14 @@ class ToWebui:
 
     @staticmethod
     def extend_node_outputs(**outputs):
-        global_state.node_outputs += [outputs]
+        # unconnected inputs are missing, the types are looked up by input name
+        output_types = getattr(global_state, 'current_workflow_output_types', {})
+        if getattr(global_state, 'current_workflow_webui_latents', False):
+            outputs = type_conversion.comfyui_latents_to_webui(outputs, output_types)
+        if getattr(global_state, 'current_workflow_compact_images', False):
+            outputs = torch_utils.compact_images(outputs, output_types)
+
+        ComfyuiIFrameRequests.extend_node_outputs(outputs)
         return ()
 
 
@@ -1,5 +1,7 @@
 import json
 import multiprocessing
+import threading
+import uuid
 from queue import Empty
 from typing import List, Any, Dict, Tuple, Optional
 from lib_comfyui import ipc, global_state, torch_utils, external_code
@@ -8,6 +10,8 @@ from lib_comfyui.comfyui import queue_tracker
 
 class ComfyuiIFrameRequests:
     finished_comfyui_queue = multiprocessing.Queue()
+    # there is a single response queue, only one request can wait for a response at a time
+    send_lock = threading.Lock()
     server_instance = None
     sid_map = {}
 
@@ -25,10 +29,11 @@ class ComfyuiIFrameRequests:
         if workflow_type not in ws_client_ids:
             raise RuntimeError(f"The workflow type {workflow_type} has not been registered by the active webui client {global_state.focused_webui_client_id}")
 
-        clear_queue(cls.finished_comfyui_queue)
-        cls.server_instance.send_sync(request, data, ws_client_ids[workflow_type])
+        with cls.send_lock:
+            clear_queue(cls.finished_comfyui_queue)
+            cls.server_instance.send_sync(request, data, ws_client_ids[workflow_type])
 
-        return cls.finished_comfyui_queue.get()
+            return cls.finished_comfyui_queue.get()
 
     @staticmethod
     @ipc.restrict_to_process('webui')
@@ -36,15 +41,29 @@ class ComfyuiIFrameRequests:
         batch_input_args: Tuple[Any, ...],
         workflow_type_id: str,
         workflow_input_types: List[str],
+        workflow_output_types: Dict[str, str],
         queue_front: bool,
+        compact_images: bool = True,
+        webui_latents: bool = False,
+        cancel_event: Optional[threading.Event] = None,
     ) -> List[Dict[str, Any]]:
         from modules import shared
         if shared.state.interrupted:
             raise RuntimeError('The workflow was not started because the webui has been interrupted')
+        if cancel_event is not None and cancel_event.is_set():
+            raise RuntimeError('The workflow was not started because it has been cancelled')
 
-        global_state.node_inputs = batch_input_args
+        if compact_images:
+            # FromWebui expands the images in the comfyui process
+            batch_input_args = torch_utils.compact_images(batch_input_args, workflow_input_types)
+
+        run_id = uuid.uuid4().hex
+        global_state.node_inputs = ipc.shared_tensors.publish(run_id, batch_input_args)
         global_state.node_outputs = []
         global_state.current_workflow_input_types = workflow_input_types
+        global_state.current_workflow_output_types = workflow_output_types
+        global_state.current_workflow_compact_images = compact_images
+        global_state.current_workflow_webui_latents = webui_latents
 
         try:
             queue_tracker.setup_tracker_id()
@@ -59,14 +78,25 @@ class ComfyuiIFrameRequests:
                 }
             )
 
-            if not queue_tracker.wait_until_done():
+            if not queue_tracker.wait_until_done(cancel_event):
                 raise RuntimeError('The workflow has not returned normally')
 
-            return global_state.node_outputs
+            return [torch_utils.expand_images(outputs, workflow_output_types) for outputs in global_state.node_outputs]
         finally:
             global_state.current_workflow_input_types = ()
+            global_state.current_workflow_output_types = {}
+            global_state.current_workflow_compact_images = False
+            global_state.current_workflow_webui_latents = False
             global_state.node_outputs = []
             global_state.node_inputs = None
+            ipc.shared_tensors.release(run_id)
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def extend_node_outputs(outputs: Dict[str, Any]) -> None:
+        # only the outputs of the calling node cross the process boundary
+        # the list is assigned instead of extended in place, so that the comfyui replica is invalidated
+        global_state.node_outputs = global_state.node_outputs + [outputs]
 
     @staticmethod
     @ipc.restrict_to_process('webui')
@@ -75,7 +105,20 @@ class ComfyuiIFrameRequests:
         max_amount_of_FromWebui_nodes: Optional[int],
         max_amount_of_ToWebui_nodes: Optional[int],
     ) -> None:
-        workflow_graph = get_workflow_graph(workflow_type_id)
+        ComfyuiIFrameRequests.validate_graph_amount_of_nodes_or_throw(
+            workflow_type_id,
+            get_workflow_graph(workflow_type_id),
+            max_amount_of_FromWebui_nodes,
+            max_amount_of_ToWebui_nodes,
+        )
+
+    @staticmethod
+    def validate_graph_amount_of_nodes_or_throw(
+        workflow_type_id: str,
+        workflow_graph: dict,
+        max_amount_of_FromWebui_nodes: Optional[int],
+        max_amount_of_ToWebui_nodes: Optional[int],
+    ) -> None:
         all_nodes = workflow_graph['nodes']
         enabled_nodes = [node for node in all_nodes if node['mode'] != 2]
         node_types = [node['type'] for node in enabled_nodes]
@@ -114,21 +157,29 @@ class ComfyuiIFrameRequests:
 
 
 def extend_infotext_with_comfyui_workflows(p, tab):
+    workflow_graphs = {}
+    with ipc.batch():
+        for workflow_type in external_code.get_workflow_types(tab):
+            workflow_type_id = workflow_type.get_ids(tab)[0]
+            if not external_code.is_workflow_type_enabled(workflow_type_id):
+                continue
+
+            workflow_graphs[workflow_type_id] = workflow_type, get_workflow_graph(workflow_type_id)
+
     workflows = {}
-    for workflow_type in external_code.get_workflow_types(tab):
-        workflow_type_id = workflow_type.get_ids(tab)[0]
+    for workflow_type_id, (workflow_type, workflow_graph) in workflow_graphs.items():
         try:
-            ComfyuiIFrameRequests.validate_amount_of_nodes_or_throw(
+            workflow_graph = workflow_graph.result()
+            ComfyuiIFrameRequests.validate_graph_amount_of_nodes_or_throw(
                 workflow_type_id,
+                workflow_graph,
                 workflow_type.max_amount_of_FromWebui_nodes,
                 workflow_type.max_amount_of_ToWebui_nodes,
             )
         except RuntimeError:
             continue
-        if not external_code.is_workflow_type_enabled(workflow_type_id):
-            continue
 
-        workflows[workflow_type.base_id] = get_workflow_graph(workflow_type_id)
+        workflows[workflow_type.base_id] = workflow_graph
 
     p.extra_generation_params['ComfyUI Workflows'] = json.dumps(workflows)
 
@@ -50,7 +50,7 @@ def setup_ipc():
     ipc_strategy_class_name = os.getenv('SD_WEBUI_COMFYUI_IPC_STRATEGY_CLASS_NAME')
     print('[sd-webui-comfyui]', f'Using inter-process communication strategy: {settings.ipc_display_names[ipc_strategy_class_name]}')
     ipc_strategy_factory = getattr(ipc.strategies, os.getenv('SD_WEBUI_COMFYUI_IPC_STRATEGY_CLASS_NAME'))
-    ipc.current_callback_listeners = {'comfyui': ipc.callback.CallbackWatcher(ipc.call_fully_qualified, 'comfyui', ipc_strategy_factory)}
+    ipc.current_callback_listeners = {'comfyui': ipc.callback.CallbackWatcher(ipc.call_registered_function, 'comfyui', ipc_strategy_factory)}
     ipc.current_callback_proxies = {'webui': ipc.callback.CallbackProxy('webui', ipc_strategy_factory)}
     ipc.start_callback_listeners()
     atexit.register(ipc.stop_callback_listeners)
@@ -1,5 +1,7 @@
 import functools
 import multiprocessing
+import threading
+from typing import Optional
 from lib_comfyui import ipc
 
 
@@ -74,7 +76,7 @@ def setup_tracker_id():
 
 
 @ipc.restrict_to_process('webui')
-def wait_until_done():
+def wait_until_done(cancel_event: Optional[threading.Event] = None):
     if not wait_until_put():
         return False
 
@@ -85,7 +87,7 @@ def wait_until_done():
             return True
         elif not tracked_id_present():
             return False
-        elif shared.state.interrupted:
+        elif shared.state.interrupted or cancel_event is not None and cancel_event.is_set():
             cancel_queued_workflow()
             return False
 
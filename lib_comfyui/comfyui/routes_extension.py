@@ -1,12 +1,13 @@
 import asyncio
 import json
-from lib_comfyui import external_code
+from lib_comfyui import external_code, ipc
 from lib_comfyui.comfyui.iframe_requests import ComfyuiIFrameRequests
 
 
 def patch_server_routes():
     add_server__init__patch(websocket_handler_patch)
     add_server__init__patch(workflow_type_ops_server_patch)
+    add_server__init__patch(ipc_metrics_server_patch)
 
 
 def add_server__init__patch(callback):
@@ -48,16 +49,29 @@ def workflow_type_ops_server_patch(instance, _loop):
     @instance.routes.get("/sd-webui-comfyui/workflow_type")
     async def get_workflow_type(request):
         workflow_type_id = request.rel_url.query.get("workflowTypeId", None)
-        workflow_type = next(iter(
-            workflow_type
-            for workflow_type in external_code.get_workflow_types()
-            if workflow_type_id in workflow_type.get_ids()
-        ))
-        return web.json_response({
-            "displayName": workflow_type.display_name,
-            "webuiIoTypes": {
-                "inputs": list(workflow_type.input_types) if isinstance(workflow_type.input_types, tuple) else workflow_type.input_types,
-                "outputs": list(workflow_type.types) if isinstance(workflow_type.types, tuple) else workflow_type.types,
-            },
-            "defaultWorkflow": json.loads(external_code.get_default_workflow_json(workflow_type_id))
-        })
+        return web.json_response(await get_workflow_type_description.call_async(workflow_type_id))
+
+
+def ipc_metrics_server_patch(instance, _loop):
+    from aiohttp import web
+
+    @instance.routes.get("/sd-webui-comfyui/ipc_metrics")
+    async def get_ipc_metrics(_request):
+        return web.json_response(ipc.metrics.get_snapshot())
+
+
+@ipc.run_in_process('webui')
+def get_workflow_type_description(workflow_type_id):
+    workflow_type = next(iter(
+        workflow_type
+        for workflow_type in external_code.get_workflow_types()
+        if workflow_type_id in workflow_type.get_ids()
+    ))
+    return {
+        "displayName": workflow_type.display_name,
+        "webuiIoTypes": {
+            "inputs": list(workflow_type.input_types) if isinstance(workflow_type.input_types, tuple) else workflow_type.input_types,
+            "outputs": list(workflow_type.types) if isinstance(workflow_type.types, tuple) else workflow_type.types,
+        },
+        "defaultWorkflow": json.loads(workflow_type.default_workflow)
+    }
@@ -1,22 +1,75 @@
+import functools
+import os
+import numpy as np
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-import torchvision.transforms.functional as F
-from lib_comfyui import ipc
+from lib_comfyui import ipc, torch_utils
 from lib_comfyui.webui.proxies import get_comfy_model_config
 
 
+# batches of at least this many images are decoded and encoded on a thread pool
+thread_pool_min_batch_size = 8
+
+
 def webui_image_to_comfyui(batch):
     if isinstance(batch[0], Image.Image):
-        batch = torch.stack([F.pil_to_tensor(image) / 255 for image in batch])
+        return pil_images_to_tensor(batch)
     return batch.permute(0, 2, 3, 1)
 
 
 def comfyui_image_to_webui(batch, return_tensors=False):
-    batch = batch.permute(0, 3, 1, 2)
     if return_tensors:
-        return batch
+        return batch.permute(0, 3, 1, 2)
+
+    return tensor_to_pil_images(batch)
+
+
+def pil_images_to_tensor(images) -> torch.Tensor:
+    """
+    Decode the images into a single uint8 buffer of shape (B, H, W, C), then normalize it in one op
+    """
+    width, height = images[0].size
+    channels = len(images[0].getbands())
+    buffer = torch.empty((len(images), height, width, channels), dtype=torch.uint8)
+    buffer_array = buffer.numpy()
+
+    def decode(i):
+        buffer_array[i] = np.asarray(images[i]).reshape(height, width, channels)
+
+    map_images(decode, len(images))
+    return buffer / 255
+
+
+def tensor_to_pil_images(batch: torch.Tensor):
+    """
+    Quantize the (B, H, W, C) batch into a single uint8 buffer, then wrap each image
+    Images are scaled one at a time so that the float scratch stays in cache, which is faster than one op over the whole batch
+    Values in [0, 1] are truncated the same way torchvision's to_pil_image does, values outside are clamped
+    """
+    batch_array = batch.detach().to(device='cpu', dtype=torch.float32).numpy()
+    quantized = np.empty(batch_array.shape, dtype=np.uint8)
+    if quantized.shape[-1] == 1:
+        quantized = quantized[..., 0]
+
+    def encode(i):
+        scaled = np.multiply(batch_array[i], 255)
+        quantized[i] = np.clip(scaled, 0, 255, out=scaled).reshape(quantized.shape[1:])
+        return Image.fromarray(quantized[i])
 
-    return [F.to_pil_image(image) for image in batch]
+    return map_images(encode, len(quantized))
+
+
+def map_images(function, count):
+    if count < thread_pool_min_batch_size:
+        return [function(i) for i in range(count)]
+
+    return list(get_thread_pool().map(function, range(count)))
+
+
+@functools.lru_cache(maxsize=None)
+def get_thread_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='sd_webui_comfyui_type_conversion')
 
 
 @ipc.run_in_process('comfyui')
@@ -29,3 +82,19 @@ def webui_latent_to_comfyui(batch):
 def comfyui_latent_to_webui(batch):
     latent_format = get_comfy_model_config().latent_format
     return latent_format.process_in(batch['samples'])
+
+
+@ipc.restrict_to_process('comfyui')
+def webui_latents_to_comfyui(values, types):
+    return torch_utils.map_values_by_type(
+        values, types,
+        lambda value, value_type: webui_latent_to_comfyui(value) if value_type == 'LATENT' and isinstance(value, torch.Tensor) else value,
+    )
+
+
+@ipc.restrict_to_process('comfyui')
+def comfyui_latents_to_webui(values, types):
+    return torch_utils.map_values_by_type(
+        values, types,
+        lambda value, value_type: comfyui_latent_to_webui(value) if value_type == 'LATENT' and isinstance(value, dict) else value,
+    )
@@ -23,7 +23,7 @@ def start():
         print('[sd-webui-comfyui]', f'Could not find ComfyUI under directory "{install_location}". The server will NOT be started.', file=sys.stderr)
         return
 
-    ipc.current_callback_listeners = {'webui': ipc.callback.CallbackWatcher(ipc.call_fully_qualified, 'webui', global_state.ipc_strategy_class, clear_on_init=True)}
+    ipc.current_callback_listeners = {'webui': ipc.callback.CallbackWatcher(ipc.call_registered_function, 'webui', global_state.ipc_strategy_class, clear_on_init=True)}
     ipc.current_callback_proxies = {'comfyui': ipc.callback.CallbackProxy('comfyui', global_state.ipc_strategy_class, clear_on_init=True)}
     ipc.start_callback_listeners()
     atexit.register(stop)
@@ -125,6 +125,7 @@ def stop():
     atexit.unregister(stop)
     stop_comfyui_process()
     ipc.stop_callback_listeners()
+    ipc.shared_tensors.release_all()
 
 
 @ipc.restrict_to_process('webui')
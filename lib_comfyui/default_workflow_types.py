@@ -19,12 +19,14 @@ preprocess_latent_workflow_type = external_code.WorkflowType(
     tabs='img2img',
     default_workflow=external_code.AUTO_WORKFLOW,
     types='LATENT',
+    webui_latents=True,
 )
 postprocess_latent_workflow_type = external_code.WorkflowType(
     base_id='postprocess_latent',
     display_name='Postprocess (latent)',
     default_workflow=external_code.AUTO_WORKFLOW,
     types='LATENT',
+    webui_latents=True,
 )
 postprocess_workflow_type = external_code.WorkflowType(
     base_id='postprocess',
@@ -1,5 +1,8 @@
+import concurrent.futures
 import dataclasses
+import functools
 import sys
+import threading
 import traceback
 from pathlib import Path
 from typing import List, Tuple, Union, Any, Optional, Dict
@@ -25,6 +28,10 @@ class WorkflowType:
     input_types: Union[str, Tuple[str, ...], Dict[str, str], None] = None
     max_amount_of_ToWebui_nodes: Optional[int] = None
     max_amount_of_FromWebui_nodes: Optional[int] = None
+    # IMAGE values cross the process boundary as 8-bit tensors. Set to False for workflows that need more precision
+    compact_images: bool = True
+    # LATENT values are exchanged as webui latent tensors, the comfyui process applies the latent format of the model
+    webui_latents: bool = False
 
     def __post_init__(self):
         if isinstance(self.tabs, str):
@@ -62,14 +69,7 @@ class WorkflowType:
         return f'"{self.display_name}" ({self.base_id})'
 
     def is_same_io(self):
-        def normalize_to_tuple(types):
-            if isinstance(types, dict):
-                return tuple(types.values())
-            elif isinstance(types, str):
-                return types,
-            return types
-
-        return normalize_to_tuple(self.input_types) == normalize_to_tuple(self.types)
+        return _normalize_types_to_tuple(self.input_types) == _normalize_types_to_tuple(self.types)
 
 
 def get_workflow_types(tabs: Tabs = ALL_TABS) -> List[WorkflowType]:
@@ -237,8 +237,30 @@ def run_workflow(
         RuntimeError: If identity_on_error is False and workflow execution fails for any reason
         AssertionError: If multiple candidate ids exist for workflow_type
     """
-    from lib_comfyui.comfyui.iframe_requests import ComfyuiIFrameRequests
+    return submit_workflow(workflow_type, tab, batch_input, queue_front, identity_on_error).result()
+
+
+@ipc.restrict_to_process('webui')
+def submit_workflow(
+    workflow_type: WorkflowType,
+    tab: str,
+    batch_input: Any,
+    queue_front: Optional[bool] = None,
+    identity_on_error: Optional[bool] = False
+) -> 'WorkflowHandle':
+    """
+    Submit a comfyui workflow without waiting for it to run
+    Submitted workflows run one after the other, in submission order. Each one keeps its own inputs and outputs
 
+    Args:
+        The same as `run_workflow`
+    Returns:
+        A handle to the pending workflow. `handle.result()` returns what `run_workflow` would have returned or raises what it would have raised
+    Raises:
+        ValueError: If workflow_type is not present on the given tab
+        TypeError: If the type of batch_input does not match the type expected by workflow_type.input_types
+        AssertionError: If multiple candidate ids exist for workflow_type
+    """
     candidate_ids = workflow_type.get_ids(tab)
     assert len(candidate_ids) <= 1, (
         f'Found multiple candidate workflow type ids for tab {tab} and workflow type {workflow_type.pretty_str()}: {candidate_ids}\n'
@@ -254,7 +276,83 @@ def run_workflow(
         raise ValueError(f'The workflow type {workflow_type.pretty_str()} does not exist on tab {tab}. '
                          f'Valid tabs for the given workflow type are: {workflow_type.tabs}')
 
-    workflow_type_id = candidate_ids[0]
+    cancel_event = threading.Event()
+    future = _get_workflow_executor().submit(
+        _run_workflow_sync,
+        workflow_type=workflow_type,
+        tab=tab,
+        workflow_type_id=candidate_ids[0],
+        batch_input_args=batch_input_args,
+        input_types=input_types,
+        queue_front=queue_front,
+        identity_on_error=identity_on_error,
+        cancel_event=cancel_event,
+    )
+    return WorkflowHandle(future, cancel_event)
+
+
+class WorkflowHandle:
+    """
+    Pending result of a workflow submitted with `submit_workflow`
+    """
+
+    def __init__(self, future: concurrent.futures.Future, cancel_event: threading.Event):
+        self._future = future
+        self._cancel_event = cancel_event
+
+    def result(self, timeout: Optional[float] = None) -> List[Any]:
+        """
+        Wait for the outputs of the workflow
+
+        Args:
+            timeout (Optional[float]): Maximum number of seconds to wait. Waits until the workflow is done if None
+        Returns:
+            The outputs of the workflow, see `run_workflow`
+        Raises:
+            concurrent.futures.TimeoutError: If the workflow is not done after timeout seconds
+            concurrent.futures.CancelledError: If the workflow was cancelled before it started
+            RuntimeError: If identity_on_error is False and the workflow failed or was cancelled while running
+        """
+        return self._future.result(timeout)
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self) -> bool:
+        """
+        Cancel the workflow. A workflow that has not started is never sent to comfyui
+        A running workflow is removed from the comfyui queue or interrupted, and then fails like an interrupted workflow
+
+        Returns:
+            False if the workflow is already done, True otherwise
+        """
+        if self._future.cancel():
+            return True
+
+        if self._future.done():
+            return False
+
+        self._cancel_event.set()
+        return True
+
+
+@functools.lru_cache(maxsize=None)
+def _get_workflow_executor() -> concurrent.futures.ThreadPoolExecutor:
+    # comfyui runs one prompt at a time and the queue tracker follows a single prompt
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sd_webui_comfyui_workflow')
+
+
+def _run_workflow_sync(
+    workflow_type: WorkflowType,
+    tab: str,
+    workflow_type_id: str,
+    batch_input_args: Tuple[Any, ...],
+    input_types: Tuple[str, ...],
+    queue_front: bool,
+    identity_on_error: bool,
+    cancel_event: threading.Event,
+) -> List[Any]:
+    from lib_comfyui.comfyui.iframe_requests import ComfyuiIFrameRequests
 
     try:
         ComfyuiIFrameRequests.validate_amount_of_nodes_or_throw(
@@ -277,7 +375,11 @@ def run_workflow(
             batch_input_args=batch_input_args,
             workflow_type_id=workflow_type_id,
             workflow_input_types=input_types,
+            workflow_output_types=_get_types_by_input_name(workflow_type.types),
             queue_front=queue_front,
+            compact_images=workflow_type.compact_images,
+            webui_latents=workflow_type.webui_latents,
+            cancel_event=cancel_event,
         )
     except RuntimeError as e:
         if not identity_on_error:
@@ -311,6 +413,23 @@ class WorkflowTypeDisabled(RuntimeError):
     pass
 
 
+def _normalize_types_to_tuple(types):
+    if isinstance(types, dict):
+        return tuple(types.values())
+    elif isinstance(types, str):
+        return types,
+    return types
+
+
+def _get_types_by_input_name(types) -> Dict[str, str]:
+    # the names the ToWebui node gives to its inputs
+    if isinstance(types, dict):
+        return dict(types)
+    elif isinstance(types, str):
+        return {types: types}
+    return {str(i): t for i, t in enumerate(types)}
+
+
 def _normalize_to_tuple(batch_input, input_types):
     if isinstance(input_types, str):
         return (batch_input,), (input_types,)
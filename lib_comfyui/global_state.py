@@ -1,75 +1,211 @@
-import sys
-from types import ModuleType
-from typing import List, Tuple, Optional, Dict, Any
-from lib_comfyui import ipc
-
-
-enabled: bool
-is_ui_instantiated: bool
-queue_front: bool
-focused_webui_client_id: Optional[str] = None
-
-workflow_types: List
-enabled_workflow_type_ids: Dict[str, bool]
-node_inputs: Tuple[Any, ...]
-node_outputs: List[Dict[str, Any]]
-current_workflow_input_types: Tuple[str, ...]
-
-ipc_strategy_class: type
-ipc_strategy_class_name: str
-comfyui_graceful_termination_timeout: float
-
-reverse_proxy_enabled: bool
-
-last_positive_prompt: str
-last_negative_prompt: str
-
-
-class GlobalState(ModuleType):
-    __state = {}
-
-    def __init__(self, glob):
-        super().__init__(__name__)
-        for k, v in glob.items():
-            setattr(self, k, v)
-
-    def __getattr__(self, item):
-        if item in ['__file__']:
-            return globals()[item]
-
-        return GlobalState.getattr(item)
-
-    @staticmethod
-    @ipc.run_in_process('webui')
-    def getattr(item):
-        try:
-            return GlobalState.__state[item]
-        except KeyError:
-            raise AttributeError
-
-    def __setattr__(self, item, value):
-        GlobalState.setattr(item, value)
-
-    @staticmethod
-    @ipc.run_in_process('webui')
-    def setattr(item, value):
-        GlobalState.__state[item] = value
-
-    def __delattr__(self, item):
-        GlobalState.delattr(item)
-
-    @staticmethod
-    @ipc.run_in_process('webui')
-    def delattr(item):
-        del GlobalState.__state[item]
-
-    def __contains__(self, item):
-        return GlobalState.contains(item)
-
-    @staticmethod
-    @ipc.run_in_process('webui')
-    def contains(item):
-        return item in GlobalState.__state
-
-
-sys.modules[__name__] = GlobalState(globals())
+import copy
+import sys
+import threading
+import weakref
+from types import ModuleType
+from typing import List, Tuple, Optional, Dict, Any
+from lib_comfyui import ipc
+
+
+enabled: bool
+is_ui_instantiated: bool
+queue_front: bool
+focused_webui_client_id: Optional[str] = None
+
+workflow_types: List
+enabled_workflow_type_ids: Dict[str, bool]
+node_inputs: Tuple[Any, ...]
+node_outputs: List[Dict[str, Any]]
+current_workflow_input_types: Tuple[str, ...]
+# ToWebui input name -> type
+current_workflow_output_types: Dict[str, str]
+current_workflow_compact_images: bool
+current_workflow_webui_latents: bool
+
+ipc_strategy_class: type
+ipc_strategy_class_name: str
+comfyui_graceful_termination_timeout: float
+
+reverse_proxy_enabled: bool
+
+last_positive_prompt: str
+last_negative_prompt: str
+
+# incremented each time the webui loads a checkpoint, invalidates the caches of the webui model proxies
+sd_model_generation: int = 0
+
+# number of images sent to the webui vae at once. 0 sends the whole batch
+vae_chunk_size: int = 4
+
+
+class GlobalState(ModuleType):
+    """
+    The state lives in the webui process. The comfyui process keeps a replica of the items it reads
+    Each write gets a new version number. When the comfyui process holds a copy of the written item, the webui invalidates it before the write returns
+    If the comfyui process does not answer in time, the write returns anyway and the invalidation is delivered in the background
+    Only assignment and deletion invalidate the replica: mutate a copy of a value and assign it back, never the value in place
+    The comfyui process gets a copy of the replicated value on each read
+    """
+    # seconds a write waits for the comfyui process to invalidate its replica
+    invalidation_timeout = 1.
+    __state = {}
+    __versions = {}
+    __last_version = 0
+    __lock = threading.Lock()
+    # items held by the replica of the comfyui process, per proxy to that process
+    __replicated_items = weakref.WeakKeyDictionary()
+    # invalidations that did not complete in time. while there are some, writes do not wait for the comfyui process
+    __late_invalidations = 0
+
+    # comfyui process only: item -> (version, found, value). invalidated items have found=None
+    __replica = {}
+    __replica_lock = threading.Lock()
+
+    def __init__(self, glob):
+        super().__init__(__name__)
+        for k, v in glob.items():
+            setattr(self, k, v)
+
+    def __getattr__(self, item):
+        if item in ['__file__']:
+            return globals()[item]
+
+        if ipc.current_process_id == 'webui':
+            return GlobalState.getattr(item)
+
+        found, value = GlobalState.get_replicated(item)
+        if not found:
+            raise AttributeError
+
+        # callers may mutate the value, the replica keeps its own copy
+        return copy.deepcopy(value)
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def getattr(item):
+        try:
+            return GlobalState.__state[item]
+        except KeyError:
+            raise AttributeError
+
+    def __setattr__(self, item, value):
+        GlobalState.setattr(item, value)
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def setattr(item, value):
+        with GlobalState.__lock:
+            GlobalState.__state[item] = value
+            version = GlobalState.__update_version(item)
+
+        GlobalState.__invalidate_replicated_item(item, version)
+
+    def __delattr__(self, item):
+        GlobalState.delattr(item)
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def delattr(item):
+        with GlobalState.__lock:
+            del GlobalState.__state[item]
+            version = GlobalState.__update_version(item)
+
+        GlobalState.__invalidate_replicated_item(item, version)
+
+    def __contains__(self, item):
+        if ipc.current_process_id == 'webui':
+            return GlobalState.contains(item)
+
+        return GlobalState.get_replicated(item)[0]
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def contains(item):
+        return item in GlobalState.__state
+
+    @staticmethod
+    @ipc.run_in_process('webui')
+    def fetch(item):
+        proxy = ipc.current_callback_proxies.get('comfyui')
+        with GlobalState.__lock:
+            if proxy is not None:
+                GlobalState.__replicated_items.setdefault(proxy, set()).add(item)
+
+            found = item in GlobalState.__state
+            return GlobalState.__versions.get(item, 0), found, GlobalState.__state.get(item)
+
+    @staticmethod
+    def __update_version(item):
+        GlobalState.__last_version += 1
+        GlobalState.__versions[item] = GlobalState.__last_version
+        return GlobalState.__last_version
+
+    @staticmethod
+    def __invalidate_replicated_item(item, version):
+        proxy = ipc.current_callback_proxies.get('comfyui')
+        if proxy is None:
+            return
+
+        with GlobalState.__lock:
+            replicated_items = GlobalState.__replicated_items.get(proxy, set())
+            if item not in replicated_items:
+                return
+
+            replicated_items.remove(item)
+            comfyui_is_late = GlobalState.__late_invalidations > 0
+
+        done = threading.Event()
+        timed_out = False
+
+        def invalidate():
+            try:
+                GlobalState.invalidate_replica(item, version)
+            except Exception as e:
+                print('[sd-webui-comfyui]', f'Could not invalidate the comfyui replica of global_state.{item}: {e}', file=sys.stderr)
+            finally:
+                with GlobalState.__lock:
+                    done.set()
+                    if timed_out:
+                        GlobalState.__late_invalidations -= 1
+
+        # daemon thread: a stalled comfyui process must not prevent the webui from exiting
+        threading.Thread(target=invalidate, name=f'sd_webui_comfyui_invalidate_{item}', daemon=True).start()
+        if comfyui_is_late or done.wait(GlobalState.invalidation_timeout):
+            return
+
+        with GlobalState.__lock:
+            if not done.is_set():
+                timed_out = True
+                GlobalState.__late_invalidations += 1
+                print('[sd-webui-comfyui]', f'The comfyui process did not invalidate global_state.{item} in time, it may read a stale value', file=sys.stderr)
+
+    @staticmethod
+    def get_replicated(item):
+        with GlobalState.__replica_lock:
+            version, found, value = GlobalState.__replica.get(item, (0, None, None))
+
+        if found is not None:
+            return found, value
+
+        fetched_version, found, value = GlobalState.fetch(item)
+        with GlobalState.__replica_lock:
+            # an invalidation for a newer write may have arrived while fetching
+            if fetched_version >= GlobalState.__replica.get(item, (0,))[0]:
+                GlobalState.__replica[item] = fetched_version, found, value
+
+        return found, value
+
+    @staticmethod
+    @ipc.run_in_process('comfyui')
+    def invalidate_replica(item, version):
+        with GlobalState.__replica_lock:
+            if version > GlobalState.__replica.get(item, (0,))[0]:
+                GlobalState.__replica[item] = version, None, None
+
+    @staticmethod
+    def clear_replica():
+        with GlobalState.__replica_lock:
+            GlobalState.__replica.clear()
+
+
+sys.modules[__name__] = GlobalState(globals())
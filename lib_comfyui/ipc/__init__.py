@@ -1,36 +1,132 @@
 from . import callback
+from . import metrics
 from . import payload
+from . import serialization
+from . import shared_tensors
 from . import strategies
 
+import contextlib
 import gc
 import importlib
 import sys
+import threading
 import time
 import logging
+import weakref
+from concurrent.futures import Future
 
 
 def run_in_process(process_id):
     def annotation(function):
+        function_name = f'{function.__module__}.{function.__qualname__}'
+
         def wrapper(*args, **kwargs):
             global current_process_id
             if process_id == current_process_id:
                 return function(*args, **kwargs)
+            elif current_batch_calls() is not None:
+                future = Future()
+                current_batch_calls().setdefault(process_id, []).append((future, (function.__module__, function.__qualname__, args, kwargs)))
+                return future
             else:
                 start = time.time()
-                res = current_callback_proxies[process_id].get(args=(function.__module__, function.__qualname__, args, kwargs))
-                logging.debug(
-                    '[sd-webui-comfyui] IPC call %s -> %s %s:\t%s',
-                    current_process_id, process_id,
-                    time.time() - start,
-                    f'{function.__module__}.{function.__qualname__}(*{args}, **{kwargs})'
-                )
+                proxy = current_callback_proxies[process_id]
+                function_id = get_remote_function_id(proxy, function.__module__, function.__qualname__)
+                with metrics.measure_call(function_name, 'outgoing'):
+                    res = proxy.get(args=(function_id, args, kwargs))
+                log_call(process_id, start, function, args, kwargs)
                 return res
 
+        async def call_async(*args, **kwargs):
+            global current_process_id
+            if process_id == current_process_id:
+                return function(*args, **kwargs)
+            else:
+                start = time.time()
+                proxy = current_callback_proxies[process_id]
+                function_id = await get_remote_function_id_async(proxy, function.__module__, function.__qualname__)
+                with metrics.measure_call(function_name, 'outgoing'):
+                    res = await proxy.get_async(args=(function_id, args, kwargs))
+                log_call(process_id, start, function, args, kwargs)
+                return res
+
+        wrapper.call_async = call_async
         return wrapper
 
     return annotation
 
 
+@contextlib.contextmanager
+def batch():
+    """
+    Defer the calls to other processes made in this context and send them together in a single message per process
+    Inside the context, calls to functions decorated with run_in_process that target another process return a concurrent.futures.Future
+    Calls that target the current process are executed immediately and return their result as usual
+    The deferred calls are executed in order when leaving the context. Each future receives its own result or exception
+    """
+    if current_batch_calls() is not None:
+        # nested batches are merged into the outermost one
+        yield
+        return
+
+    batch_state.calls = {}
+    try:
+        yield
+    except BaseException:
+        for calls in batch_state.calls.values():
+            for future, _ in calls:
+                future.cancel()
+        raise
+    finally:
+        deferred_calls, batch_state.calls = batch_state.calls, None
+
+    for process_id, calls in deferred_calls.items():
+        start = time.time()
+        try:
+            proxy = current_callback_proxies[process_id]
+            registered_calls = [
+                (get_remote_function_id(proxy, module_name, qualified_name), args, kwargs)
+                for _, (module_name, qualified_name, args, kwargs) in calls
+            ]
+            with metrics.measure_call(f'{__name__}.{call_batch.__qualname__}', 'outgoing'):
+                results = proxy.get(args=(call_batch_function_id, (registered_calls,), {}))
+        except Exception as e:
+            for future, _ in calls:
+                future.set_exception(e)
+            continue
+
+        logging.debug('[sd-webui-comfyui] IPC batch %s -> %s %s:\t%d calls', current_process_id, process_id, time.time() - start, len(calls))
+        for (future, _), (succeeded, result) in zip(calls, results):
+            if succeeded:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+
+def current_batch_calls():
+    return getattr(batch_state, 'calls', None)
+
+
+def call_batch(calls):
+    results = []
+    for function_id, args, kwargs in calls:
+        try:
+            results.append((True, call_registered_function(function_id, args, kwargs)))
+        except Exception as e:
+            results.append((False, e))
+
+    return results
+
+
+def log_call(process_id, start, function, args, kwargs):
+    logging.debug(
+        '[sd-webui-comfyui] IPC call %s -> %s %s:\t%s.%s(*%s, **%s)',
+        current_process_id, process_id,
+        time.time() - start,
+        function.__module__, function.__qualname__, args, kwargs,
+    )
+
+
 def restrict_to_process(process_id):
     def annotation(function):
         def wrapper(*args, **kwargs):
@@ -45,7 +141,47 @@ def restrict_to_process(process_id):
     return annotation
 
 
-def call_fully_qualified(module_name, qualified_name, args, kwargs):
+def get_remote_function_id(proxy, module_name, qualified_name):
+    function_ids = remote_function_ids.setdefault(proxy, {})
+    function_key = module_name, qualified_name
+    if function_key not in function_ids:
+        function_ids[function_key] = proxy.get(args=(register_function_id, function_key, {}))
+
+    return function_ids[function_key]
+
+
+async def get_remote_function_id_async(proxy, module_name, qualified_name):
+    function_ids = remote_function_ids.setdefault(proxy, {})
+    function_key = module_name, qualified_name
+    if function_key not in function_ids:
+        function_ids[function_key] = await proxy.get_async(args=(register_function_id, function_key, {}))
+
+    return function_ids[function_key]
+
+
+def register_function(module_name, qualified_name):
+    """
+    Resolve a function of the current process once and return the id other processes use to call it
+    """
+    function_key = module_name, qualified_name
+    with registered_functions_lock:
+        if function_key not in registered_function_ids:
+            registered_functions.append((f'{module_name}.{qualified_name}', resolve_fully_qualified(module_name, qualified_name)))
+            registered_function_ids[function_key] = len(registered_functions) - 1
+
+        return registered_function_ids[function_key]
+
+
+def call_registered_function(function_id, args, kwargs):
+    function_name, function = registered_functions[function_id]
+    call_stats = metrics.current_call_stats.get()
+    if call_stats is not None and call_stats.function_name is None:
+        call_stats.function_name = function_name
+
+    return function(*args, **kwargs)
+
+
+def resolve_fully_qualified(module_name, qualified_name):
     module_parts = module_name.split('.')
     try:
         module = sys.modules[module_parts[0]]
@@ -58,12 +194,29 @@ def call_fully_qualified(module_name, qualified_name, args, kwargs):
     function = module
     for name in qualified_name.split('.'):
         function = getattr(function, name)
-    return function(*args, **kwargs)
+    return function
 
 
 current_process_id = 'webui'
 current_callback_listeners = {}
 current_callback_proxies = {}
+batch_state = threading.local()
+
+# functions other processes can call, indexed by id. the first ids are reserved for the ipc layer itself
+registered_functions = [
+    (f'{__name__}.{register_function.__qualname__}', register_function),
+    (f'{__name__}.{call_batch.__qualname__}', call_batch),
+]
+registered_function_ids = {
+    (__name__, function.__qualname__): function_id
+    for function_id, (_, function) in enumerate(registered_functions)
+}
+registered_functions_lock = threading.Lock()
+register_function_id = 0
+call_batch_function_id = 1
+
+# ids of the functions of other processes, per proxy. a new proxy renegotiates them with the new process
+remote_function_ids = weakref.WeakKeyDictionary()
 
 
 def start_callback_listeners():
@@ -1,78 +1,248 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import itertools
+import os
+import sys
 import threading
+import time
 from typing import Callable
+from lib_comfyui.ipc import metrics
 from lib_comfyui.ipc.payload import IpcSender, IpcReceiver
 from lib_comfyui.ipc.strategies import IpcStrategy
 
 
+# maximum number of calls that can be served concurrently for each callback
+# both the watcher and the proxy of a callback must use the same value
+default_max_workers = 4
+
+
 class CallbackWatcher:
-    def __init__(self, callback: Callable, name: str, strategy_factory: Callable[[str], IpcStrategy], clear_on_init: bool = False, clear_on_del: bool = True):
+    def __init__(
+        self,
+        callback: Callable,
+        name: str,
+        strategy_factory: Callable[[str], IpcStrategy],
+        clear_on_init: bool = False,
+        clear_on_del: bool = True,
+        max_workers: int = default_max_workers,
+    ):
         self._callback = callback
-        self._res_sender = IpcSender(
-            f'res_{name}',
-            strategy_factory,
-            clear_on_init=clear_on_init,
-            clear_on_del=clear_on_del,
-        )
-        self._args_receiver = IpcReceiver(
-            f'args_{name}',
-            strategy_factory,
-            clear_on_init=clear_on_init,
-            clear_on_del=clear_on_del,
-        )
-        self._producer_thread = None
+        self._slots = [
+            (
+                IpcReceiver(
+                    f'args_{name}_{slot_index}',
+                    strategy_factory,
+                    clear_on_init=clear_on_init,
+                    clear_on_del=clear_on_del,
+                ),
+                IpcSender(
+                    f'res_{name}_{slot_index}',
+                    strategy_factory,
+                    clear_on_init=clear_on_init,
+                    clear_on_del=clear_on_del,
+                ),
+            )
+            for slot_index in range(max_workers)
+        ]
+        self._worker_threads = []
 
     def start(self):
-        def thread_loop():
-            while self._producer_thread.is_running():
-                self.attend_consumer(timeout=0.5)
+        def thread_loop(slot_index):
+            while threading.current_thread().is_running():
+                try:
+                    self.attend_consumer(slot_index, timeout=0.5)
+                except Exception as e:
+                    # a failed call must not stop the slot from serving the next ones
+                    print('[sd-webui-comfyui]', f'Error while serving an IPC call: {e!r}', file=sys.stderr)
 
-        self._producer_thread = StoppableThread(target=thread_loop, daemon=True)
-        self._producer_thread.start()
+        self._worker_threads = [
+            StoppableThread(target=thread_loop, args=(slot_index,), daemon=True)
+            for slot_index in range(len(self._slots))
+        ]
+        for worker_thread in self._worker_threads:
+            worker_thread.start()
 
     def stop(self):
-        if self._producer_thread is None:
-            return
+        for worker_thread in self._worker_threads:
+            worker_thread.stop()
 
-        self._producer_thread.join()
-        self._producer_thread = None
+        for worker_thread in self._worker_threads:
+            worker_thread.join()
+
+        self._worker_threads = []
+        # nothing listens anymore, the next call to start() creates the doorbells again
+        for args_receiver, _ in self._slots:
+            args_receiver.close_doorbell()
 
     def is_running(self):
-        return self._producer_thread and self._producer_thread.is_running()
+        return any(worker_thread.is_running() for worker_thread in self._worker_threads)
 
-    def attend_consumer(self, timeout: float = None):
+    def attend_consumer(self, slot_index: int = 0, timeout: float = None):
+        args_receiver, res_sender = self._slots[slot_index]
+        # the callback names the call in the stats once it knows which function is called
+        call_stats = metrics.CallStats()
+        call_stats_token = metrics.current_call_stats.set(call_stats)
         try:
-            args, kwargs = self._args_receiver.recv(timeout=timeout)
-        except TimeoutError:
-            return
+            try:
+                request_id, args, kwargs = args_receiver.recv(timeout=timeout)
+            except TimeoutError:
+                return
 
-        try:
-            self._res_sender.send(self._callback(*args, **kwargs))
-        except Exception as e:
-            self._res_sender.send(RemoteError(e))
+            start = time.perf_counter()
+            try:
+                res = self._callback(*args, **kwargs)
+            except Exception as e:
+                res = RemoteError(e)
 
+            try:
+                res_sender.send((request_id, res))
+            except (TimeoutError, ConnectionError) as e:
+                # the caller is gone, there is nobody to answer to
+                print('[sd-webui-comfyui]', f'Could not send the result of an IPC call: {e}', file=sys.stderr)
+            except Exception as e:
+                # e.g. the result cannot be pickled. the error itself may not be either, only send its description
+                print('[sd-webui-comfyui]', f'Could not send the result of an IPC call: {e!r}', file=sys.stderr)
+                res = RemoteError(RuntimeError(f'Could not send the result of the call: {e!r}'))
+                try:
+                    res_sender.send((request_id, res))
+                except Exception as e:
+                    print('[sd-webui-comfyui]', f'Could not send the error of an IPC call: {e!r}', file=sys.stderr)
+        finally:
+            metrics.current_call_stats.reset(call_stats_token)
 
-class CallbackProxy:
-    def __init__(self, name: str, strategy_factory, clear_on_init: bool = False, clear_on_del: bool = True):
-        self._res_receiver = IpcReceiver(
-            f'res_{name}',
-            strategy_factory,
-            clear_on_init=clear_on_init,
-            clear_on_del=clear_on_del,
-        )
-        self._args_sender = IpcSender(
-            f'args_{name}',
-            strategy_factory,
-            clear_on_init=clear_on_init,
-            clear_on_del=clear_on_del,
+        metrics.record_call(
+            call_stats.function_name or getattr(self._callback, '__qualname__', 'unknown'),
+            'incoming',
+            time.perf_counter() - start,
+            call_stats,
+            succeeded=not isinstance(res, RemoteError),
         )
 
+
+class CallbackProxy:
+    def __init__(
+        self,
+        name: str,
+        strategy_factory,
+        clear_on_init: bool = False,
+        clear_on_del: bool = True,
+        max_workers: int = default_max_workers,
+    ):
+        self._slots = [
+            (
+                IpcSender(
+                    f'args_{name}_{slot_index}',
+                    strategy_factory,
+                    clear_on_init=clear_on_init,
+                    clear_on_del=clear_on_del,
+                ),
+                IpcReceiver(
+                    f'res_{name}_{slot_index}',
+                    strategy_factory,
+                    clear_on_init=clear_on_init,
+                    clear_on_del=clear_on_del,
+                ),
+            )
+            for slot_index in range(max_workers)
+        ]
+        self._free_slots = list(range(max_workers))
+        self._free_slots_condition = threading.Condition()
+        self._async_slot_waiters = []
+        # async callers send their requests from here, at most one per slot
+        self._send_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sd_webui_comfyui_ipc_send')
+
+        # start at a random id to never match a stale response left by a previous process
+        self._request_ids = itertools.count(int.from_bytes(os.urandom(4), 'little'))
+
     def get(self, args=None, kwargs=None):
-        self._args_sender.send((args if args is not None else (), kwargs if kwargs is not None else {}))
-        res = self._res_receiver.recv()
-        if isinstance(res, RemoteError):
-            raise res.error from res
-        else:
-            return res
+        slot_index = self._acquire_slot()
+        try:
+            args_sender, res_receiver = self._slots[slot_index]
+            request_id = self._send_request(args_sender, args, kwargs)
+            while True:
+                response_id, res = res_receiver.recv()
+                if response_id == request_id:
+                    break
+                # response to an earlier call that was interrupted before receiving it
+        finally:
+            self._release_slot(slot_index)
+
+        return unwrap_result(res)
+
+    async def get_async(self, args=None, kwargs=None):
+        slot_index = await self._acquire_slot_async()
+        request_sent = None
+        try:
+            args_sender, res_receiver = self._slots[slot_index]
+            # sending waits for the payload lock, or for the receiver to listen. never block the event loop on it
+            request_sent = self._send_executor.submit(contextvars.copy_context().run, self._send_request, args_sender, args, kwargs)
+            request_id = await asyncio.wrap_future(request_sent)
+            while True:
+                response_id, res = await res_receiver.recv_async()
+                if response_id == request_id:
+                    break
+        finally:
+            if request_sent is None or request_sent.done():
+                self._release_slot(slot_index)
+            else:
+                # cancelled while sending, the slot is free once the request is out
+                request_sent.add_done_callback(lambda _: self._release_slot(slot_index))
+
+        return unwrap_result(res)
+
+    def _acquire_slot(self) -> int:
+        with self._free_slots_condition:
+            self._free_slots_condition.wait_for(lambda: self._free_slots)
+            return self._free_slots.pop()
+
+    async def _acquire_slot_async(self) -> int:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._free_slots_condition:
+                if self._free_slots:
+                    return self._free_slots.pop()
+
+                waiter = loop.create_future()
+                self._async_slot_waiters.append((loop, waiter))
+
+            try:
+                await waiter
+            finally:
+                with self._free_slots_condition:
+                    if (loop, waiter) in self._async_slot_waiters:
+                        self._async_slot_waiters.remove((loop, waiter))
+
+    def _release_slot(self, slot_index: int):
+        with self._free_slots_condition:
+            self._free_slots.append(slot_index)
+            self._free_slots_condition.notify()
+            async_slot_waiters, self._async_slot_waiters = self._async_slot_waiters, []
+
+        # waiters may belong to event loops of other threads. they all retry, the losers wait again
+        for loop, waiter in async_slot_waiters:
+            try:
+                loop.call_soon_threadsafe(wake_up_waiter, waiter)
+            except RuntimeError:
+                # the event loop of the waiter is closed
+                pass
+
+    def _send_request(self, args_sender, args, kwargs):
+        request_id = next(self._request_ids)
+        args_sender.send((request_id, args if args is not None else (), kwargs if kwargs is not None else {}))
+        return request_id
+
+
+def wake_up_waiter(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def unwrap_result(res):
+    if isinstance(res, RemoteError):
+        raise res.error from res
+    else:
+        return res
 
 
 class RemoteError(Exception):
@@ -0,0 +1,174 @@
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class CallStats:
+    """
+    Measurements accumulated by the IPC layer while a single call is being made or served
+    """
+    __slots__ = ('function_name', 'serialized_bytes_sent', 'serialized_bytes_received', 'serialization_time', 'lock_wait_time')
+
+    def __init__(self, function_name: Optional[str] = None):
+        self.function_name = function_name
+        self.serialized_bytes_sent = 0
+        self.serialized_bytes_received = 0
+        self.serialization_time = 0.
+        self.lock_wait_time = 0.
+
+
+# stats of the call being made or served by the current thread or task, if any
+current_call_stats = contextvars.ContextVar('current_call_stats', default=None)
+
+
+class LatencyHistogram:
+    """
+    Histogram with logarithmic buckets, each bucket is 2^(1/4) times wider than the previous one
+    Percentiles are estimated with the upper bound of their bucket, which is accurate to about 19%
+    """
+    min_latency = 1e-6
+    buckets_per_doubling = 4
+
+    def __init__(self):
+        self._bucket_counts = {}
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, latency: float):
+        bucket_index = self._get_bucket_index(latency)
+        self._bucket_counts[bucket_index] = self._bucket_counts.get(bucket_index, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+
+        target_count = percent / 100 * self.count
+        seen_count = 0
+        for bucket_index in sorted(self._bucket_counts):
+            seen_count += self._bucket_counts[bucket_index]
+            if seen_count >= target_count:
+                return min(self._get_bucket_upper_bound(bucket_index), self.max)
+
+        return self.max
+
+    def _get_bucket_index(self, latency: float) -> int:
+        if latency <= self.min_latency:
+            return 0
+
+        return math.ceil(math.log2(latency / self.min_latency) * self.buckets_per_doubling)
+
+    def _get_bucket_upper_bound(self, bucket_index: int) -> float:
+        return self.min_latency * 2 ** (bucket_index / self.buckets_per_doubling)
+
+
+class FunctionMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.serialized_bytes_sent = 0
+        self.serialized_bytes_received = 0
+        self.serialization_time = 0.
+        self.lock_wait_time = 0.
+
+    def add(self, latency: float, stats: CallStats, succeeded: bool):
+        self.calls += 1
+        self.errors += int(not succeeded)
+        self.latency.add(latency)
+        self.serialized_bytes_sent += stats.serialized_bytes_sent
+        self.serialized_bytes_received += stats.serialized_bytes_received
+        self.serialization_time += stats.serialization_time
+        self.lock_wait_time += stats.lock_wait_time
+
+    def to_dict(self) -> dict:
+        def to_ms(seconds):
+            return None if seconds is None else seconds * 1000
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency_ms': {
+                'mean': to_ms(self.latency.total / self.latency.count if self.latency.count else None),
+                'p50': to_ms(self.latency.percentile(50)),
+                'p90': to_ms(self.latency.percentile(90)),
+                'p99': to_ms(self.latency.percentile(99)),
+                'max': to_ms(self.latency.max),
+            },
+            'serialized_bytes': {
+                'sent': self.serialized_bytes_sent,
+                'received': self.serialized_bytes_received,
+            },
+            'serialization_ms': to_ms(self.serialization_time),
+            'lock_wait_ms': to_ms(self.lock_wait_time),
+        }
+
+
+functions_metrics: Dict[Tuple[str, str], FunctionMetrics] = {}
+functions_metrics_lock = threading.Lock()
+# last value reported for settings and sizes that explain the call metrics, e.g. the chunk size of the vae calls
+gauges: Dict[str, Any] = {}
+
+
+def record_call(function_name: str, direction: str, latency: float, stats: CallStats, succeeded: bool):
+    """
+    Record a call made to another process (direction 'outgoing') or served for another process (direction 'incoming')
+    """
+    with functions_metrics_lock:
+        key = function_name, direction
+        if key not in functions_metrics:
+            functions_metrics[key] = FunctionMetrics()
+
+        functions_metrics[key].add(latency, stats, succeeded)
+
+
+def set_gauge(name: str, value: Any):
+    with functions_metrics_lock:
+        gauges[name] = value
+
+
+@contextlib.contextmanager
+def measure_call(function_name: str, direction: str):
+    stats = CallStats(function_name)
+    token = current_call_stats.set(stats)
+    start = time.perf_counter()
+    succeeded = False
+    try:
+        yield stats
+        succeeded = True
+    finally:
+        latency = time.perf_counter() - start
+        current_call_stats.reset(token)
+        record_call(function_name, direction, latency, stats, succeeded)
+
+
+def get_snapshot() -> dict:
+    from lib_comfyui import ipc
+    with functions_metrics_lock:
+        functions = [
+            {
+                'function': function_name,
+                'direction': direction,
+                **function_metrics.to_dict(),
+            }
+            for (function_name, direction), function_metrics in sorted(functions_metrics.items())
+        ]
+        current_gauges = dict(sorted(gauges.items()))
+
+    return {
+        'process': ipc.current_process_id,
+        'functions': functions,
+        'gauges': current_gauges,
+    }
+
+
+def reset():
+    with functions_metrics_lock:
+        functions_metrics.clear()
+        gauges.clear()
@@ -1,32 +1,46 @@
 import contextlib
 import math
-import pickle
 import portalocker
 import tempfile
 import time
 import logging
 from pathlib import Path
-from typing import Optional, Any, Callable
-from lib_comfyui.ipc.strategies import IpcStrategy
+from typing import Optional, Any, Callable, Union
+from lib_comfyui.ipc import metrics, serialization
+from lib_comfyui.ipc.strategies import IpcStrategy, StreamIpcStrategy, IpcDoorbell, OsFriendlyIpcDoorbell
 
 
 class IpcPayload:
-    def __init__(self, name, strategy_factory: Callable[[str], IpcStrategy], lock_directory: str = None, clear_on_init: bool = False, clear_on_del: bool = True):
+    def __init__(
+        self,
+        name,
+        strategy_factory: Callable[[str], Union[IpcStrategy, StreamIpcStrategy]],
+        lock_directory: str = None,
+        clear_on_init: bool = False,
+        clear_on_del: bool = True,
+        doorbell_factory: Callable[[str], IpcDoorbell] = OsFriendlyIpcDoorbell,
+    ):
         self._name = name
         self._strategy = strategy_factory(f'ipc_payload_{name}')
         lock_directory = tempfile.gettempdir() if lock_directory is None else lock_directory
         self._lock_path = Path(lock_directory, f'ipc_payload_{name}')
+        self._doorbell = doorbell_factory(str(Path(lock_directory, f'ipc_payload_{name}.doorbell')))
+        self._segment_prefix = f'ipc_payload_{name}_tensor'
         self._clear_on_del = clear_on_del
 
         if clear_on_init:
             with self.get_lock() as lock_file:
-                self._strategy.clear(lock_file)
+                self.clear(lock_file)
 
     def __del__(self):
         if self._clear_on_del:
             lock = self.get_lock()
             with lock as lock_file:
-                self._strategy.clear(lock_file)
+                self.clear(lock_file)
+
+    def clear(self, lock_file):
+        self._strategy.clear(lock_file)
+        serialization.clear_segments(self._segment_prefix)
 
     def get_lock(self, timeout: Optional[float] = None, mode: str = 'wb+'):
         return portalocker.Lock(
@@ -39,33 +53,66 @@ class IpcPayload:
 
 
 class IpcSender(IpcPayload):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._segment_paths = []
+
     def send(self, value: Any):
+        call_stats = metrics.current_call_stats.get()
+        serialization_start = time.perf_counter()
+        data, segment_paths = serialization.dumps(value, self._segment_prefix)
+        if call_stats is not None:
+            call_stats.serialization_time += time.perf_counter() - serialization_start
+            call_stats.serialized_bytes_sent += len(data)
+
+        if isinstance(self._strategy, StreamIpcStrategy):
+            logging.debug('IPC payload %s\tsend value: %s', self._name, value)
+            # messages are queued, the receiver unlinks the segments of each message it reads
+            self._strategy.send(data)
+            return
+
+        lock_start = time.perf_counter()
         with self.get_lock() as lock_file:
-            logging.debug(f'IPC payload {self._name}\tsend value: {value}')
-            self._strategy.set_data(lock_file, pickle.dumps(value))
+            if call_stats is not None:
+                call_stats.lock_wait_time += time.perf_counter() - lock_start
+
+            logging.debug('IPC payload %s\tsend value: %s', self._name, value)
+            # by now, the previous value has either been received or is about to be overwritten
+            serialization.unlink_segments(self._segment_paths)
+            self._segment_paths = segment_paths
+            self._strategy.set_data(lock_file, data)
+
+        self._doorbell.ring()
 
 
 class IpcReceiver(IpcPayload):
+    def clear(self, lock_file):
+        super().clear(lock_file)
+        self.close_doorbell()
+
+    def close_doorbell(self):
+        # the receiving side owns the doorbell, senders only ring it
+        self._doorbell.close()
+        self._doorbell.unlink()
+
     def recv(self, timeout: Optional[float] = None) -> Any:
         current_time = time.time()
         end_time = (current_time + timeout) if timeout is not None else math.inf
+        if isinstance(self._strategy, StreamIpcStrategy):
+            with self._strategy.recv(end_time - current_time) as data, restore_torch_load():
+                value = self._loads(data)
+                del data
 
-        while current_time < end_time:
-            lock = self.get_lock(timeout=end_time - current_time, mode='rb+')
-
-            try:
-                with lock as lock_file:
-                    if self._strategy.is_empty(lock_file):
-                        raise FileEmptyException
+            logging.debug('IPC payload %s\treceive value: %s', self._name, value)
+            return value
 
-                    with self._strategy.get_data(lock_file) as data, restore_torch_load():
-                        value = pickle.loads(data)
-                        del data
+        self._doorbell.listen()
 
-                logging.debug(f'IPC payload {self._name}\treceive value: {value}')
-                return value
+        while current_time < end_time:
+            try:
+                return self._recv_once(lock_timeout=end_time - current_time)
             except FileEmptyException:
-                time.sleep(lock.check_interval)  # yuck
+                self._doorbell.wait(end_time - current_time)
                 current_time = time.time()
                 continue
             except portalocker.LockException:
@@ -73,6 +120,59 @@ class IpcReceiver(IpcPayload):
 
         raise TimeoutError
 
+    async def recv_async(self, timeout: Optional[float] = None) -> Any:
+        current_time = time.time()
+        end_time = (current_time + timeout) if timeout is not None else math.inf
+        if isinstance(self._strategy, StreamIpcStrategy):
+            data = await self._strategy.recv_async(end_time - current_time)
+            with restore_torch_load():
+                value = self._loads(data)
+                del data
+
+            logging.debug('IPC payload %s\treceive value: %s', self._name, value)
+            return value
+
+        self._doorbell.listen()
+
+        while current_time < end_time:
+            try:
+                # never block the event loop on the lock, the sender rings the doorbell after releasing it
+                return self._recv_once(lock_timeout=0)
+            except (FileEmptyException, portalocker.LockException):
+                await self._doorbell.wait_async(end_time - current_time)
+                current_time = time.time()
+
+        raise TimeoutError
+
+    def _recv_once(self, lock_timeout: float) -> Any:
+        lock_start = time.perf_counter()
+        with self.get_lock(timeout=lock_timeout, mode='rb+') as lock_file:
+            call_stats = metrics.current_call_stats.get()
+            if call_stats is not None:
+                call_stats.lock_wait_time += time.perf_counter() - lock_start
+
+            if self._strategy.is_empty(lock_file):
+                raise FileEmptyException
+
+            with self._strategy.get_data(lock_file) as data, restore_torch_load():
+                value = self._loads(data)
+                del data
+
+        logging.debug('IPC payload %s\treceive value: %s', self._name, value)
+        return value
+
+    @staticmethod
+    def _loads(data) -> Any:
+        call_stats = metrics.current_call_stats.get()
+        if call_stats is None:
+            return serialization.loads(data)
+
+        serialization_start = time.perf_counter()
+        value = serialization.loads(data)
+        call_stats.serialization_time += time.perf_counter() - serialization_start
+        call_stats.serialized_bytes_received += len(data)
+        return value
+
 
 class FileEmptyException(Exception):
     pass
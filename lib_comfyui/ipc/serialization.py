@@ -0,0 +1,109 @@
+import io
+import math
+import os
+import pickle
+import sys
+import uuid
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+from lib_comfyui.ipc.strategies import BytesLike, get_available_shared_memory_size
+
+
+# cpu tensors smaller than this are pickled inline with the rest of the payload
+shared_tensor_min_bytes = 64 * 1024
+
+
+def get_shared_tensor_directory() -> Optional[Path]:
+    # only tmpfs keeps the tensors in memory. elsewhere (windows, macos), tensors are pickled inline
+    directory = '/dev/shm'
+    if os.path.isdir(directory) and os.access(directory, os.W_OK):
+        return Path(directory)
+
+    return None
+
+
+shared_tensor_directory = get_shared_tensor_directory()
+
+
+class IpcPickler(pickle.Pickler):
+    """
+    Pickler that moves large cpu tensors to their own shared file instead of copying them into the payload
+    The receiver maps the file as the storage of the unpickled tensor and unlinks it right away,
+    so that the memory is released as soon as the receiver drops the tensor
+    """
+
+    def __init__(self, file, segment_prefix: Optional[str]):
+        super().__init__(file)
+        self.segment_prefix = segment_prefix
+        self.segment_paths = []
+
+    def reducer_override(self, obj):
+        # torch may still be importing in another thread, the tensor type is there before any tensor can be created
+        torch = sys.modules.get('torch', None)
+        if (
+            self.segment_prefix is None or
+            shared_tensor_directory is None or
+            type(obj) is not getattr(torch, 'Tensor', None)
+        ):
+            return NotImplemented
+
+        nbytes = obj.numel() * obj.element_size()
+        if (
+            nbytes < shared_tensor_min_bytes or
+            obj.device.type != 'cpu' or
+            obj.layout != torch.strided or
+            obj.requires_grad or
+            # writing past the end of a full tmpfs kills the process with SIGBUS
+            nbytes > get_available_shared_memory_size()
+        ):
+            return NotImplemented
+
+        path = str(shared_tensor_directory / f'{self.segment_prefix}_{uuid.uuid4().hex}')
+        segment = torch.from_file(path, shared=True, size=nbytes, dtype=torch.uint8)
+        self.segment_paths.append(path)
+        segment.view(obj.dtype).view(obj.shape).copy_(obj)
+        return rebuild_shared_tensor, (path, obj.dtype, tuple(obj.shape))
+
+
+def rebuild_shared_tensor(path: str, dtype, shape: tuple):
+    import torch
+    nbytes = math.prod(shape) * torch.empty((), dtype=dtype).element_size()
+    segment = torch.from_file(path, shared=True, size=nbytes, dtype=torch.uint8)
+    # the mapping stays valid after unlinking the file
+    os.unlink(path)
+    return segment.view(dtype).view(shape)
+
+
+def dumps(value: Any, segment_prefix: Optional[str] = None) -> Tuple[bytes, List[str]]:
+    """
+    Serialize value, moving large cpu tensors to shared files named after segment_prefix
+    Returns the serialized value and the paths of the created shared files
+    """
+    file = io.BytesIO()
+    pickler = IpcPickler(file, segment_prefix)
+    try:
+        pickler.dump(value)
+    except BaseException:
+        unlink_segments(pickler.segment_paths)
+        raise
+
+    return file.getvalue(), pickler.segment_paths
+
+
+def loads(data: BytesLike) -> Any:
+    return pickle.loads(data)
+
+
+def unlink_segments(segment_paths: List[str]) -> None:
+    for path in segment_paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear_segments(segment_prefix: str) -> None:
+    if shared_tensor_directory is None:
+        return
+
+    unlink_segments([str(path) for path in shared_tensor_directory.glob(f'{segment_prefix}_*')])
@@ -0,0 +1,109 @@
+import math
+import os
+import threading
+import uuid
+from typing import Any, Dict, List
+from lib_comfyui.ipc.strategies import get_available_shared_memory_size
+from lib_comfyui.ipc.serialization import shared_tensor_directory, shared_tensor_min_bytes, unlink_segments, clear_segments
+
+
+segment_prefix = 'sd_webui_comfyui_published'
+
+
+class SharedTensorHandle:
+    """
+    Reference to a tensor published in a shared file. Pickling the handle does not copy the tensor
+    """
+    __slots__ = ('path', 'dtype', 'shape')
+
+    def __init__(self, path: str, dtype, shape: tuple):
+        self.path = path
+        self.dtype = dtype
+        self.shape = shape
+
+    def resolve(self):
+        import torch
+        nbytes = math.prod(self.shape) * torch.empty((), dtype=self.dtype).element_size()
+        # private mapping: nodes that modify their inputs in place get their own copy of the modified pages
+        segment = torch.from_file(self.path, shared=False, size=nbytes, dtype=torch.uint8)
+        return segment.view(self.dtype).view(self.shape)
+
+
+published_segments: Dict[str, List[str]] = {}
+published_segments_lock = threading.Lock()
+
+
+def publish(run_id: str, value: Any) -> Any:
+    """
+    Copy the large cpu tensors of value to shared files owned by the run, once
+    Returns value with these tensors replaced by handles. Other tensors are left as is
+    """
+    with published_segments_lock:
+        segment_paths = published_segments.setdefault(run_id, [])
+
+    try:
+        return map_tensors(value, lambda tensor: publish_tensor(run_id, tensor, segment_paths))
+    except BaseException:
+        release(run_id)
+        raise
+
+
+def publish_tensor(run_id: str, tensor, segment_paths: List[str]):
+    import torch
+    nbytes = tensor.numel() * tensor.element_size()
+    if (
+        shared_tensor_directory is None or
+        nbytes < shared_tensor_min_bytes or
+        tensor.device.type != 'cpu' or
+        tensor.layout != torch.strided or
+        tensor.requires_grad or
+        # writing past the end of a full tmpfs kills the process with SIGBUS
+        nbytes > get_available_shared_memory_size()
+    ):
+        return tensor
+
+    path = str(shared_tensor_directory / f'{segment_prefix}_{run_id}_{uuid.uuid4().hex}')
+    segment = torch.from_file(path, shared=True, size=nbytes, dtype=torch.uint8)
+    segment_paths.append(path)
+    segment.view(tensor.dtype).view(tensor.shape).copy_(tensor)
+    return SharedTensorHandle(path, tensor.dtype, tuple(tensor.shape))
+
+
+def resolve(value: Any) -> Any:
+    """
+    Replace the handles of value with tensors mapping the published files, without copying them
+    """
+    return map_values(value, lambda v: v.resolve() if isinstance(v, SharedTensorHandle) else v)
+
+
+def release(run_id: str) -> None:
+    """
+    Unlink the files published by the run. Tensors still mapping them stay valid until they are freed
+    """
+    with published_segments_lock:
+        segment_paths = published_segments.pop(run_id, [])
+
+    unlink_segments(segment_paths)
+
+
+def release_all() -> None:
+    with published_segments_lock:
+        published_segments.clear()
+
+    clear_segments(segment_prefix)
+
+
+def map_tensors(value: Any, function) -> Any:
+    import torch
+    return map_values(value, lambda v: function(v) if isinstance(v, torch.Tensor) else v)
+
+
+def map_values(value: Any, function) -> Any:
+    if type(value) is tuple:
+        return tuple(map_values(v, function) for v in value)
+    if type(value) is list:
+        return [map_values(v, function) for v in value]
+    if type(value) is dict:
+        return {k: map_values(v, function) for k, v in value.items()}
+
+    return function(value)
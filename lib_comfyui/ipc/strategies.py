@@ -1,11 +1,22 @@
+import asyncio
+import atexit
 import contextlib
-import dataclasses
+import hashlib
+import math
+import mmap
 import os
-import pickle
 import platform
+import select
+import socket
+import stat
+import struct
+import tempfile
+import time
+import uuid
 from abc import ABC, abstractmethod
+from multiprocessing import resource_tracker
 from multiprocessing.shared_memory import SharedMemory
-from typing import IO, Union
+from typing import IO, Optional, Union
 
 
 BytesLike = Union[bytes, bytearray, memoryview]
@@ -14,7 +25,12 @@ BytesLike = Union[bytes, bytearray, memoryview]
 __all__ = [
     'FileSystemIpcStrategy',
     'SharedMemoryIpcStrategy',
+    'MemoryMappedFileIpcStrategy',
     'OsFriendlyIpcStrategy',
+    'UnixSocketIpcStrategy',
+    'PollingIpcDoorbell',
+    'FifoIpcDoorbell',
+    'OsFriendlyIpcDoorbell',
 ]
 
 
@@ -60,72 +76,679 @@ class FileSystemIpcStrategy(IpcStrategy):
 
 
 class SharedMemoryIpcStrategy(IpcStrategy):
+    """
+    Keeps one shared memory segment per payload, reused across messages and grown geometrically when a message does not fit
+    The segment starts with a fixed size header. The lock file only holds the id of the current segment
+    When shared memory is too small to hold a message (e.g. docker limits /dev/shm to 64MB), the message is written to the lock file instead
+    """
+
+    initial_capacity = 1024 * 1024
+    locator = struct.Struct('<Q')
+    header = struct.Struct('<BQ')
+    header_size = 16
+
+    STATE_EMPTY = 0
+    STATE_IN_SEGMENT = 1
+    STATE_IN_LOCK_FILE = 2
+
     def __init__(self, shm_name: str):
         self._shm_name = shm_name
+        # segment names must stay short, macos limits them to 31 characters
+        self._segment_name_prefix = f'sdwc_{hashlib.blake2b(shm_name.encode(), digest_size=4).hexdigest()}'
         self._shm = None
+        self._shm_id = 0
+        self._is_owner = False
+
+    def is_empty(self, lock_file: IO) -> bool:
+        shm = self._attach(lock_file)
+        return shm is None or self._get_header(shm)[0] == self.STATE_EMPTY
+
+    def set_data(self, lock_file: IO, data: BytesLike):
+        data_len = len(data)
+        shm = self._reserve(data_len)
+        lock_file.seek(0)
+        lock_file.write(self.locator.pack(self._shm_id))
+        if shm.size >= self.header_size + data_len:
+            shm.buf[self.header_size:self.header_size + data_len] = data
+            lock_file.truncate(self.locator.size)
+            self._set_header(shm, self.STATE_IN_SEGMENT, data_len)
+        else:
+            lock_file.write(data)
+            lock_file.truncate(self.locator.size + data_len)
+            self._set_header(shm, self.STATE_IN_LOCK_FILE, data_len)
+
+    @contextlib.contextmanager
+    def get_data(self, lock_file: IO) -> BytesLike:
+        shm = self._attach(lock_file)
+        assert shm is not None, f'shared memory segment not found for IPC payload {self._shm_name}'
+        state, size = self._get_header(shm)
+        assert state != self.STATE_EMPTY, f'data not found for shared memory IPC payload {self._shm_name}'
 
-    @dataclasses.dataclass
-    class Metadata:
-        is_empty: bool
-        size: int
+        if state == self.STATE_IN_SEGMENT:
+            data = shm.buf[self.header_size:self.header_size + size]
+            try:
+                yield data
+            finally:
+                data.release()
+        else:
+            lock_file.seek(self.locator.size)
+            yield lock_file.read(size)
 
-    def _get_metadata(self, lock_file: IO) -> Metadata:
-        file_size = lock_file.seek(0, os.SEEK_END)
-        if file_size == 0:
-            return self.Metadata(is_empty=True, size=0)
+        self.clear(lock_file)
+
+    def clear(self, lock_file: IO):
+        shm = self._attach(lock_file)
+        if shm is not None:
+            self._set_header(shm, self.STATE_EMPTY, 0)
+
+        lock_file.truncate(self.locator.size if shm is not None else 0)
+
+    def _attach(self, lock_file: IO):
+        if self._is_owner:
+            return self._shm
 
         lock_file.seek(0)
+        serialized_locator = lock_file.read(self.locator.size)
+        if len(serialized_locator) < self.locator.size:
+            return None
+
+        shm_id, = self.locator.unpack(serialized_locator)
+        if shm_id == self._shm_id:
+            return self._shm
+
+        self._close_shm()
         try:
-            return pickle.loads(lock_file.read())
-        except (ModuleNotFoundError, AttributeError):
-            return self.Metadata(is_empty=True, size=0)
+            self._shm = attach_untracked_shared_memory(self._get_segment_name(shm_id))
+        except FileNotFoundError:
+            return None
 
-    def _set_metadata(self, lock_file: IO, metadata: Metadata):
-        lock_file.seek(0)
-        serialized = pickle.dumps(metadata)
-        lock_file.write(serialized)
-        lock_file.truncate(len(serialized))
+        self._shm_id = shm_id
+        return self._shm
+
+    def _reserve(self, data_len: int) -> SharedMemory:
+        required_size = self.header_size + data_len
+        if self._is_owner and self._shm.size >= required_size:
+            return self._shm
+
+        current_capacity = self._shm.size if self._is_owner else 0
+        available_size = get_available_shared_memory_size()
+        capacity = max(required_size, 2 * current_capacity, self.initial_capacity)
+        if capacity > available_size:
+            capacity = required_size if required_size <= available_size else self.header_size
+
+        if self._is_owner and capacity <= current_capacity:
+            return self._shm
+
+        self._close_shm(unlink=True)
+        shm_id = uuid.uuid4().int & 0xffff_ffff_ffff_ffff
+        self._shm = SharedMemory(name=self._get_segment_name(shm_id), create=True, size=capacity)
+        self._shm_id = shm_id
+        self._is_owner = True
+        return self._shm
+
+    def _get_segment_name(self, shm_id: int) -> str:
+        return f'{self._segment_name_prefix}_{shm_id:016x}'
+
+    def _get_header(self, shm: SharedMemory):
+        return self.header.unpack_from(shm.buf, 0)
+
+    def _set_header(self, shm: SharedMemory, state: int, size: int):
+        self.header.pack_into(shm.buf, 0, state, size)
+
+    def _close_shm(self, unlink: bool = False):
+        if self._shm is None:
+            return
+
+        self._shm.close()
+        if unlink and self._is_owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+        self._shm = None
+        self._shm_id = 0
+        self._is_owner = False
+
+    def __del__(self):
+        self._close_shm(unlink=True)
+
+
+def attach_untracked_shared_memory(name: str) -> SharedMemory:
+    # only the process that created the segment should unlink it when it exits
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13
+        shm = SharedMemory(name=name)
+        if os.name != 'nt':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+        return shm
+
+
+def get_available_shared_memory_size() -> float:
+    return get_available_size('/dev/shm')
+
+
+class MemoryMappedFileIpcStrategy(IpcStrategy):
+    """
+    Keeps one memory-mapped file per payload, on tmpfs when available, reused across messages and grown geometrically when a message does not fit
+    The file is preallocated and starts with a fixed size header. The receiver reads messages through a memoryview of the mapping
+    Growing the file creates a new one, so that a mapping is never truncated under the feet of the other process
+    When tmpfs is too small to hold a message, the message is written to the lock file instead
+    """
+
+    initial_capacity = 1024 * 1024
+    header = struct.Struct('<BQ')
+    header_size = 16
+
+    STATE_EMPTY = 0
+    STATE_IN_FILE = 1
+    STATE_IN_LOCK_FILE = 2
+
+    def __init__(self, name: str, directory: str = None):
+        directory = get_memory_mapped_file_directory() if directory is None else directory
+        self._path = os.path.join(directory, f'{name}.mmap')
+        self._mapping = None
+        self._mapping_inode = None
+        self._is_owner = False
 
     def is_empty(self, lock_file: IO) -> bool:
-        return self._get_metadata(lock_file).is_empty
+        mapping = self._attach()
+        return mapping is None or self._get_header(mapping)[0] == self.STATE_EMPTY
 
     def set_data(self, lock_file: IO, data: BytesLike):
-        metadata = self._get_metadata(lock_file)
-        assert metadata.is_empty, f'data of shared memory IPC payload {self._shm_name} has not yet been read'
-
         data_len = len(data)
-        self._clear_shm()
-        self._shm = SharedMemory(name=self._shm_name, create=True, size=data_len)
-        self._shm.buf[:data_len] = data
-        self._set_metadata(lock_file, self.Metadata(is_empty=False, size=data_len))
+        mapping = self._reserve(data_len)
+        if len(mapping) >= self.header_size + data_len:
+            mapping[self.header_size:self.header_size + data_len] = data
+            lock_file.truncate(0)
+            self._set_header(mapping, self.STATE_IN_FILE, data_len)
+        else:
+            lock_file.seek(0)
+            lock_file.write(data)
+            lock_file.truncate(data_len)
+            self._set_header(mapping, self.STATE_IN_LOCK_FILE, data_len)
 
     @contextlib.contextmanager
     def get_data(self, lock_file: IO) -> BytesLike:
-        metadata = self._get_metadata(lock_file)
-        assert not metadata.is_empty, f'metadata not found for shared memory IPC payload {self._shm_name}'
+        mapping = self._attach()
+        assert mapping is not None, f'memory-mapped file not found for IPC payload {self._path}'
+        state, size = self._get_header(mapping)
+        assert state != self.STATE_EMPTY, f'data not found for memory-mapped IPC payload {self._path}'
+
+        if state == self.STATE_IN_FILE:
+            # the value must not reference the view after unpickling, it is overwritten by the next message
+            data = memoryview(mapping)[self.header_size:self.header_size + size]
+            try:
+                yield data
+            finally:
+                data.release()
+        else:
+            lock_file.seek(0)
+            yield lock_file.read(size)
 
-        shm = SharedMemory(name=self._shm_name)
-        yield shm.buf[:metadata.size]
-        shm.close()
-        shm.unlink()
         self.clear(lock_file)
 
     def clear(self, lock_file: IO):
-        self._set_metadata(lock_file, self.Metadata(is_empty=True, size=0))
+        mapping = self._attach()
+        if mapping is not None:
+            self._set_header(mapping, self.STATE_EMPTY, 0)
 
-    def _clear_shm(self):
+        lock_file.truncate(0)
+
+    def _attach(self) -> Optional[mmap.mmap]:
         try:
-            if self._shm is None:
-                self._shm = SharedMemory(name=self._shm_name)
-            self._shm.close()
-            self._shm.unlink()
+            stat_result = os.stat(self._path)
+        except FileNotFoundError:
+            # the sender unlinks the file when it exits, the last message it sent can still be read from the mapping
+            return self._mapping
+
+        if self._mapping is not None and stat_result.st_ino == self._mapping_inode:
+            return self._mapping
+
+        self._close_mapping()
+        if stat_result.st_size < self.header_size:
+            return None
+
+        with open(self._path, 'r+b') as f:
+            self._mapping = mmap.mmap(f.fileno(), 0)
+        self._mapping_inode = stat_result.st_ino
+        return self._mapping
+
+    def _reserve(self, data_len: int) -> mmap.mmap:
+        required_size = self.header_size + data_len
+        current_capacity = len(self._mapping) if self._is_owner else 0
+        if self._is_owner and current_capacity >= required_size:
+            return self._mapping
+
+        available_size = get_available_size(os.path.dirname(self._path))
+        capacity = max(required_size, 2 * current_capacity, self.initial_capacity)
+        if capacity > available_size:
+            capacity = required_size if required_size <= available_size else self.header_size
+
+        if self._is_owner and capacity <= current_capacity:
+            return self._mapping
+
+        self._close_mapping(unlink=True)
+        try:
+            os.unlink(self._path)
         except FileNotFoundError:
             pass
 
-        self._shm = None
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            try:
+                # reserve the pages now. writing past the end of a full tmpfs mapping kills the process with SIGBUS
+                allocate_file(fd, capacity)
+            except OSError:
+                capacity = self.header_size
+                allocate_file(fd, capacity)
+
+            self._mapping = mmap.mmap(fd, capacity)
+            self._mapping_inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+
+        self._is_owner = True
+        return self._mapping
+
+    def _get_header(self, mapping: mmap.mmap):
+        return self.header.unpack_from(mapping, 0)
+
+    def _set_header(self, mapping: mmap.mmap, state: int, size: int):
+        self.header.pack_into(mapping, 0, state, size)
+
+    def _close_mapping(self, unlink: bool = False):
+        if self._mapping is None:
+            return
+
+        self._mapping.close()
+        if unlink and self._is_owner:
+            try:
+                if os.stat(self._path).st_ino == self._mapping_inode:
+                    os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+        self._mapping = None
+        self._mapping_inode = None
+        self._is_owner = False
+
+    def __del__(self):
+        self._close_mapping(unlink=True)
+
+
+def get_memory_mapped_file_directory() -> str:
+    directory = '/dev/shm'
+    if os.path.isdir(directory) and os.access(directory, os.W_OK):
+        return directory
+
+    return tempfile.gettempdir()
+
+
+def allocate_file(fd: int, size: int):
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
+
+
+def get_available_size(directory: str) -> float:
+    try:
+        stats = os.statvfs(directory)
+    except (AttributeError, OSError):
+        return math.inf
+
+    return stats.f_bavail * stats.f_frsize
+
+
+class StreamIpcStrategy(ABC):
+    """
+    Strategy that owns its transport and queues messages instead of overwriting them
+    Payloads using a stream strategy do not use the lock file nor the doorbell
+    """
+
+    @abstractmethod
+    def send(self, data: BytesLike) -> None:
+        pass
+
+    @abstractmethod
+    @contextlib.contextmanager
+    def recv(self, timeout: float) -> BytesLike:
+        pass
+
+    @abstractmethod
+    async def recv_async(self, timeout: float) -> BytesLike:
+        pass
+
+    @abstractmethod
+    def clear(self, lock_file: IO) -> None:
+        pass
+
+
+class UnixSocketIpcStrategy(StreamIpcStrategy):
+    """
+    Keeps one long-lived unix domain socket connection per payload
+    The receiving side listens on a socket file in the temp directory, the sending side connects to it
+    Messages are framed with their size
+    The receiving side reads without blocking and keeps partially received frames across calls,
+    so that an interrupted receive never splits a frame
+    """
+
+    frame_header = struct.Struct('<Q')
+    connect_interval = 0.01
+
+    def __init__(self, name: str, socket_directory: str = None, connect_timeout: float = 30.):
+        socket_directory = tempfile.gettempdir() if socket_directory is None else socket_directory
+        self._socket_path = os.path.join(socket_directory, f'{name}.sock')
+        self._connect_timeout = connect_timeout
+        self._listener = None
+        self._connection = None
+        self._frame_header_buffer = bytearray(self.frame_header.size)
+        self._frame_buffer = None
+        self._frame_received = 0
+
+    def send(self, data: BytesLike):
+        header = self.frame_header.pack(len(data))
+        for attempt in range(2):
+            connection = self._connect()
+            try:
+                connection.sendall(header)
+                connection.sendall(data)
+                return
+            except (BrokenPipeError, ConnectionResetError):
+                # the receiver was restarted, reconnect and try again once
+                self._close_connection()
+                if attempt > 0:
+                    raise
+
+    @contextlib.contextmanager
+    def recv(self, timeout: float) -> BytesLike:
+        end_time = time.time() + timeout
+        self._listen()
+
+        while True:
+            data = self._poll_frame()
+            if data is not None:
+                yield data
+                return
+
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                raise TimeoutError
+
+            select.select(self._get_waitables(), [], [], remaining if remaining < math.inf else None)
+
+    async def recv_async(self, timeout: float) -> BytesLike:
+        end_time = time.time() + timeout
+        self._listen()
+        loop = asyncio.get_running_loop()
+
+        while True:
+            data = self._poll_frame()
+            if data is not None:
+                return data
+
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                raise TimeoutError
+
+            ready = loop.create_future()
+            waitables = self._get_waitables()
+            for waitable in waitables:
+                loop.add_reader(waitable, lambda: ready.done() or ready.set_result(None))
+            try:
+                await asyncio.wait([ready], timeout=remaining if remaining < math.inf else None)
+            finally:
+                for waitable in waitables:
+                    loop.remove_reader(waitable)
+                ready.cancel()
+
+    def clear(self, lock_file: IO):
+        pass
+
+    def _connect(self) -> socket.socket:
+        end_time = time.time() + self._connect_timeout
+        while self._connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self._socket_path)
+                self._connection = connection
+            except (FileNotFoundError, ConnectionRefusedError):
+                # the receiver is not listening yet, or it is gone
+                connection.close()
+                if time.time() >= end_time:
+                    raise TimeoutError(f'Could not connect to {self._socket_path} within {self._connect_timeout} seconds')
+
+                time.sleep(self.connect_interval)
+
+        return self._connection
+
+    def _listen(self):
+        if self._listener is not None:
+            return
+
+        try:
+            os.unlink(self._socket_path)
+        except FileNotFoundError:
+            pass
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._socket_path)
+        self._listener.listen()
+
+    def _get_waitables(self):
+        return [self._listener] if self._connection is None else [self._connection, self._listener]
+
+    def _poll_frame(self) -> Optional[bytearray]:
+        if self._connection is not None:
+            data = self._read_frame()
+            if data is not None:
+                return data
+
+        ready, _, _ = select.select([self._listener], [], [], 0)
+        if not ready:
+            return None
+
+        # a new connection replaces the previous one, i.e. the sender was restarted
+        self._close_connection()
+        self._connection, _ = self._listener.accept()
+        self._connection.setblocking(False)
+        return self._read_frame()
+
+    def _read_frame(self) -> Optional[bytearray]:
+        while True:
+            buffer = self._frame_header_buffer if self._frame_buffer is None else self._frame_buffer
+            if self._frame_received == len(buffer):
+                if self._frame_buffer is None:
+                    size, = self.frame_header.unpack(self._frame_header_buffer)
+                    self._frame_buffer, self._frame_received = bytearray(size), 0
+                    continue
+
+                frame, self._frame_buffer, self._frame_received = self._frame_buffer, None, 0
+                return frame
+
+            try:
+                received = self._connection.recv_into(memoryview(buffer)[self._frame_received:])
+            except BlockingIOError:
+                return None
+
+            if received == 0:
+                # the sender closed the connection
+                self._close_connection()
+                return None
+
+            self._frame_received += received
+
+    def _close_connection(self):
+        if self._connection is None:
+            return
+
+        self._connection.close()
+        self._connection = None
+        self._frame_buffer, self._frame_received = None, 0
+
+    def __del__(self):
+        self._close_connection()
+        if self._listener is not None:
+            self._listener.close()
+            try:
+                os.unlink(self._socket_path)
+            except FileNotFoundError:
+                pass
+
+
+class IpcDoorbell(ABC):
+    @abstractmethod
+    def ring(self) -> None:
+        pass
+
+    @abstractmethod
+    def listen(self) -> None:
+        pass
+
+    @abstractmethod
+    def wait(self, timeout: float) -> None:
+        pass
+
+    async def wait_async(self, timeout: float) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.wait, timeout)
+
+    def close(self) -> None:
+        pass
+
+    def unlink(self) -> None:
+        pass
+
+
+class PollingIpcDoorbell(IpcDoorbell):
+    def __init__(self, _path: str, check_interval: float = 0.02):
+        self._check_interval = check_interval
+
+    def ring(self):
+        pass
+
+    def listen(self):
+        pass
+
+    def wait(self, timeout: float):
+        time.sleep(min(timeout, self._check_interval))
+
+    async def wait_async(self, timeout: float):
+        await asyncio.sleep(min(timeout, self._check_interval))
+
+
+class FifoIpcDoorbell(IpcDoorbell):
+    # upper bound on a single wait, in case a ring is lost (e.g. the fifo was removed by a tmp cleaner)
+    max_wait = 1.0
+
+    def __init__(self, path: str):
+        self._path = path
+        self._read_fd = None
+
+    def ring(self):
+        try:
+            fd = os.open(self._path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            # nobody is listening yet. the receiver checks for data before waiting anyway
+            return
+
+        try:
+            os.write(fd, b'\0')
+        except BlockingIOError:
+            # the fifo is full of pending rings, the receiver is going to wake up regardless
+            pass
+        finally:
+            os.close(fd)
+
+    def listen(self):
+        if self._read_fd is not None:
+            return
+
+        try:
+            if not stat.S_ISFIFO(os.stat(self._path).st_mode):
+                os.unlink(self._path)
+                os.mkfifo(self._path)
+        except FileNotFoundError:
+            try:
+                os.mkfifo(self._path)
+            except FileExistsError:
+                pass
+
+        created_fifo_paths.add(self._path)
+        # opening read-write keeps a writer on the fifo, so that select() never reports EOF
+        self._read_fd = os.open(self._path, os.O_RDWR | os.O_NONBLOCK)
+
+    def wait(self, timeout: float):
+        self.listen()
+        ready, _, _ = select.select([self._read_fd], [], [], min(timeout, self.max_wait))
+        if ready:
+            self._drain()
+
+    async def wait_async(self, timeout: float):
+        self.listen()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self._read_fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait([ready], timeout=min(timeout, self.max_wait))
+        finally:
+            loop.remove_reader(self._read_fd)
+            ready.cancel()
+
+        self._drain()
+
+    def _drain(self):
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self._read_fd is None:
+            return
+
+        os.close(self._read_fd)
+        self._read_fd = None
+
+    def unlink(self):
+        created_fifo_paths.discard(self._path)
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+# fifos listened to by this process. the receivers that did not get to unlink theirs are cleaned up on exit
+created_fifo_paths = set()
+
+
+def unlink_created_fifos():
+    for path in list(created_fifo_paths):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    created_fifo_paths.clear()
+
+
+atexit.register(unlink_created_fifos)
 
 
 if platform.system().lower() == 'linux':
     OsFriendlyIpcStrategy = FileSystemIpcStrategy
 else:
     OsFriendlyIpcStrategy = SharedMemoryIpcStrategy
+
+
+if hasattr(os, 'mkfifo'):
+    OsFriendlyIpcDoorbell = FifoIpcDoorbell
+else:
+    OsFriendlyIpcDoorbell = PollingIpcDoorbell
@@ -3,7 +3,7 @@ import operator
 from typing import Tuple
 
 import gradio as gr
-from lib_comfyui import external_code, global_state
+from lib_comfyui import external_code, global_state, ipc
 from lib_comfyui.webui import gradio_utils, settings
 from lib_comfyui.comfyui import iframe_requests
 
@@ -222,9 +222,7 @@ class AccordionInterface:
         if not serialized_graphs:
             return (gr.skip(),) * 3
 
-        if not hasattr(global_state, 'enabled_workflow_type_ids'):
-            global_state.enabled_workflow_type_ids = {}
-
+        enabled_workflow_type_ids = dict(getattr(global_state, 'enabled_workflow_type_ids', {}))
         serialized_graphs = json.loads(serialized_graphs)
         workflow_graphs = {
             workflow_type.get_ids(self.tab)[0]: (
@@ -235,12 +233,20 @@ class AccordionInterface:
         }
 
         new_enabled_display_names = []
-        for workflow_type_id, (graph, workflow_type) in workflow_graphs.items():
-            is_custom_workflow = workflow_type.base_id in serialized_graphs
-            global_state.enabled_workflow_type_ids[workflow_type_id] = is_custom_workflow
-            if is_custom_workflow:
-                new_enabled_display_names.append(workflow_type.display_name)
-            iframe_requests.set_workflow_graph(graph, workflow_type_id)
+        set_workflow_graph_results = []
+        with ipc.batch():
+            for workflow_type_id, (graph, workflow_type) in workflow_graphs.items():
+                is_custom_workflow = workflow_type.base_id in serialized_graphs
+                enabled_workflow_type_ids[workflow_type_id] = is_custom_workflow
+                if is_custom_workflow:
+                    new_enabled_display_names.append(workflow_type.display_name)
+                set_workflow_graph_results.append(iframe_requests.set_workflow_graph(graph, workflow_type_id))
+
+            # assigned instead of updated in place, so that the comfyui replica is invalidated
+            global_state.enabled_workflow_type_ids = enabled_workflow_type_ids
+
+        for set_workflow_graph_result in set_workflow_graph_results:
+            set_workflow_graph_result.result()
 
         return (
             gr.update(value=''),
@@ -13,6 +13,7 @@ def register_callbacks():
     script_callbacks.on_app_started(on_app_started)
     script_callbacks.on_script_unloaded(on_script_unloaded)
     script_callbacks.on_before_image_saved(on_before_image_saved)
+    script_callbacks.on_model_loaded(on_model_loaded)
 
 
 @ipc.restrict_to_process('webui')
@@ -35,6 +36,7 @@ def on_after_component(*args, **kwargs):
 def on_app_started(_gr_root, fast_api):
     comfyui_process.start()
     reverse_proxy.create_comfyui_proxy(fast_api)
+    fast_api.add_api_route("/sd-webui-comfyui/ipc_metrics", ipc.metrics.get_snapshot, methods=["GET"])
 
 
 @ipc.restrict_to_process('webui')
@@ -65,3 +67,8 @@ def on_before_image_saved(params):
     )
 
     params.image = type_conversion.comfyui_image_to_webui(results[0], return_tensors=False)[0]
+
+
+@ipc.restrict_to_process('webui')
+def on_model_loaded(_sd_model):
+    global_state.sd_model_generation += 1
@@ -0,0 +1,111 @@
+import gc
+import threading
+import time
+from typing import Callable, Optional
+import psutil
+import torch
+from lib_comfyui import ipc
+
+
+def get_unused_reserved_bytes() -> int:
+    if not torch.cuda.is_available():
+        return 0
+
+    return torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+
+def get_rss_bytes() -> int:
+    return psutil.Process().memory_info().rss
+
+
+class MemoryReclaimer:
+    """
+    Collects garbage and empties the torch allocator cache only when one of the thresholds is crossed
+    A threshold of 0 is disabled
+    """
+    def __init__(
+        self,
+        max_unused_reserved_bytes: int = 0,
+        max_rss_growth_bytes: int = 0,
+        max_calls: int = 0,
+        max_seconds: float = 0,
+        get_unused_reserved_bytes: Callable[[], int] = get_unused_reserved_bytes,
+        get_rss_bytes: Callable[[], int] = get_rss_bytes,
+    ):
+        self.max_unused_reserved_bytes = max_unused_reserved_bytes
+        self.max_rss_growth_bytes = max_rss_growth_bytes
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self._get_unused_reserved_bytes = get_unused_reserved_bytes
+        self._get_rss_bytes = get_rss_bytes
+        self._lock = threading.Lock()
+        self._calls_since_reclaim = 0
+        self._last_reclaim_time = time.monotonic()
+        self._rss_after_reclaim: Optional[int] = None
+        self._checks = 0
+        self._reclaims = {}
+        self._reclaim_time = 0.
+
+    def after_call(self) -> Optional[str]:
+        """
+        Reclaim memory if a threshold is crossed
+        Returns the name of the crossed threshold, if any
+        """
+        with self._lock:
+            self._checks += 1
+            self._calls_since_reclaim += 1
+            reason = self._get_reclaim_reason()
+            if reason is not None:
+                self._reclaim(reason)
+
+            return reason
+
+    def _get_reclaim_reason(self) -> Optional[str]:
+        if self.max_calls > 0 and self._calls_since_reclaim >= self.max_calls:
+            return 'calls'
+
+        if self.max_seconds > 0 and time.monotonic() - self._last_reclaim_time >= self.max_seconds:
+            return 'seconds'
+
+        if self.max_unused_reserved_bytes > 0 and self._get_unused_reserved_bytes() >= self.max_unused_reserved_bytes:
+            return 'unused_reserved_bytes'
+
+        if self.max_rss_growth_bytes > 0:
+            rss = self._get_rss_bytes()
+            if self._rss_after_reclaim is None:
+                self._rss_after_reclaim = rss
+            elif rss - self._rss_after_reclaim >= self.max_rss_growth_bytes:
+                return 'rss_growth_bytes'
+
+        return None
+
+    def _reclaim(self, reason: str):
+        start = time.perf_counter()
+        gc.collect(1)
+        torch.cuda.empty_cache()
+        self._reclaim_time += time.perf_counter() - start
+
+        self._reclaims[reason] = self._reclaims.get(reason, 0) + 1
+        self._calls_since_reclaim = 0
+        self._last_reclaim_time = time.monotonic()
+        if self.max_rss_growth_bytes > 0:
+            self._rss_after_reclaim = self._get_rss_bytes()
+
+        ipc.metrics.set_gauge('memory_reclaims', sum(self._reclaims.values()))
+        ipc.metrics.set_gauge('memory_reclaim_ms', self._reclaim_time * 1000)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'checks': self._checks,
+                'reclaims': sum(self._reclaims.values()),
+                'reclaims_by_reason': dict(self._reclaims),
+                'reclaim_ms': self._reclaim_time * 1000,
+            }
+
+
+reclaimer = MemoryReclaimer(
+    max_unused_reserved_bytes=1024 ** 3,
+    max_rss_growth_bytes=2 * 1024 ** 3,
+    max_seconds=60,
+)
@@ -67,11 +67,11 @@ def sample_img2img_hijack(p, x, *args, original_function, **kwargs):
     processed_x = external_code.run_workflow(
         workflow_type=default_workflow_types.preprocess_latent_workflow_type,
         tab='img2img',
-        batch_input=type_conversion.webui_latent_to_comfyui(x.to(device='cpu')),
+        batch_input=x.to(device='cpu'),
         identity_on_error=True,
     )
     verify_singleton(processed_x)
-    x = type_conversion.comfyui_latent_to_webui(processed_x[0]).to(device=x.device)
+    x = processed_x[0].to(device=x.device)
     return original_function(p, x, *args, **kwargs)
 
 
@@ -101,11 +101,11 @@ def p_sample_patch(*args, original_function, is_img2img, **kwargs):
     processed_x = external_code.run_workflow(
         workflow_type=default_workflow_types.postprocess_latent_workflow_type,
         tab=tab,
-        batch_input=type_conversion.webui_latent_to_comfyui(x.to(device='cpu')),
+        batch_input=x.to(device='cpu'),
         identity_on_error=True,
     )
     verify_singleton(processed_x)
-    return type_conversion.comfyui_latent_to_webui(processed_x[0]).to(device=x.device)
+    return processed_x[0].to(device=x.device)
 
 
 def p_img2img_init(*args, original_function, p_ref, **kwargs):
@@ -1,11 +1,15 @@
+import collections
+import concurrent.futures
+import copy
 import functools
-import gc
 import sys
+import threading
 import yaml
 import textwrap
 import torch
-from lib_comfyui import ipc, torch_utils
-from lib_comfyui.webui import settings
+from typing import Any, Callable, Dict, Iterable, Optional
+from lib_comfyui import ipc, torch_utils, global_state
+from lib_comfyui.webui import memory, settings
 
 
 class ModelPatcher:
@@ -64,7 +68,41 @@ class ModelPatcher:
         return functools.partial(getattr(comfy.sd.ModelPatcher, item), self)
 
 
+class AttributeCache:
+    """
+    Cache of values that depend on the checkpoint loaded in the webui, e.g. the attributes of a model proxy
+    Values are kept until the webui loads another checkpoint
+    Attributes in uncached_attributes are fetched on every access, e.g. for attributes that are mutated in place
+    """
+    def __init__(self, uncached_attributes: Iterable[str] = ()):
+        self.uncached_attributes = set(uncached_attributes)
+        self._values = {}
+        self._sd_model_generation = None
+        self._lock = threading.Lock()
+
+    def get(self, item: str, fetch: Callable[[], Any]) -> Any:
+        if item in self.uncached_attributes:
+            return fetch()
+
+        sd_model_generation = global_state.sd_model_generation
+        with self._lock:
+            if sd_model_generation != self._sd_model_generation:
+                self._values.clear()
+                self._sd_model_generation = sd_model_generation
+            elif item in self._values:
+                return self._values[item]
+
+        value = fetch()
+        with self._lock:
+            if sd_model_generation == self._sd_model_generation:
+                self._values[item] = value
+
+        return value
+
+
 class Model:
+    attribute_cache = AttributeCache()
+
     @property
     def model_config(self):
         return get_comfy_model_config()
@@ -102,16 +140,28 @@ class Model:
         args = torch_utils.deep_to(args, device='cpu')
         del kwargs['transformer_options']
         kwargs = torch_utils.deep_to(kwargs, device='cpu')
-        return torch_utils.deep_to(Model.sd_model_apply(*args, **kwargs), device=self.device)
+        fingerprints = {
+            k: torch_utils.fingerprint(kwargs[k])
+            for k in step_invariant_apply_model_kwargs
+            if isinstance(kwargs.get(k, None), torch.Tensor)
+        }
+        try:
+            res = Model.sd_model_apply(*args, **sent_conditioning.to_references(kwargs, fingerprints))
+        except ConditioningCacheMiss:
+            sent_conditioning.clear()
+            res = Model.sd_model_apply(*args, **sent_conditioning.to_references(kwargs, fingerprints))
+
+        return torch_utils.deep_to(res, device=self.device)
 
     @staticmethod
     @ipc.run_in_process('webui')
     def sd_model_apply(*args, **kwargs):
         from modules import shared, devices
+        kwargs = {k: conditioning_cache.resolve(v, shared.sd_model.device) for k, v in kwargs.items()}
         args = torch_utils.deep_to(args, shared.sd_model.device)
         kwargs = torch_utils.deep_to(kwargs, shared.sd_model.device)
         with devices.autocast(), torch.no_grad():
-            res = shared.sd_model.model(*args, **kwargs).cpu().share_memory_()
+            res = shared.sd_model.model(*args, **kwargs).cpu()
             free_webui_memory()
             return res
 
@@ -123,11 +173,14 @@ class Model:
         if item in self.__dict__:
             return self.__dict__[item]
 
-        res = Model.sd_model_getattr(item)
-        if item != "device":
-            res = torch_utils.deep_to(res, device=self.device)
+        def fetch():
+            res = Model.sd_model_getattr(item)
+            if item != "device":
+                res = torch_utils.deep_to(res, device=self.device)
 
-        return res
+            return res
+
+        return Model.attribute_cache.get(item, fetch)
 
     @staticmethod
     @ipc.run_in_process('webui')
@@ -138,6 +191,205 @@ class Model:
         return res
 
 
+# unet arguments that usually stay the same for all the steps of a sampler
+step_invariant_apply_model_kwargs = ('c_crossattn', 'c_concat', 'y')
+
+
+class CachedTensor:
+    """
+    Reference to a tensor of the webui conditioning cache
+    The tensor is only included when the webui may not have it yet
+    """
+    __slots__ = ('fingerprint', 'tensor')
+
+    def __init__(self, fingerprint: str, tensor: Optional[torch.Tensor] = None):
+        self.fingerprint = fingerprint
+        self.tensor = tensor
+
+
+class ConditioningCacheMiss(KeyError):
+    pass
+
+
+class ConditioningCache:
+    """
+    Webui side LRU cache of the step-invariant unet arguments, keyed by content fingerprint
+    Cached tensors are kept on the device of the model, hits skip both the transfer and the copy to the device
+    """
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, value, device):
+        if not isinstance(value, CachedTensor):
+            return value
+
+        with self._lock:
+            if value.tensor is not None:
+                self.misses += 1
+                tensor = value.tensor.to(device)
+                self._entries[value.fingerprint] = tensor
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                try:
+                    tensor = self._entries[value.fingerprint]
+                except KeyError:
+                    raise ConditioningCacheMiss(value.fingerprint)
+
+                self._entries.move_to_end(value.fingerprint)
+                self.hits += 1
+                tensor = tensor.to(device)
+
+        self.publish_stats()
+        return tensor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
+
+    def publish_stats(self):
+        stats = self.get_stats()
+        ipc.metrics.set_gauge('conditioning_cache_hits', stats['hits'])
+        ipc.metrics.set_gauge('conditioning_cache_misses', stats['misses'])
+
+
+class SentConditioning:
+    """
+    ComfyUI side record of the fingerprints recently sent to the webui conditioning cache
+    It evicts at the same pace as the cache. When they disagree, the webui raises ConditioningCacheMiss and the tensors are sent again
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._fingerprints = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def to_references(self, kwargs: dict, fingerprints: Dict[str, str]) -> dict:
+        kwargs = dict(kwargs)
+        with self._lock:
+            for k, fingerprint in fingerprints.items():
+                if fingerprint in self._fingerprints:
+                    self._fingerprints.move_to_end(fingerprint)
+                    kwargs[k] = CachedTensor(fingerprint)
+                else:
+                    self._fingerprints[fingerprint] = None
+                    if len(self._fingerprints) > self.max_entries:
+                        self._fingerprints.popitem(last=False)
+                    kwargs[k] = CachedTensor(fingerprint, kwargs[k])
+
+        return kwargs
+
+    def clear(self):
+        with self._lock:
+            self._fingerprints.clear()
+
+
+conditioning_cache = ConditioningCache()
+sent_conditioning = SentConditioning(conditioning_cache.max_entries)
+
+
+class TextEncoderCache:
+    """
+    Webui side LRU cache of the tokenized and encoded prompts
+    Entries are only valid for the checkpoint, clip skip, emphasis mode and textual inversion embeddings they were computed with
+    The cache is cleared when any of them changes
+    """
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._context = None
+        self._lock = threading.Lock()
+
+    def get(self, key, compute: Callable[[], Any]) -> Any:
+        context = self.get_context()
+        with self._lock:
+            if context != self._context:
+                self._entries.clear()
+                self._context = context
+
+            hit = key in self._entries
+            if hit:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = self._entries[key]
+            else:
+                self.misses += 1
+
+        self.publish_stats()
+        if hit:
+            return value
+
+        value = compute()
+        with self._lock:
+            if context == self._context:
+                self._entries[key] = value
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return value
+
+    @staticmethod
+    def get_context():
+        from modules import shared
+        return (
+            global_state.sd_model_generation,
+            shared.opts.CLIP_stop_at_last_layers,
+            getattr(shared.opts, 'emphasis', None),
+            get_embeddings_state(),
+        )
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
+
+    def publish_stats(self):
+        stats = self.get_stats()
+        ipc.metrics.set_gauge('text_encoder_cache_hits', stats['hits'])
+        ipc.metrics.set_gauge('text_encoder_cache_misses', stats['misses'])
+
+
+def get_embeddings_state() -> tuple:
+    """
+    The loaded textual inversion embeddings and the modification times of their directories
+    Loading or reloading an embedding creates a new object. Embeddings compare by identity, the state keeps them alive so that it cannot be fooled by a reused id
+    """
+    from modules import sd_hijack
+    embedding_db = getattr(sd_hijack.model_hijack, 'embedding_db', None)
+    word_embeddings = getattr(embedding_db, 'word_embeddings', {})
+    embedding_dirs = getattr(embedding_db, 'embedding_dirs', {})
+    return (
+        tuple(sorted(word_embeddings.items(), key=lambda item: item[0])),
+        tuple(sorted((str(path), getattr(embedding_dir, 'mtime', None)) for path, embedding_dir in embedding_dirs.items())),
+    )
+
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+
+    return value
+
+
+text_encoder_cache = TextEncoderCache()
+
+
 class ClipWrapper:
     def __init__(self, proxy):
         self.cond_stage_model = proxy
@@ -166,17 +418,27 @@ class ClipWrapper:
     @staticmethod
     @ipc.run_in_process('webui')
     def sd_clip_tokenize_with_weights(text, return_word_ids=False):
+        return text_encoder_cache.get(
+            ('tokenize', text, return_word_ids),
+            lambda: ClipWrapper.tokenize_with_weights(text, return_word_ids),
+        )
+
+    @staticmethod
+    def tokenize_with_weights(text, return_word_ids):
         from modules import shared
         chunks, tokens_count, *_ = shared.sd_model.cond_stage_model.tokenize_line(text)
-        weighted_tokens = [list(zip(chunk.tokens, chunk.multipliers)) for chunk in chunks]
         clip_max_len = shared.sd_model.cond_stage_model.wrapped.max_length
-        if return_word_ids:
-            padding_tokens_count = ((tokens_count // clip_max_len) + 1) * clip_max_len
-            for token_i in range(padding_tokens_count):
-                actual_id = token_i if token_i < tokens_count else 0
-                weighted_tokens[token_i // clip_max_len][token_i % clip_max_len] += (actual_id,)
-
-        return weighted_tokens
+        if not return_word_ids:
+            return [list(zip(chunk.tokens, chunk.multipliers)) for chunk in chunks]
+
+        padding_chunks_count = tokens_count // clip_max_len + 1
+        return [
+            [
+                (token, multiplier, word_id if word_id < tokens_count else 0)
+                for token, multiplier, word_id in zip(chunk.tokens, chunk.multipliers, range(chunk_index * clip_max_len, (chunk_index + 1) * clip_max_len))
+            ] if chunk_index < padding_chunks_count else list(zip(chunk.tokens, chunk.multipliers))
+            for chunk_index, chunk in enumerate(chunks)
+        ]
 
     def __getattr__(self, item):
         if item in self.__dict__:
@@ -187,6 +449,8 @@ class ClipWrapper:
 
 
 class Clip:
+    attribute_cache = AttributeCache()
+
     def clip_layer(self, layer_idx, *args, **kwargs):
         soft_raise(f'cannot control webui clip skip from comfyui. Tried to stop at layer {layer_idx}')
         return
@@ -202,20 +466,25 @@ class Clip:
     @staticmethod
     @ipc.run_in_process('webui')
     def sd_clip_encode_token_weights(token_weight_pairs_list):
+        return text_encoder_cache.get(
+            ('encode', freeze(token_weight_pairs_list)),
+            lambda: Clip.encode_with_weights(token_weight_pairs_list),
+        )
+
+    @staticmethod
+    def encode_with_weights(token_weight_pairs_list):
         from modules import shared
-        tokens = [
-            [pair[0] for pair in token_weight_pairs]
-            for token_weight_pairs in token_weight_pairs_list
-        ]
-        weights = [
-            [pair[1] for pair in token_weight_pairs]
+        # (chunks, tokens, 2). pairs can also hold the word id, it is not needed here
+        token_weight_pairs = torch.tensor([
+            [pair[:2] for pair in token_weight_pairs]
             for token_weight_pairs in token_weight_pairs_list
-        ]
-        conds = [
-            shared.sd_model.cond_stage_model.process_tokens([tokens], [weights])
-            for tokens, weights in zip(tokens, weights)
-        ]
-        return torch.hstack(conds).cpu().share_memory_(), None
+        ], dtype=torch.float64)
+        tokens = token_weight_pairs[..., 0].long()
+        multipliers = token_weight_pairs[..., 1].float()
+        with torch.no_grad():
+            z = encode_chunks(shared.sd_model.cond_stage_model, tokens, multipliers)
+
+        return z.reshape(1, -1, z.shape[-1]).cpu(), None
 
     def to(self, device):
         assert str(device) == str(self.device), textwrap.dedent(f'''
@@ -232,11 +501,14 @@ class Clip:
         if item in self.__dict__:
             return self.__dict__[item]
 
-        res = Clip.sd_clip_getattr(item)
-        if item != "device":
-            res = torch_utils.deep_to(res, device=self.device)
+        def fetch():
+            res = Clip.sd_clip_getattr(item)
+            if item != "device":
+                res = torch_utils.deep_to(res, device=self.device)
 
-        return res
+            return res
+
+        return Clip.attribute_cache.get(item, fetch)
 
     @staticmethod
     @ipc.run_in_process('webui')
@@ -247,6 +519,41 @@ class Clip:
         return res
 
 
+def encode_chunks(cond_stage_model, tokens: torch.Tensor, multipliers: torch.Tensor) -> torch.Tensor:
+    """
+    Same as calling cond_stage_model.process_tokens for each chunk of 77 tokens, with a single pass through the text encoder
+    Emphasis is still applied to each chunk on its own, like the webui does
+    """
+    from modules import shared, devices
+    batch_tokens = tokens.to(devices.device)
+    if cond_stage_model.id_end != cond_stage_model.id_pad:
+        # sd2 pads the tokens after the first end token with a different token
+        is_end = batch_tokens == cond_stage_model.id_end
+        batch_tokens = batch_tokens.masked_fill(is_end.cumsum(dim=1) - is_end.long() > 0, cond_stage_model.id_pad)
+
+    z = cond_stage_model.encode_with_transformers(batch_tokens)
+    multipliers = multipliers.to(devices.device)
+
+    try:
+        from modules import sd_emphasis
+    except ImportError:
+        original_mean = z.mean(dim=(1, 2), keepdim=True)
+        z = z * multipliers.unsqueeze(-1)
+        new_mean = z.mean(dim=(1, 2), keepdim=True)
+        return z * (original_mean / new_mean)
+
+    emphasized_chunks = []
+    for chunk_index in range(z.shape[0]):
+        emphasis = sd_emphasis.get_current_option(shared.opts.emphasis)()
+        emphasis.tokens = tokens[chunk_index:chunk_index + 1].tolist()
+        emphasis.multipliers = multipliers[chunk_index:chunk_index + 1]
+        emphasis.z = z[chunk_index:chunk_index + 1]
+        emphasis.after_transformers()
+        emphasized_chunks.append(emphasis.z)
+
+    return torch.cat(emphasized_chunks)
+
+
 class VaeWrapper:
     def __init__(self, proxy):
         self.first_stage_model = proxy
@@ -272,15 +579,16 @@ class VaeWrapper:
 
 
 class Vae:
+    attribute_cache = AttributeCache()
+    # the webui computes one chunk at a time, the next chunk is received in the meantime
+    compute_lock = threading.Lock()
+
     def state_dict(self):
         soft_raise('accessing the webui checkpoint state dict from comfyui is not yet suppported')
         return {}
 
-    def encode(self, *args, **kwargs):
-        args = torch_utils.deep_to(args, device='cpu')
-        kwargs = torch_utils.deep_to(kwargs, device='cpu')
-        res = torch_utils.deep_to(Vae.sd_vae_encode(*args, **kwargs), device=self.device)
-        return DistributionProxy(res)
+    def encode(self, pixels, *args, **kwargs):
+        return DistributionProxy(self.send_in_chunks(Vae.sd_vae_encode, 'encode', pixels, *args, **kwargs))
 
     @staticmethod
     @ipc.run_in_process('webui')
@@ -288,15 +596,13 @@ class Vae:
         from modules import shared, devices
         args = torch_utils.deep_to(args, shared.sd_model.device)
         kwargs = torch_utils.deep_to(kwargs, shared.sd_model.device)
-        with devices.autocast(), torch.no_grad():
-            res = shared.sd_model.first_stage_model.encode(*args, **kwargs).sample().cpu().share_memory_()
+        with Vae.compute_lock, devices.autocast(), torch.no_grad():
+            res = shared.sd_model.first_stage_model.encode(*args, **kwargs).sample().cpu()
             free_webui_memory()
             return res
 
-    def decode(self, *args, **kwargs):
-        args = torch_utils.deep_to(args, device='cpu')
-        kwargs = torch_utils.deep_to(kwargs, device='cpu')
-        return torch_utils.deep_to(Vae.sd_vae_decode(*args, **kwargs), device=self.device)
+    def decode(self, samples, *args, **kwargs):
+        return self.send_in_chunks(Vae.sd_vae_decode, 'decode', samples, *args, **kwargs)
 
     @staticmethod
     @ipc.run_in_process('webui')
@@ -304,11 +610,17 @@ class Vae:
         from modules import shared, devices
         args = torch_utils.deep_to(args, shared.sd_model.device)
         kwargs = torch_utils.deep_to(kwargs, shared.sd_model.device)
-        with devices.autocast(), torch.no_grad():
-            res = shared.sd_model.first_stage_model.decode(*args, **kwargs).cpu().share_memory_()
+        with Vae.compute_lock, devices.autocast(), torch.no_grad():
+            res = shared.sd_model.first_stage_model.decode(*args, **kwargs).cpu()
             free_webui_memory()
             return res
 
+    def send_in_chunks(self, function, operation, batch, *args, **kwargs):
+        chunk_size = global_state.vae_chunk_size
+        ipc.metrics.set_gauge(f'vae_{operation}_chunk_size', chunk_size)
+        ipc.metrics.set_gauge(f'vae_{operation}_chunks', len(batch) if chunk_size <= 0 else -(-len(batch) // chunk_size))
+        return call_in_chunks(function, batch, *args, chunk_size=chunk_size, device=self.device, **kwargs)
+
     def to(self, device):
         assert str(device) == str(self.device), textwrap.dedent(f'''
             cannot move the webui unet to a different device
@@ -320,11 +632,14 @@ class Vae:
         if item in self.__dict__:
             return self.__dict__[item]
 
-        res = Vae.sd_vae_getattr(item)
-        if item != "device":
-            res = torch_utils.deep_to(res, device=self.device)
+        def fetch():
+            res = Vae.sd_vae_getattr(item)
+            if item != "device":
+                res = torch_utils.deep_to(res, device=self.device)
 
-        return res
+            return res
+
+        return Vae.attribute_cache.get(item, fetch)
 
     @staticmethod
     @ipc.run_in_process('webui')
@@ -335,6 +650,42 @@ class Vae:
         return res
 
 
+# one chunk is computed by the webui while the next one is being sent
+vae_chunks_in_flight = 2
+
+
+def call_in_chunks(function: Callable, batch: torch.Tensor, *args, chunk_size: int, device, **kwargs) -> torch.Tensor:
+    """
+    Call function on micro-batches of batch and assemble the results in a tensor preallocated on device
+    chunk_size <= 0 sends the whole batch at once
+    """
+    args = torch_utils.deep_to(args, device='cpu')
+    kwargs = torch_utils.deep_to(kwargs, device='cpu')
+    if chunk_size <= 0 or len(batch) <= chunk_size:
+        return torch_utils.deep_to(function(batch.cpu(), *args, **kwargs), device=device)
+
+    def call(chunk):
+        return function(chunk.cpu(), *args, **kwargs)
+
+    res = None
+    offset = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=vae_chunks_in_flight) as executor:
+        futures = collections.deque(executor.submit(call, chunk) for chunk in batch.split(chunk_size))
+        try:
+            while futures:
+                chunk_res = futures.popleft().result()
+                if res is None:
+                    res = torch.empty((len(batch), *chunk_res.shape[1:]), dtype=chunk_res.dtype, device=device)
+
+                res[offset:offset + len(chunk_res)].copy_(chunk_res)
+                offset += len(chunk_res)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return res
+
+
 class DistributionProxy:
     def __init__(self, sample):
         self.sample_proxy = sample
@@ -345,8 +696,7 @@ class DistributionProxy:
 
 @ipc.run_in_process('webui')
 def free_webui_memory():
-    gc.collect(1)
-    torch.cuda.empty_cache()
+    memory.reclaimer.after_call()
 
 
 @ipc.restrict_to_process('comfyui')
@@ -361,8 +711,18 @@ def raise_on_unsupported_model_type(config):
 
 @ipc.restrict_to_process('comfyui')
 def get_comfy_model_config():
+    return load_comfy_model_config(comfy_model_config_cache.get('config_path', sd_model_get_config))
+
+
+def load_comfy_model_config(config_path):
+    # the comfy model config classes are mutable, each caller gets its own copy of the parsed config
+    return copy.deepcopy(parse_comfy_model_config(config_path))
+
+
+@functools.lru_cache(maxsize=8)
+def parse_comfy_model_config(config_path):
     import comfy
-    with open(sd_model_get_config()) as f:
+    with open(config_path) as f:
         config_dict = yaml.safe_load(f)
 
     unet_config = config_dict['model']['params']['unet_config']['params']
@@ -374,10 +734,19 @@ def get_comfy_model_config():
 
 @ipc.run_in_process('webui')
 def sd_model_get_config():
+    # finding the config materializes the state dict of the checkpoint
+    return sd_model_config_cache.get('config_path', find_sd_model_config)
+
+
+def find_sd_model_config():
     from modules import shared, sd_models, sd_models_config
     return sd_models_config.find_checkpoint_config(shared.sd_model.state_dict(), sd_models.select_checkpoint())
 
 
+comfy_model_config_cache = AttributeCache()
+sd_model_config_cache = AttributeCache()
+
+
 @ipc.run_in_process('webui')
 def extra_networks_parse_prompts(prompts):
     from modules import extra_networks
@@ -1,3 +1,4 @@
+import socket
 import sys
 import textwrap
 from pathlib import Path
@@ -36,6 +37,22 @@ def create_section():
     shared.opts.onchange('comfyui_graceful_termination_timeout', update_comfyui_graceful_termination_timeout)
     update_comfyui_graceful_termination_timeout()
 
+    shared.opts.add_option("comfyui_vae_chunk_size", shared.OptionInfo(
+        4, 'Number of images sent at once when ComfyUI uses the webui VAE. The next chunk is sent while the webui computes the previous one (0 to send the whole batch at once)', gr.Number, section=section))
+    shared.opts.onchange('comfyui_vae_chunk_size', update_vae_chunk_size)
+    update_vae_chunk_size()
+
+    memory_reclaim_options = {
+        'comfyui_memory_reclaim_unused_reserved_mb': (1024, 'Free webui memory after a call from ComfyUI when the torch allocator holds this many unused MB (0 to disable)'),
+        'comfyui_memory_reclaim_rss_growth_mb': (2048, 'Free webui memory after a call from ComfyUI when the process grew by this many MB since the last time (0 to disable)'),
+        'comfyui_memory_reclaim_calls': (0, 'Free webui memory every N calls from ComfyUI (0 to disable)'),
+        'comfyui_memory_reclaim_seconds': (60, 'Free webui memory after a call from ComfyUI when this many seconds passed since the last time (0 to disable)'),
+    }
+    for key, (default, label) in memory_reclaim_options.items():
+        shared.opts.add_option(key, shared.OptionInfo(default, label, gr.Number, section=section))
+        shared.opts.onchange(key, update_memory_reclaim_thresholds)
+    update_memory_reclaim_thresholds()
+
     shared.opts.add_option("comfyui_reverse_proxy_enabled", shared.OptionInfo(
         next(iter(reverse_proxy_choices.keys())), "Load ComfyUI iframes through a reverse proxy (requires reload UI. Needs --api. Default is on if webui is remote)", gr.Dropdown, lambda: {"choices": list(reverse_proxy_choices.keys())}, section=section))
     shared.opts.onchange("comfyui_reverse_proxy_enabled", update_reverse_proxy_enabled)
@@ -65,6 +82,23 @@ def update_comfyui_graceful_termination_timeout():
     global_state.comfyui_graceful_termination_timeout = timeout if timeout >= 0 else None
 
 
+@ipc.restrict_to_process('webui')
+def update_vae_chunk_size():
+    from modules import shared
+    global_state.vae_chunk_size = max(int(shared.opts.data.get('comfyui_vae_chunk_size', 4)), 0)
+
+
+@ipc.restrict_to_process('webui')
+def update_memory_reclaim_thresholds():
+    from modules import shared
+    from lib_comfyui.webui import memory
+    reclaimer = memory.reclaimer
+    reclaimer.max_unused_reserved_bytes = max(int(shared.opts.data.get('comfyui_memory_reclaim_unused_reserved_mb', 1024)), 0) * 1024 ** 2
+    reclaimer.max_rss_growth_bytes = max(int(shared.opts.data.get('comfyui_memory_reclaim_rss_growth_mb', 2048)), 0) * 1024 ** 2
+    reclaimer.max_calls = max(int(shared.opts.data.get('comfyui_memory_reclaim_calls', 0)), 0)
+    reclaimer.max_seconds = max(float(shared.opts.data.get('comfyui_memory_reclaim_seconds', 60)), 0)
+
+
 @ipc.restrict_to_process("webui")
 def update_reverse_proxy_enabled():
     from modules import shared
@@ -87,7 +121,10 @@ ipc_strategy_choices = {
     'Default': ipc.strategies.OsFriendlyIpcStrategy,
     'Shared memory': ipc.strategies.SharedMemoryIpcStrategy,
     'File system': ipc.strategies.FileSystemIpcStrategy,
+    'Memory-mapped file': ipc.strategies.MemoryMappedFileIpcStrategy,
 }
+if hasattr(socket, 'AF_UNIX'):
+    ipc_strategy_choices['Unix domain socket'] = ipc.strategies.UnixSocketIpcStrategy
 
 
 ipc_display_names = {
@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import patch
+from tests.utils import setup_test_env
+setup_test_env()
+
+import multiprocessing
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+from lib_comfyui import ipc, global_state
+from lib_comfyui.comfyui.iframe_requests import ComfyuiIFrameRequests
+
+
+class FakeServer:
+    def __init__(self, response_queue):
+        self.response_queue = response_queue
+
+    def send_sync(self, request, data, sid):
+        # the browser answers asynchronously. earlier requests take longer to answer
+        threading.Timer(data['delay'], self.response_queue.put, args=(f'{request} response',)).start()
+
+
+class TestComfyuiIFrameRequestsSend(unittest.TestCase):
+    def setUp(self) -> None:
+        response_queue = multiprocessing.Queue()
+        self.patches = [
+            patch.object(ipc, 'current_process_id', 'comfyui'),
+            patch('lib_comfyui.comfyui.iframe_requests.global_state', types.SimpleNamespace(focused_webui_client_id='client')),
+            patch.object(ComfyuiIFrameRequests, 'finished_comfyui_queue', response_queue),
+            patch.object(ComfyuiIFrameRequests, 'server_instance', FakeServer(response_queue)),
+            patch.object(ComfyuiIFrameRequests, 'sid_map', {'client': {'workflow_type': 'sid'}}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def test_concurrent_requests_receive_their_own_response(self):
+        requests = [f'request_{i}' for i in range(4)]
+
+        def send(i):
+            return ComfyuiIFrameRequests.send(request=requests[i], workflow_type='workflow_type', data={'delay': 0.1 * (len(requests) - i)})
+
+        with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            responses = list(executor.map(send, range(len(requests))))
+
+        self.assertEqual(responses, [f'{request} response' for request in requests])
+
+
+class TestComfyuiIFrameRequestsNodeOutputs(unittest.TestCase):
+    def tearDown(self) -> None:
+        global_state.node_outputs = []
+
+    def test_extend_node_outputs_appends_to_running_workflow_outputs(self):
+        global_state.node_outputs = []
+
+        ComfyuiIFrameRequests.extend_node_outputs({'output': 1})
+        ComfyuiIFrameRequests.extend_node_outputs({'output': 2})
+
+        self.assertEqual(global_state.node_outputs, [{'output': 1}, {'output': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Benchmark of the image conversions between the webui and comfyui
+
+Measures, for batches of 1 to 64 RGB images of 512 to 2048 px:
+- webui_to_comfyui: PIL images to a normalized (B, H, W, C) float tensor
+- comfyui_to_webui: a (B, H, W, C) float tensor to PIL images
+Each conversion is compared with the previous per-image implementation.
+Results are printed to stdout as json, or written to the file given with --output.
+
+Usage (from the extension root directory):
+    python -m tests.lib_comfyui_tests.comfyui_tests.type_conversion_benchmark --iterations 3 --output type_conversion_benchmark.json
+"""
+from tests.utils import setup_test_env
+setup_test_env()
+
+import argparse
+import json
+import os
+import statistics
+import time
+import numpy as np
+import torch
+from PIL import Image
+from typing import Callable, Dict, List
+from lib_comfyui.comfyui import type_conversion
+
+
+def per_image_webui_to_comfyui(images) -> torch.Tensor:
+    return torch.stack([torch.from_numpy(np.array(image)).permute(2, 0, 1) / 255 for image in images]).permute(0, 2, 3, 1)
+
+
+def per_image_comfyui_to_webui(batch: torch.Tensor) -> List[Image.Image]:
+    return [Image.fromarray(image.mul(255).byte().numpy()) for image in batch]
+
+
+def measure(function: Callable, iterations: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return {
+        'mean_ms': statistics.mean(durations) * 1000,
+        'min_ms': min(durations) * 1000,
+    }
+
+
+def measure_conversions(batch_size: int, resolution: int, iterations: int) -> Dict[str, Dict[str, float]]:
+    batch = torch.rand(batch_size, resolution, resolution, 3)
+    images = type_conversion.comfyui_image_to_webui(batch)
+    return {
+        'webui_to_comfyui': {
+            'per_image': measure(lambda: per_image_webui_to_comfyui(images), iterations),
+            'batched': measure(lambda: type_conversion.webui_image_to_comfyui(images), iterations),
+        },
+        'comfyui_to_webui': {
+            'per_image': measure(lambda: per_image_comfyui_to_webui(batch), iterations),
+            'batched': measure(lambda: type_conversion.comfyui_image_to_webui(batch), iterations),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image conversion benchmark')
+    parser.add_argument('--iterations', type=int, default=3, help='iterations per measurement')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--max-batch-mb', type=float, default=2048, help='skip batches whose float tensor is larger than this')
+    parser.add_argument('--output', help='json file to write the results to, defaults to stdout')
+    args = parser.parse_args()
+
+    conversions = []
+    for resolution in args.resolutions:
+        for batch_size in args.batch_sizes:
+            if batch_size * resolution ** 2 * 3 * 4 > args.max_batch_mb * 2 ** 20:
+                continue
+
+            conversions.append({
+                'batch_size': batch_size,
+                'resolution': resolution,
+                **measure_conversions(batch_size, resolution, args.iterations),
+            })
+
+    results = json.dumps({
+        'environment': {
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'thread_pool_min_batch_size': type_conversion.thread_pool_min_batch_size,
+        },
+        'conversions': conversions,
+    }, indent=4)
+    if args.output is None:
+        print(results)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import torch
+import types
+from unittest.mock import patch
+try:
+    from PIL import Image
+except ImportError:
+    raise unittest.SkipTest('Pillow is not installed')
+
+from lib_comfyui import ipc
+from lib_comfyui.comfyui import type_conversion
+from tests.lib_comfyui_tests.comfyui_tests import type_conversion_benchmark
+
+
+class TestImageConversion(unittest.TestCase):
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.batch = torch.rand(3, 16, 24, 3)
+
+    def test_matches_per_image_conversion(self):
+        images = type_conversion.comfyui_image_to_webui(self.batch)
+        expected_images = type_conversion_benchmark.per_image_comfyui_to_webui(self.batch)
+        self.assertEqual([image.tobytes() for image in images], [image.tobytes() for image in expected_images])
+        self.assertEqual(images[0].mode, 'RGB')
+        self.assertEqual(images[0].size, (24, 16))
+
+        batch = type_conversion.webui_image_to_comfyui(images)
+        self.assertEqual(batch.dtype, torch.float32)
+        self.assertTrue(torch.equal(batch, type_conversion_benchmark.per_image_webui_to_comfyui(images)))
+
+    def test_round_trip_is_within_quantization_error(self):
+        batch = type_conversion.webui_image_to_comfyui(type_conversion.comfyui_image_to_webui(self.batch))
+        self.assertLessEqual((batch - self.batch).abs().max().item(), 1 / 255)
+
+    def test_out_of_range_values_are_clamped(self):
+        batch = torch.tensor([-0.5, 0., 1., 1.5]).reshape(1, 1, 4, 1).expand(1, 1, 4, 3)
+        image = type_conversion.comfyui_image_to_webui(batch)[0]
+        self.assertEqual([image.getpixel((x, 0))[0] for x in range(4)], [0, 0, 255, 255])
+
+    def test_channel_modes(self):
+        for channels, mode in ((1, 'L'), (4, 'RGBA')):
+            images = type_conversion.comfyui_image_to_webui(self.batch[..., :1].expand(-1, -1, -1, channels))
+            self.assertEqual(images[0].mode, mode)
+            self.assertEqual(type_conversion.webui_image_to_comfyui(images).shape, (3, 16, 24, channels))
+
+    def test_thread_pool_preserves_order(self):
+        batch = torch.arange(10).reshape(10, 1, 1, 1).expand(10, 2, 2, 3) / 255
+        with patch.object(type_conversion, 'thread_pool_min_batch_size', 2):
+            images = type_conversion.comfyui_image_to_webui(batch)
+            self.assertEqual([image.getpixel((0, 0))[0] for image in images], list(range(10)))
+            self.assertTrue(torch.allclose(type_conversion.webui_image_to_comfyui(images), batch))
+
+    def test_tensors(self):
+        batch = type_conversion.comfyui_image_to_webui(self.batch, return_tensors=True)
+        self.assertEqual(batch.shape, (3, 3, 16, 24))
+        self.assertTrue(torch.equal(type_conversion.webui_image_to_comfyui(batch), self.batch))
+
+
+class TestLatentConversion(unittest.TestCase):
+    def setUp(self) -> None:
+        latent_format = types.SimpleNamespace(process_out=lambda x: x * 2, process_in=lambda x: x / 2)
+        self.patches = [
+            patch.object(ipc, 'current_process_id', 'comfyui'),
+            patch.object(type_conversion, 'get_comfy_model_config', lambda: types.SimpleNamespace(latent_format=latent_format)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def test_latents_are_converted_in_place_of_their_type(self):
+        latent = torch.ones(1, 4, 2, 2)
+        image = torch.zeros(1, 2, 2, 3)
+        comfyui_values = type_conversion.webui_latents_to_comfyui((image, latent), ('IMAGE', 'LATENT'))
+        self.assertIs(comfyui_values[0], image)
+        self.assertTrue(torch.equal(comfyui_values[1]['samples'], latent * 2))
+
+        webui_values = type_conversion.comfyui_latents_to_webui(comfyui_values, ('IMAGE', 'LATENT'))
+        self.assertIs(webui_values[0], image)
+        self.assertTrue(torch.equal(webui_values[1], latent))
+
+    def test_outputs_are_converted_by_input_name(self):
+        latent = {'samples': torch.ones(1, 4, 2, 2)}
+        image = torch.zeros(1, 2, 2, 3)
+        webui_outputs = type_conversion.comfyui_latents_to_webui({'2': latent, '1': image}, {'0': 'LATENT', '1': 'IMAGE', '2': 'LATENT'})
+        self.assertIs(webui_outputs['1'], image)
+        self.assertTrue(torch.equal(webui_outputs['2'], latent['samples'] / 2))
+
+
+class TestTypeConversionBenchmark(unittest.TestCase):
+    def test_measure_conversions(self):
+        results = type_conversion_benchmark.measure_conversions(batch_size=2, resolution=32, iterations=1)
+        for direction in ('webui_to_comfyui', 'comfyui_to_webui'):
+            for implementation in ('per_image', 'batched'):
+                self.assertGreater(results[direction][implementation]['mean_ms'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
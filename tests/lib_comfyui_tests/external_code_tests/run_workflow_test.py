@@ -1,8 +1,11 @@
 import unittest
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 from tests.utils import setup_test_env
 setup_test_env()
 
+import concurrent.futures
+import threading
+import time
 from lib_comfyui import external_code, global_state
 
 
@@ -30,7 +33,11 @@ class TestRunWorkflowBasicFunctionality(unittest.TestCase):
             batch_input_args=("value", 123),
             workflow_type_id="test_tab",
             workflow_input_types=('IMAGE', 'LATENT'),
+            workflow_output_types={'key1': 'IMAGE', 'key2': 'LATENT'},
             queue_front=True,
+            compact_images=True,
+            webui_latents=False,
+            cancel_event=ANY,
         )
         self.assertEqual(result, mock_start_workflow.return_value)
 
@@ -52,7 +59,11 @@ class TestRunWorkflowBasicFunctionality(unittest.TestCase):
             batch_input_args=("value", 123),
             workflow_type_id="test_tab",
             workflow_input_types=('IMAGE', 'LATENT'),
+            workflow_output_types={'0': 'IMAGE', '1': 'LATENT'},
             queue_front=True,
+            compact_images=True,
+            webui_latents=False,
+            cancel_event=ANY,
         )
         self.assertEqual(result, [tuple(batch.values()) for batch in mock_start_workflow.return_value])
 
@@ -74,7 +85,11 @@ class TestRunWorkflowBasicFunctionality(unittest.TestCase):
             batch_input_args=("value",),
             workflow_type_id="test_tab",
             workflow_input_types=('IMAGE',),
+            workflow_output_types={'IMAGE': 'IMAGE'},
             queue_front=True,
+            compact_images=True,
+            webui_latents=False,
+            cancel_event=ANY,
         )
         self.assertEqual(result, [next(iter(batch.values())) for batch in mock_start_workflow.return_value])
 
@@ -192,7 +207,11 @@ class TestRunWorkflowInputValidation(unittest.TestCase):
             batch_input_args=("value",),
             workflow_type_id="test_tab",
             workflow_input_types=('IMAGE',),
+            workflow_output_types={'IMAGE': 'IMAGE'},
             queue_front=True,
+            compact_images=True,
+            webui_latents=False,
+            cancel_event=ANY,
         )
 
     @patch("lib_comfyui.comfyui.iframe_requests.ComfyuiIFrameRequests.validate_amount_of_nodes_or_throw")
@@ -249,5 +268,77 @@ class TestRunWorkflowExecutionBehavior(unittest.TestCase):
         mock_start_workflow.assert_called_once()
 
 
+class TestSubmitWorkflow(unittest.TestCase):
+    def setUp(self) -> None:
+        setattr(global_state, 'enabled_workflow_type_ids', {
+            'test_tab': True,
+        })
+        self.workflow_type = external_code.WorkflowType(
+            base_id="test",
+            display_name="Test Tab",
+            tabs="tab",
+            types="IMAGE",
+        )
+        self.release_event = threading.Event()
+        self.started_events = []
+        self.patches = [
+            patch("lib_comfyui.comfyui.iframe_requests.ComfyuiIFrameRequests.validate_amount_of_nodes_or_throw"),
+            patch("lib_comfyui.comfyui.iframe_requests.ComfyuiIFrameRequests.start_workflow_sync", self.fake_start_workflow_sync),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        self.release_event.set()
+        for p in self.patches:
+            p.stop()
+
+    def fake_start_workflow_sync(self, batch_input_args, cancel_event, **kwargs):
+        self.started_events.append(batch_input_args[0])
+        while not self.release_event.wait(0.01):
+            if cancel_event.is_set():
+                raise RuntimeError('The workflow has not returned normally')
+
+        return [{'IMAGE': batch_input_args[0] * 2}]
+
+    def test_submissions_have_their_own_outputs(self):
+        handles = [external_code.submit_workflow(self.workflow_type, "tab", i) for i in range(3)]
+        self.assertFalse(any(handle.done() for handle in handles))
+
+        self.release_event.set()
+        self.assertEqual([handle.result(timeout=5) for handle in handles], [[0], [2], [4]])
+        self.assertEqual(self.started_events, [0, 1, 2])
+        self.assertTrue(all(handle.done() for handle in handles))
+
+    def test_result_timeout(self):
+        handle = external_code.submit_workflow(self.workflow_type, "tab", 1)
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            handle.result(timeout=0.05)
+
+    def test_cancel_pending_workflow(self):
+        running_handle = external_code.submit_workflow(self.workflow_type, "tab", 1)
+        pending_handle = external_code.submit_workflow(self.workflow_type, "tab", 2)
+
+        self.assertTrue(pending_handle.cancel())
+        self.release_event.set()
+        self.assertEqual(running_handle.result(timeout=5), [2])
+        with self.assertRaises(concurrent.futures.CancelledError):
+            pending_handle.result()
+        self.assertEqual(self.started_events, [1])
+
+    def test_cancel_running_workflow(self):
+        handle = external_code.submit_workflow(self.workflow_type, "tab", 1, identity_on_error=True)
+        while not self.started_events:
+            time.sleep(0.01)
+
+        self.assertTrue(handle.cancel())
+        self.assertEqual(handle.result(timeout=5), [1])
+        self.assertFalse(handle.cancel())
+
+    def test_invalid_input_raises_on_submit(self):
+        with self.assertRaises(ValueError):
+            external_code.submit_workflow(self.workflow_type, "other_tab", 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import threading
+import time
+import uuid
+from unittest.mock import patch
+from lib_comfyui import ipc, global_state
+
+
+GlobalState = type(global_state)
+
+
+class TestGlobalStateReplica(unittest.TestCase):
+    def setUp(self) -> None:
+        self.item = f'global_state_test_{uuid.uuid4().hex}'
+        self.proxy = object.__new__(ipc.callback.CallbackProxy)
+
+    def tearDown(self) -> None:
+        GlobalState.clear_replica()
+
+    def test_comfyui_reads_are_local_after_first_fetch(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'), \
+             patch.object(GlobalState, 'fetch', return_value=(1, True, 'value')) as fetch:
+            self.assertEqual(getattr(global_state, self.item), 'value')
+            self.assertEqual(getattr(global_state, self.item), 'value')
+            self.assertIn(self.item, global_state)
+
+        fetch.assert_called_once_with(self.item)
+
+    def test_comfyui_missing_items_are_replicated(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'), \
+             patch.object(GlobalState, 'fetch', return_value=(0, False, None)) as fetch:
+            self.assertFalse(hasattr(global_state, self.item))
+            self.assertNotIn(self.item, global_state)
+
+        fetch.assert_called_once_with(self.item)
+
+    def test_comfyui_invalidation_refetches(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'), \
+             patch.object(GlobalState, 'fetch', side_effect=[(1, True, 'old'), (2, True, 'new')]):
+            self.assertEqual(getattr(global_state, self.item), 'old')
+            GlobalState.invalidate_replica(self.item, 2)
+            self.assertEqual(getattr(global_state, self.item), 'new')
+            self.assertEqual(getattr(global_state, self.item), 'new')
+
+    def test_comfyui_does_not_keep_values_older_than_invalidation(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'):
+            GlobalState.invalidate_replica(self.item, 2)
+            with patch.object(GlobalState, 'fetch', side_effect=[(1, True, 'stale'), (2, True, 'new')]):
+                self.assertEqual(getattr(global_state, self.item), 'stale')
+                self.assertEqual(getattr(global_state, self.item), 'new')
+
+    def test_webui_invalidates_replicated_items_on_write(self):
+        with patch.dict(ipc.current_callback_proxies, {'comfyui': self.proxy}), \
+             patch.object(GlobalState, 'invalidate_replica') as invalidate_replica:
+            setattr(global_state, self.item, 'value')
+            invalidate_replica.assert_not_called()
+
+            version, found, value = GlobalState.fetch(self.item)
+            self.assertEqual((found, value), (True, 'value'))
+
+            setattr(global_state, self.item, 'new value')
+            invalidate_replica.assert_called_once_with(self.item, version + 1)
+
+            # the replica fetches again before it needs a new invalidation
+            delattr(global_state, self.item)
+            invalidate_replica.assert_called_once()
+
+    def test_comfyui_reads_return_copies(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'), \
+             patch.object(GlobalState, 'fetch', return_value=(1, True, {'key': [1]})):
+            getattr(global_state, self.item)['key'].append(2)
+            self.assertEqual(getattr(global_state, self.item), {'key': [1]})
+
+    def test_webui_writes_do_not_wait_for_a_stalled_comfyui_process(self):
+        release_event = threading.Event()
+        with patch.dict(ipc.current_callback_proxies, {'comfyui': self.proxy}), \
+             patch.object(GlobalState, 'invalidation_timeout', 0.05), \
+             patch.object(GlobalState, 'invalidate_replica', side_effect=lambda *args: release_event.wait()) as invalidate_replica:
+            try:
+                for _ in range(3):
+                    GlobalState.fetch(self.item)
+                    start = time.perf_counter()
+                    setattr(global_state, self.item, 'value')
+                    self.assertLess(time.perf_counter() - start, 0.5)
+            finally:
+                release_event.set()
+
+            # the invalidations run in the background
+            end_time = time.time() + 1
+            while invalidate_replica.call_count < 3 and time.time() < end_time:
+                time.sleep(0.01)
+            self.assertEqual(invalidate_replica.call_count, 3)
+            delattr(global_state, self.item)
+
+
+if __name__ == '__main__':
+    unittest.main()
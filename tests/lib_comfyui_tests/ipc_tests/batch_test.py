@@ -0,0 +1,63 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+from concurrent.futures import Future
+from unittest.mock import patch
+from lib_comfyui import ipc
+from tests.lib_comfyui_tests.ipc_tests.remote_call_test_case import RemoteCallTestCase, remote_echo, remote_fail, local_echo
+
+
+class TestBatch(RemoteCallTestCase):
+    def test_calls_are_sent_in_a_single_message(self):
+        # the first call to a function negotiates its id
+        remote_echo(None)
+        with patch.object(self.proxy, 'get', wraps=self.proxy.get) as get:
+            with ipc.batch():
+                futures = [remote_echo(i) for i in range(10)]
+                self.assertTrue(all(isinstance(future, Future) for future in futures))
+                self.assertFalse(any(future.done() for future in futures))
+
+            self.assertEqual(get.call_count, 1)
+
+        self.assertEqual([future.result() for future in futures], list(range(10)))
+
+    def test_exception_does_not_lose_other_results(self):
+        with ipc.batch():
+            before = remote_echo('before')
+            failure = remote_fail('message')
+            after = remote_echo('after')
+
+        self.assertEqual(before.result(), 'before')
+        self.assertIsInstance(failure.exception(), ValueError)
+        self.assertEqual(after.result(), 'after')
+
+    def test_local_calls_run_immediately(self):
+        with ipc.batch():
+            self.assertEqual(local_echo('value'), 'value')
+
+    def test_nested_batches_are_merged(self):
+        remote_echo(None)
+        with patch.object(self.proxy, 'get', wraps=self.proxy.get) as get:
+            with ipc.batch():
+                outer = remote_echo('outer')
+                with ipc.batch():
+                    inner = remote_echo('inner')
+
+                self.assertFalse(inner.done())
+
+            self.assertEqual(get.call_count, 1)
+
+        self.assertEqual((outer.result(), inner.result()), ('outer', 'inner'))
+
+    def test_error_in_context_cancels_calls(self):
+        with self.assertRaises(KeyError):
+            with ipc.batch():
+                future = remote_echo('value')
+                raise KeyError
+
+        self.assertTrue(future.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
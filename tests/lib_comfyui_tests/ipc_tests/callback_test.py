@@ -0,0 +1,193 @@
+import unittest
+from tests.utils import setup_test_env, remove_callback_files
+setup_test_env()
+
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from lib_comfyui.ipc.callback import CallbackWatcher, CallbackProxy
+from lib_comfyui.ipc.strategies import FileSystemIpcStrategy
+
+
+def echo(value, delay=0):
+    time.sleep(delay)
+    return value
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def delay_sends(proxy, delay, sending_event=None):
+    def delay_send(send):
+        def wrapper(value):
+            if sending_event is not None:
+                sending_event.set()
+            time.sleep(delay)
+            send(value)
+
+        return wrapper
+
+    for args_sender, _ in proxy._slots:
+        args_sender.send = delay_send(args_sender.send)
+
+
+def get_lock():
+    # locks cannot be pickled
+    return threading.Lock()
+
+
+class TestCallback(unittest.TestCase):
+    def setUp(self) -> None:
+        self.name = f'callback_test_{uuid.uuid4().hex}'
+        self.watcher = CallbackWatcher(lambda f, *args, **kwargs: f(*args, **kwargs), self.name, FileSystemIpcStrategy, clear_on_init=True, clear_on_del=False)
+        self.proxy = CallbackProxy(self.name, FileSystemIpcStrategy, clear_on_del=False)
+        self.watcher.start()
+
+    def tearDown(self) -> None:
+        self.watcher.stop()
+        remove_callback_files(self.name)
+
+    def test_returns_result(self):
+        self.assertEqual(self.proxy.get(args=(echo, 'value')), 'value')
+
+    def test_raises_remote_error(self):
+        with self.assertRaises(ValueError):
+            self.proxy.get(args=(fail, 'message'))
+
+    def test_concurrent_callers_receive_their_own_results(self):
+        def call(i):
+            return [self.proxy.get(args=(echo, (i, j))) for j in range(10)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(call, range(8)))
+
+        self.assertEqual(results, [[(i, j) for j in range(10)] for i in range(8)])
+
+    def test_small_calls_are_not_blocked_by_a_long_call(self):
+        long_call = threading.Thread(target=self.proxy.get, kwargs={'args': (echo, 'long'), 'kwargs': {'delay': 3}})
+        long_call.start()
+        time.sleep(0.2)
+
+        start_time = time.time()
+        for i in range(20):
+            self.assertEqual(self.proxy.get(args=(echo, i)), i)
+
+        self.assertLess(time.time() - start_time, 2)
+        long_call.join()
+
+    def test_get_async_returns_result(self):
+        self.assertEqual(asyncio.run(self.proxy.get_async(args=(echo, 'value'))), 'value')
+
+    def test_get_async_raises_remote_error(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(self.proxy.get_async(args=(fail, 'message')))
+
+    def test_get_async_does_not_block_event_loop(self):
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            res = await self.proxy.get_async(args=(echo, 'value'), kwargs={'delay': 0.5})
+            ticker.cancel()
+            return res, ticks
+
+        res, ticks = asyncio.run(run())
+        self.assertEqual(res, 'value')
+        self.assertGreater(ticks, 10)
+
+    def test_get_async_does_not_block_event_loop_while_sending(self):
+        delay_sends(self.proxy, 0.5)
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            res = await self.proxy.get_async(args=(echo, 'value'))
+            ticker.cancel()
+            return res, ticks
+
+        res, ticks = asyncio.run(run())
+        self.assertEqual(res, 'value')
+        self.assertGreater(ticks, 10)
+
+    def test_cancelled_get_async_frees_its_slot_once_sent(self):
+        sending = threading.Event()
+        delay_sends(self.proxy, 0.3, sending)
+
+        async def run():
+            call = asyncio.ensure_future(self.proxy.get_async(args=(echo, 'cancelled')))
+            while not sending.is_set():
+                await asyncio.sleep(0.01)
+
+            call.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await call
+
+        asyncio.run(run())
+        self.assertEqual(len(self.proxy._free_slots), len(self.proxy._slots) - 1)
+        time.sleep(0.5)
+        self.assertEqual(len(self.proxy._free_slots), len(self.proxy._slots))
+
+    def test_async_and_sync_callers_share_slots(self):
+        async def run():
+            return await asyncio.gather(*(
+                self.proxy.get_async(args=(echo, i), kwargs={'delay': 0.05})
+                for i in range(12)
+            ))
+
+        sync_results = []
+        sync_calls = threading.Thread(target=lambda: sync_results.extend(self.proxy.get(args=(echo, i), kwargs={'delay': 0.05}) for i in range(4)))
+        sync_calls.start()
+        self.assertEqual(asyncio.run(run()), list(range(12)))
+        sync_calls.join()
+        self.assertEqual(sync_results, list(range(4)))
+
+    def test_unpicklable_result_is_reported_to_the_caller(self):
+        with self.assertRaises(RuntimeError):
+            self.proxy.get(args=(get_lock,))
+
+        self.assertEqual(self.proxy.get(args=(echo, 'value')), 'value')
+
+    def test_worker_threads_survive_errors(self):
+        attend_consumer = self.watcher.attend_consumer
+        failed_slots = set()
+
+        def fail_once_per_slot(slot_index, *args, **kwargs):
+            if slot_index not in failed_slots:
+                failed_slots.add(slot_index)
+                raise OSError('disk full')
+
+            return attend_consumer(slot_index, *args, **kwargs)
+
+        self.watcher.attend_consumer = fail_once_per_slot
+        end_time = time.time() + 5
+        while len(failed_slots) < len(self.watcher._slots) and time.time() < end_time:
+            time.sleep(0.01)
+
+        async def run():
+            # one call per slot, a dead worker thread would never answer
+            return await asyncio.wait_for(asyncio.gather(*(
+                self.proxy.get_async(args=(echo, i), kwargs={'delay': 0.1})
+                for i in range(len(self.watcher._slots))
+            )), timeout=5)
+
+        self.assertEqual(asyncio.run(run()), list(range(len(self.watcher._slots))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from tests.utils import setup_test_env, remove_callback_files
+setup_test_env()
+
+import asyncio
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import time
+from lib_comfyui.ipc import strategies
+from lib_comfyui.ipc.callback import CallbackWatcher
+from lib_comfyui.ipc.payload import IpcReceiver, IpcSender
+from lib_comfyui.ipc.strategies import FileSystemIpcStrategy, FifoIpcDoorbell
+
+
+@unittest.skipUnless(hasattr(os, 'mkfifo'), 'named pipes are not available on this platform')
+class TestFifoIpcDoorbell(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'doorbell')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_ring_wakes_up_waiter(self):
+        doorbell = FifoIpcDoorbell(self.path)
+        doorbell.listen()
+        threading.Timer(0.2, FifoIpcDoorbell(self.path).ring).start()
+
+        start_time = time.time()
+        doorbell.wait(5)
+        self.assertLess(time.time() - start_time, 1)
+
+    def test_wait_times_out(self):
+        doorbell = FifoIpcDoorbell(self.path)
+        start_time = time.time()
+        doorbell.wait(0.2)
+        self.assertTrue(0.15 <= time.time() - start_time <= 0.5)
+
+    def test_ring_before_wait_is_not_lost(self):
+        doorbell = FifoIpcDoorbell(self.path)
+        doorbell.listen()
+        FifoIpcDoorbell(self.path).ring()
+
+        start_time = time.time()
+        doorbell.wait(5)
+        self.assertLess(time.time() - start_time, 0.5)
+
+    def test_ring_wakes_up_async_waiter(self):
+        doorbell = FifoIpcDoorbell(self.path)
+        doorbell.listen()
+
+        async def wait():
+            asyncio.get_running_loop().call_later(0.2, FifoIpcDoorbell(self.path).ring)
+            await doorbell.wait_async(5)
+
+        start_time = time.time()
+        asyncio.run(wait())
+        self.assertLess(time.time() - start_time, 1)
+
+    def test_ring_without_listener(self):
+        FifoIpcDoorbell(self.path).ring()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_blocking_receive_wakes_up_on_send(self):
+        receiver = IpcReceiver('doorbell_test', FileSystemIpcStrategy, lock_directory=self.directory, clear_on_init=True)
+        sender = IpcSender('doorbell_test', FileSystemIpcStrategy, lock_directory=self.directory, clear_on_del=False)
+        send_time = None
+
+        # the first receive imports torch, keep it out of the measurement
+        sender.send('warmup')
+        receiver.recv(timeout=5)
+
+        def send():
+            nonlocal send_time
+            send_time = time.time()
+            sender.send('test_value')
+
+        threading.Timer(0.2, send).start()
+        value = receiver.recv(timeout=5)
+        self.assertEqual(value, 'test_value')
+        self.assertLess(time.time() - send_time, 0.5)
+
+    def test_receiver_removes_fifo_on_delete(self):
+        receiver = IpcReceiver('doorbell_test', FileSystemIpcStrategy, lock_directory=self.directory, clear_on_init=True)
+        with self.assertRaises(TimeoutError):
+            receiver.recv(timeout=0.1)
+
+        doorbell_path = os.path.join(self.directory, 'ipc_payload_doorbell_test.doorbell')
+        self.assertTrue(os.path.exists(doorbell_path))
+        del receiver
+        gc.collect()
+        self.assertFalse(os.path.exists(doorbell_path))
+
+    def test_fifos_are_removed_on_exit(self):
+        doorbell = FifoIpcDoorbell(self.path)
+        doorbell.listen()
+        doorbell.close()
+        self.assertIn(self.path, strategies.created_fifo_paths)
+
+        strategies.unlink_created_fifos()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertNotIn(self.path, strategies.created_fifo_paths)
+
+    def test_stopped_watcher_removes_fifos(self):
+        watcher = CallbackWatcher(lambda: None, 'doorbell_test', FileSystemIpcStrategy, clear_on_init=True, clear_on_del=False, max_workers=2)
+        watcher.start()
+        doorbell_paths = [os.path.join(tempfile.gettempdir(), f'ipc_payload_args_doorbell_test_{slot_index}.doorbell') for slot_index in range(2)]
+        try:
+            end_time = time.time() + 5
+            while not all(map(os.path.exists, doorbell_paths)) and time.time() < end_time:
+                time.sleep(0.01)
+            self.assertTrue(all(map(os.path.exists, doorbell_paths)))
+
+            watcher.stop()
+            self.assertFalse(any(map(os.path.exists, doorbell_paths)))
+        finally:
+            watcher.stop()
+            remove_callback_files('doorbell_test')
+
+
+if __name__ == '__main__':
+    unittest.main()
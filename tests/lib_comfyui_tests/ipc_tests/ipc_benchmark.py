@@ -0,0 +1,297 @@
+"""
+Benchmark suite of the IPC layer
+
+Starts a second process and measures, for each strategy:
+- payload round trips: a value goes to the other process and back through raw IpcSender/IpcReceiver pairs, for each doorbell
+- callback calls: a remote echo function is called through CallbackProxy/CallbackWatcher, with sequential and concurrent callers
+- dispatch: the cost of finding the function to call on the serving side, by registered id and by fully qualified name
+
+Payloads range from a few bytes to several hundred MB of tensors.
+Results are printed to stdout as json, or written to the file given with --output.
+
+Usage (from the extension root directory):
+    python -m tests.lib_comfyui_tests.ipc_tests.ipc_benchmark --iterations 50 --output ipc_benchmark.json
+"""
+from tests.utils import setup_test_env
+setup_test_env()
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import torch
+from typing import Any, Callable, Dict, List
+from lib_comfyui import ipc
+from lib_comfyui.ipc import strategies
+from lib_comfyui.ipc.callback import CallbackProxy, CallbackWatcher, default_max_workers
+from lib_comfyui.ipc.payload import IpcReceiver, IpcSender
+
+
+def echo_worker(name: str, strategy_name: str, doorbell_name: str, iterations: int):
+    strategy_factory = get_strategy_factories()[strategy_name]
+    doorbell_factory = get_doorbell_factories()[doorbell_name]
+    receiver = IpcReceiver(f'{name}_ping', strategy_factory, clear_on_del=False, doorbell_factory=doorbell_factory)
+    sender = IpcSender(f'{name}_pong', strategy_factory, clear_on_del=False, doorbell_factory=doorbell_factory)
+    for _ in range(iterations):
+        sender.send(receiver.recv(timeout=60))
+
+
+def serve_worker(name: str, strategy_name: str):
+    watcher = CallbackWatcher(echo, name, get_strategy_factories()[strategy_name], clear_on_del=False)
+    watcher.start()
+    # serve until the benchmark closes our stdin
+    sys.stdin.read()
+    watcher.stop()
+
+
+def echo(value):
+    return value
+
+
+def start_worker_process(*worker_args: str, **kwargs) -> subprocess.Popen:
+    extension_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+    return subprocess.Popen(
+        [sys.executable, '-m', __spec__.name, *worker_args],
+        cwd=extension_root,
+        **kwargs,
+    )
+
+
+def measure_round_trips(strategy_name: str, doorbell_name: str, iterations: int, value: Any) -> Dict[str, float]:
+    name = f'benchmark_{os.getpid()}'
+    strategy_factory = get_strategy_factories()[strategy_name]
+    doorbell_factory = get_doorbell_factories()[doorbell_name]
+    sender = IpcSender(f'{name}_ping', strategy_factory, clear_on_init=True, doorbell_factory=doorbell_factory)
+    receiver = IpcReceiver(f'{name}_pong', strategy_factory, clear_on_init=True, doorbell_factory=doorbell_factory)
+
+    warmup_iterations = 1
+    process = start_worker_process('--echo', name, strategy_name, doorbell_name, str(iterations + warmup_iterations))
+    try:
+        latencies = []
+        for i in range(iterations + warmup_iterations):
+            start = time.perf_counter()
+            sender.send(value)
+            receiver.recv(timeout=60)
+            if i >= warmup_iterations:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        process.wait(timeout=60)
+
+    return summarize_latencies(latencies)
+
+
+def measure_calls(strategy_name: str, value: Any, iterations: int, callers: int) -> Dict[str, float]:
+    """
+    Call the echo function of a serving process `iterations` times from each of `callers` threads
+    """
+    name = f'benchmark_{os.getpid()}_callback'
+    proxy = CallbackProxy(name, get_strategy_factories()[strategy_name], clear_on_init=True)
+    process = start_worker_process('--serve', name, strategy_name, stdin=subprocess.PIPE)
+    try:
+        # warmup, also waits for the serving process to be ready
+        proxy.get(args=(value,))
+
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def caller():
+            caller_latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                proxy.get(args=(value,))
+                caller_latencies.append(time.perf_counter() - start)
+
+            with latencies_lock:
+                latencies.extend(caller_latencies)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.stdin.close()
+        process.wait(timeout=60)
+
+    calls = iterations * callers
+    return {
+        **summarize_latencies(latencies),
+        'calls_per_second': calls / elapsed,
+        # the value goes both ways
+        'throughput_mb_per_second': 2 * calls * get_payload_size(value) / elapsed / 2 ** 20,
+    }
+
+
+def measure_dispatch(iterations: int) -> Dict[str, float]:
+    """
+    Per call time spent by the serving process to find the function to call, excluding the call itself
+    """
+    function_id = ipc.register_function(__name__, echo.__qualname__)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        ipc.call_registered_function(function_id, (None,), {})
+    registered_id_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        ipc.resolve_fully_qualified(__name__, echo.__qualname__)(None)
+    fully_qualified_name_time = time.perf_counter() - start
+
+    return {
+        'iterations': iterations,
+        'registered_id_us': registered_id_time / iterations * 1e6,
+        'fully_qualified_name_us': fully_qualified_name_time / iterations * 1e6,
+    }
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        'iterations': len(latencies_ms),
+        'mean_ms': statistics.mean(latencies_ms),
+        'median_ms': statistics.median(latencies_ms),
+        'p90_ms': latencies_ms[int(0.9 * (len(latencies_ms) - 1))],
+        'p99_ms': latencies_ms[int(0.99 * (len(latencies_ms) - 1))],
+        'min_ms': latencies_ms[0],
+        'max_ms': latencies_ms[-1],
+    }
+
+
+def get_payloads(max_payload_mb: float) -> Dict[str, Any]:
+    payload_factories = {
+        'ping': (4, lambda: 'ping'),
+        'bytes_64KiB': (64 * 2 ** 10, lambda: os.urandom(64 * 2 ** 10)),
+        # large enough to need many socket reads per frame and to grow shared memory segments
+        'bytes_8MiB': (8 * 2 ** 20, lambda: os.urandom(8 * 2 ** 20)),
+        # a sd1.5 512x512 latent batch
+        'tensor_1x4x64x64': (4 * 64 * 64 * 4, lambda: torch.randn(1, 4, 64, 64)),
+        # a 1024x1024 comfyui IMAGE batch of 4
+        'tensor_4x1024x1024x3': (4 * 1024 * 1024 * 3 * 4, lambda: torch.rand(4, 1024, 1024, 3)),
+        'tensor_256MiB': (256 * 2 ** 20, lambda: torch.rand(64, 1024, 1024)),
+    }
+    return {
+        payload_name: payload_factory()
+        for payload_name, (payload_size, payload_factory) in payload_factories.items()
+        if payload_size <= max_payload_mb * 2 ** 20
+    }
+
+
+def get_payload_size(value: Any) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+
+    return len(value)
+
+
+def get_payload_iterations(value: Any, iterations: int) -> int:
+    # keep the large payloads from dominating the run time
+    return max(3, min(iterations, int(iterations * 2 ** 20 / max(get_payload_size(value), 1))))
+
+
+def get_strategy_factories() -> Dict[str, Callable]:
+    strategy_factories = {
+        'file_system': strategies.FileSystemIpcStrategy,
+        'shared_memory': strategies.SharedMemoryIpcStrategy,
+        'memory_mapped_file': strategies.MemoryMappedFileIpcStrategy,
+    }
+    if hasattr(socket, 'AF_UNIX'):
+        strategy_factories['unix_socket'] = strategies.UnixSocketIpcStrategy
+
+    return strategy_factories
+
+
+def get_doorbell_factories() -> Dict[str, Callable]:
+    doorbell_factories = {
+        'none': strategies.PollingIpcDoorbell,
+        'polling': strategies.PollingIpcDoorbell,
+    }
+    if hasattr(os, 'mkfifo'):
+        doorbell_factories['fifo'] = strategies.FifoIpcDoorbell
+
+    return doorbell_factories
+
+
+def get_environment() -> Dict[str, Any]:
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IPC benchmark suite')
+    parser.add_argument('--iterations', type=int, default=50, help='iterations per measurement, fewer for payloads larger than 1MiB')
+    parser.add_argument('--max-payload-mb', type=float, default=512, help='skip payloads larger than this')
+    parser.add_argument('--concurrency', type=int, default=default_max_workers, help='number of concurrent callers')
+    parser.add_argument('--strategies', nargs='+', choices=list(get_strategy_factories()), default=list(get_strategy_factories()))
+    parser.add_argument('--output', help='json file to write the results to, defaults to stdout')
+    parser.add_argument('--echo', nargs=4, metavar=('NAME', 'STRATEGY', 'DOORBELL', 'ITERATIONS'), help=argparse.SUPPRESS)
+    parser.add_argument('--serve', nargs=2, metavar=('NAME', 'STRATEGY'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.echo is not None:
+        name, strategy_name, doorbell_name, iterations = args.echo
+        echo_worker(name, strategy_name, doorbell_name, int(iterations))
+        return
+
+    if args.serve is not None:
+        serve_worker(*args.serve)
+        return
+
+    payloads = get_payloads(args.max_payload_mb)
+    payload_round_trips = []
+    callback_calls = []
+    for strategy_name in args.strategies:
+        strategy_factory = get_strategy_factories()[strategy_name]
+        # stream strategies do not use doorbells
+        doorbell_names = ['none'] if issubclass(strategy_factory, strategies.StreamIpcStrategy) else ['polling', 'fifo']
+        for payload_name, payload in payloads.items():
+            iterations = get_payload_iterations(payload, args.iterations)
+            common_fields = {
+                'strategy': strategy_name,
+                'payload': payload_name,
+                'payload_bytes': get_payload_size(payload),
+            }
+
+            for doorbell_name in doorbell_names:
+                if doorbell_name not in get_doorbell_factories():
+                    continue
+
+                payload_round_trips.append({
+                    **common_fields,
+                    'doorbell': doorbell_name,
+                    **measure_round_trips(strategy_name, doorbell_name, iterations, payload),
+                })
+
+            for callers in sorted({1, args.concurrency}):
+                callback_calls.append({
+                    **common_fields,
+                    'callers': callers,
+                    **measure_calls(strategy_name, payload, max(1, iterations // callers), callers),
+                })
+
+    results = json.dumps({
+        'environment': get_environment(),
+        'payload_round_trips': payload_round_trips,
+        'callback_calls': callback_calls,
+        'dispatch': measure_dispatch(100_000),
+    }, indent=4)
+    if args.output is None:
+        print(results)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(results)
+
+
+if __name__ == '__main__':
+    main()
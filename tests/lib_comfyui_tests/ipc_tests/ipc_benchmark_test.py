@@ -0,0 +1,36 @@
+import unittest
+from tests.utils import setup_test_env, remove_ipc_payload_files, remove_callback_files
+setup_test_env()
+
+import os
+import torch
+from tests.lib_comfyui_tests.ipc_tests import ipc_benchmark
+
+
+class TestIpcBenchmark(unittest.TestCase):
+    def tearDown(self) -> None:
+        name = f'benchmark_{os.getpid()}'
+        remove_ipc_payload_files(f'{name}_ping', f'{name}_pong')
+        remove_callback_files(f'{name}_callback')
+
+    def test_measure_calls(self):
+        results = ipc_benchmark.measure_calls('file_system', torch.randn(1, 4, 64, 64), iterations=2, callers=2)
+        self.assertEqual(results['iterations'], 4)
+        self.assertGreater(results['throughput_mb_per_second'], 0)
+
+    def test_measure_round_trips(self):
+        results = ipc_benchmark.measure_round_trips('file_system', 'polling', iterations=2, value='ping')
+        self.assertEqual(results['iterations'], 2)
+
+    def test_measure_dispatch(self):
+        results = ipc_benchmark.measure_dispatch(iterations=10)
+        self.assertGreater(results['registered_id_us'], 0)
+        self.assertGreater(results['fully_qualified_name_us'], 0)
+
+    def test_payload_size_limit(self):
+        payloads = ipc_benchmark.get_payloads(max_payload_mb=1)
+        self.assertTrue(all(ipc_benchmark.get_payload_size(payload) <= 2 ** 20 for payload in payloads.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
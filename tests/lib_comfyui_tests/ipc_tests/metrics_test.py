@@ -0,0 +1,77 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import asyncio
+import time
+from lib_comfyui.ipc import metrics
+from tests.lib_comfyui_tests.ipc_tests.remote_call_test_case import RemoteCallTestCase, echo, fail, remote_echo, remote_fail
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = metrics.LatencyHistogram()
+        for i in range(1, 101):
+            histogram.add(i / 1000)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 0.05, delta=0.05 * 0.2)
+        self.assertAlmostEqual(histogram.percentile(90), 0.09, delta=0.09 * 0.2)
+        self.assertEqual(histogram.percentile(100), 0.1)
+
+    def test_empty(self):
+        self.assertIsNone(metrics.LatencyHistogram().percentile(50))
+
+
+class TestIpcMetrics(RemoteCallTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        metrics.reset()
+
+    def get_function_metrics(self, function, direction, calls=1):
+        function_name = f'{function.__module__}.{function.__qualname__}'
+        # the serving side records a call right after answering it
+        end_time = time.time() + 1
+        while True:
+            for function_metrics in metrics.get_snapshot()['functions']:
+                if function_metrics['function'] == function_name and function_metrics['direction'] == direction and function_metrics['calls'] >= calls:
+                    return function_metrics
+
+            if time.time() > end_time:
+                self.fail(f'{direction} call to {function_name} was not recorded')
+
+            time.sleep(0.01)
+
+    def test_records_both_directions(self):
+        for _ in range(3):
+            remote_echo(b'x' * 1000)
+
+        for direction in ('outgoing', 'incoming'):
+            function_metrics = self.get_function_metrics(echo, direction, calls=3)
+            self.assertEqual(function_metrics['calls'], 3)
+            self.assertEqual(function_metrics['errors'], 0)
+            self.assertGreater(function_metrics['serialized_bytes']['sent'], 3000)
+            self.assertGreater(function_metrics['serialized_bytes']['received'], 3000)
+            self.assertGreater(function_metrics['latency_ms']['p50'], 0)
+
+    def test_records_async_calls(self):
+        asyncio.run(remote_echo.call_async(b'x' * 1000))
+
+        function_metrics = self.get_function_metrics(echo, 'outgoing')
+        self.assertGreater(function_metrics['serialized_bytes']['sent'], 1000)
+        self.assertGreater(function_metrics['serialized_bytes']['received'], 1000)
+
+    def test_records_errors(self):
+        with self.assertRaises(ValueError):
+            remote_fail()
+
+        self.assertEqual(self.get_function_metrics(fail, 'outgoing')['errors'], 1)
+        self.assertEqual(self.get_function_metrics(fail, 'incoming')['errors'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from tests.utils import setup_test_env, run_subprocess
+from tests.utils import setup_test_env, run_subprocess, remove_ipc_payload_files
 setup_test_env()
 
 import contextlib
@@ -33,6 +33,9 @@ class MockStrategy:
 
 
 class TestIpcSender(unittest.TestCase):
+    def tearDown(self) -> None:
+        remove_ipc_payload_files("test_sender")
+
     def test_send_method(self):
         strategy: MockStrategy
         def strategy_factory(*args):
@@ -48,6 +51,9 @@ class TestIpcSender(unittest.TestCase):
 
 
 class TestIpcReceiver(unittest.TestCase):
+    def tearDown(self) -> None:
+        remove_ipc_payload_files("test_receiver")
+
     def test_receive_method(self):
         strategy: MockStrategy
         def strategy_factory(*args):
@@ -68,6 +74,9 @@ class TestFunctionalIpc(unittest.TestCase):
     def setUp(self) -> None:
         self.name = "test"
 
+    def tearDown(self) -> None:
+        remove_ipc_payload_files(self.name, "mismatched_name")
+
     def test_basic_send_and_receive(self):
         run_subprocess(__file__, sender_worker, self.name, FileSystemIpcStrategy, "test_value")
         received_value = run_subprocess(__file__, receiver_worker, self.name, FileSystemIpcStrategy)
@@ -97,6 +106,8 @@ class TestFunctionalIpc(unittest.TestCase):
             run_subprocess(__file__, receiver_worker, "mismatched_name", FileSystemIpcStrategy)
 
     def test_timeout_behavior(self):
+        # an empty payload, the receiver waits for a value until the timeout
+        IpcReceiver(self.name, FileSystemIpcStrategy, clear_on_init=True, clear_on_del=False)
         start_time = time.time()
         with self.assertRaises(Exception):
             run_subprocess(__file__, receiver_worker, self.name, FileSystemIpcStrategy, 2)
@@ -0,0 +1,43 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import asyncio
+from unittest.mock import patch
+from lib_comfyui import ipc
+from lib_comfyui.ipc.callback import CallbackProxy
+from lib_comfyui.ipc.strategies import FileSystemIpcStrategy
+from tests.lib_comfyui_tests.ipc_tests.remote_call_test_case import RemoteCallTestCase, echo, remote_echo
+
+
+class TestFunctionRegistry(RemoteCallTestCase):
+    def test_register_function_is_idempotent(self):
+        function_id = ipc.register_function(echo.__module__, echo.__qualname__)
+        self.assertEqual(ipc.register_function(echo.__module__, echo.__qualname__), function_id)
+        self.assertEqual(ipc.call_registered_function(function_id, ('value',), {}), 'value')
+
+    def test_calls_only_send_the_function_id(self):
+        self.assertEqual(remote_echo('first'), 'first')
+        function_id = ipc.register_function(echo.__module__, echo.__qualname__)
+
+        with patch.object(self.proxy, 'get', wraps=self.proxy.get) as get:
+            self.assertEqual(remote_echo('second'), 'second')
+
+        get.assert_called_once_with(args=(function_id, ('second',), {}))
+
+    def test_new_proxy_negotiates_ids_again(self):
+        remote_echo('value')
+        self.assertIn((echo.__module__, echo.__qualname__), ipc.remote_function_ids[self.proxy])
+
+        proxy = CallbackProxy(self.name, FileSystemIpcStrategy)
+        with patch.dict(ipc.current_callback_proxies, {'comfyui': proxy}):
+            self.assertNotIn(proxy, ipc.remote_function_ids)
+            self.assertEqual(remote_echo('value'), 'value')
+            self.assertIn((echo.__module__, echo.__qualname__), ipc.remote_function_ids[proxy])
+
+    def test_call_async(self):
+        self.assertEqual(asyncio.run(remote_echo.call_async('value')), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
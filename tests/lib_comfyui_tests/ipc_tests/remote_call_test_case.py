@@ -0,0 +1,48 @@
+import unittest
+from tests.utils import setup_test_env, remove_callback_files
+setup_test_env()
+
+import uuid
+from unittest.mock import patch
+from lib_comfyui import ipc
+from lib_comfyui.ipc.callback import CallbackWatcher, CallbackProxy
+from lib_comfyui.ipc.strategies import FileSystemIpcStrategy
+
+
+def echo(value):
+    return value
+
+
+def fail(message=None):
+    raise ValueError(message)
+
+
+# both processes are the same in these tests. the watcher resolves the undecorated functions by name
+remote_echo = ipc.run_in_process('comfyui')(echo)
+remote_fail = ipc.run_in_process('comfyui')(fail)
+local_echo = ipc.run_in_process('webui')(echo)
+
+
+class RemoteCallTestCase(unittest.TestCase):
+    """
+    The current process plays the webui and serves the calls to the comfyui process itself
+    The lock and doorbell files of the callback are removed after each test
+    """
+
+    def setUp(self) -> None:
+        self.name = f'{type(self).__name__}_{uuid.uuid4().hex}'
+        self.watcher = CallbackWatcher(ipc.call_registered_function, self.name, FileSystemIpcStrategy, clear_on_init=True, clear_on_del=False)
+        self.proxy = CallbackProxy(self.name, FileSystemIpcStrategy, clear_on_del=False)
+        self.watcher.start()
+        self.patches = [
+            patch.object(ipc, 'current_process_id', 'webui'),
+            patch.dict(ipc.current_callback_proxies, {'comfyui': self.proxy}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+        self.watcher.stop()
+        remove_callback_files(self.name)
@@ -0,0 +1,81 @@
+import unittest
+from tests.utils import setup_test_env, run_subprocess, remove_ipc_payload_files
+setup_test_env()
+
+import os
+import pickle
+import torch
+from unittest.mock import patch
+from lib_comfyui.ipc import serialization
+from lib_comfyui.ipc.payload import IpcReceiver, IpcSender
+from lib_comfyui.ipc.strategies import FileSystemIpcStrategy
+
+
+@unittest.skipIf(serialization.shared_tensor_directory is None, 'shared tensors are not supported on this platform')
+class TestSharedTensors(unittest.TestCase):
+    def setUp(self) -> None:
+        self.segment_prefix = 'serialization_test'
+
+    def tearDown(self) -> None:
+        serialization.clear_segments(self.segment_prefix)
+        remove_ipc_payload_files('serialization_test')
+
+    def test_large_tensor_is_moved_to_shared_file(self):
+        tensor = torch.randn(4, 4, 64, 64)
+        data, segment_paths = serialization.dumps({'x': tensor}, self.segment_prefix)
+
+        self.assertEqual(len(segment_paths), 1)
+        self.assertLess(len(data), 1024)
+
+        value = serialization.loads(data)
+        self.assertTrue(torch.equal(value['x'], tensor))
+        self.assertFalse(os.path.exists(segment_paths[0]))
+
+    def test_non_contiguous_tensor(self):
+        tensor = torch.randn(4, 4, 64, 64).transpose(1, 3)
+        data, _ = serialization.dumps(tensor, self.segment_prefix)
+        self.assertTrue(torch.equal(serialization.loads(data), tensor))
+
+    def test_small_tensor_is_pickled_inline(self):
+        tensor = torch.randn(4, 4)
+        data, segment_paths = serialization.dumps(tensor, self.segment_prefix)
+
+        self.assertEqual(segment_paths, [])
+        self.assertTrue(torch.equal(serialization.loads(data), tensor))
+
+    def test_tensor_is_pickled_inline_when_shared_memory_is_full(self):
+        tensor = torch.randn(4, 4, 64, 64)
+        with patch('lib_comfyui.ipc.serialization.get_available_shared_memory_size', return_value=tensor.numel() * tensor.element_size() - 1):
+            data, segment_paths = serialization.dumps(tensor, self.segment_prefix)
+
+        self.assertEqual(segment_paths, [])
+        self.assertTrue(torch.equal(serialization.loads(data), tensor))
+
+    def test_no_segment_prefix(self):
+        tensor = torch.randn(4, 4, 64, 64)
+        data, segment_paths = serialization.dumps(tensor)
+
+        self.assertEqual(segment_paths, [])
+        self.assertEqual(data, pickle.dumps(tensor))
+
+    def test_clear_segments(self):
+        _, segment_paths = serialization.dumps(torch.randn(4, 4, 64, 64), self.segment_prefix)
+        serialization.clear_segments(self.segment_prefix)
+        self.assertFalse(os.path.exists(segment_paths[0]))
+
+    def test_send_tensor_to_other_process(self):
+        tensor = torch.randn(2, 4, 64, 64)
+        sender = IpcSender('serialization_test', FileSystemIpcStrategy, clear_on_init=True)
+        sender.send(tensor)
+        received_tensor = run_subprocess(__file__, receiver_worker, 'serialization_test', FileSystemIpcStrategy)
+
+        self.assertTrue(torch.equal(received_tensor, tensor))
+
+
+def receiver_worker(name, strategy_cls, timeout=1):
+    receiver = IpcReceiver(name, strategy_cls, clear_on_del=False)
+    return receiver.recv(timeout=timeout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import os
+import pickle
+import uuid
+import torch
+from lib_comfyui.ipc import shared_tensors, serialization
+
+
+@unittest.skipIf(serialization.shared_tensor_directory is None, 'tensors are only published on tmpfs')
+class TestSharedTensors(unittest.TestCase):
+    def setUp(self) -> None:
+        self.run_id = uuid.uuid4().hex
+
+    def tearDown(self) -> None:
+        shared_tensors.release(self.run_id)
+
+    def test_publish_and_resolve(self):
+        images = torch.rand(2, 64, 64, 3)
+        latent = {'samples': torch.randn(2, 4, 64, 64)}
+        inputs = (images, latent, 'text', torch.ones(2))
+
+        published = shared_tensors.publish(self.run_id, inputs)
+        self.assertIsInstance(published[0], shared_tensors.SharedTensorHandle)
+        self.assertIsInstance(published[1]['samples'], shared_tensors.SharedTensorHandle)
+        self.assertEqual(published[2], 'text')
+        # small tensors are left as is
+        self.assertIsInstance(published[3], torch.Tensor)
+        self.assertLess(len(pickle.dumps(published[:2])), 1024)
+
+        resolved = shared_tensors.resolve(pickle.loads(pickle.dumps(published)))
+        self.assertTrue(torch.equal(resolved[0], images))
+        self.assertTrue(torch.equal(resolved[1]['samples'], latent['samples']))
+        self.assertEqual(resolved[2], 'text')
+
+    def test_resolved_tensors_do_not_modify_published_file(self):
+        published = shared_tensors.publish(self.run_id, torch.zeros(64, 1024))
+        shared_tensors.resolve(published).fill_(1)
+        self.assertEqual(shared_tensors.resolve(published).sum().item(), 0)
+
+    def test_release_unlinks_files(self):
+        published = shared_tensors.publish(self.run_id, [torch.rand(64, 1024), torch.rand(64, 1024)])
+        resolved = shared_tensors.resolve(published)
+        paths = [handle.path for handle in published]
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        shared_tensors.release(self.run_id)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        # mapped tensors stay valid
+        self.assertEqual(resolved[0].shape, (64, 1024))
+        resolved[0].sum()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import unittest
+from unittest.mock import patch
+from tests.utils import setup_test_env
+setup_test_env()
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from lib_comfyui.ipc.strategies import MemoryMappedFileIpcStrategy, SharedMemoryIpcStrategy, UnixSocketIpcStrategy
+
+
+class TestSharedMemoryIpcStrategy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.directory, 'lock')
+        open(self.lock_path, 'wb').close()
+        self.sender = SharedMemoryIpcStrategy('strategies_test')
+        self.receiver = SharedMemoryIpcStrategy('strategies_test')
+
+    def tearDown(self) -> None:
+        del self.sender, self.receiver
+        shutil.rmtree(self.directory)
+
+    def send(self, data):
+        with open(self.lock_path, 'wb+') as lock_file:
+            self.sender.set_data(lock_file, data)
+
+    def recv(self):
+        with open(self.lock_path, 'rb+') as lock_file:
+            if self.receiver.is_empty(lock_file):
+                return None
+
+            with self.receiver.get_data(lock_file) as data:
+                return bytes(data)
+
+    def test_send_and_receive(self):
+        self.assertIsNone(self.recv())
+        self.send(b'test_value')
+        self.assertEqual(self.recv(), b'test_value')
+        self.assertIsNone(self.recv())
+
+    def test_segment_is_reused(self):
+        self.send(b'data1')
+        self.recv()
+        segment_name = self.sender._shm.name
+
+        self.send(b'data2')
+        self.assertEqual(self.recv(), b'data2')
+        self.assertEqual(self.sender._shm.name, segment_name)
+        self.assertEqual(self.receiver._shm.name, segment_name)
+
+    def test_segment_grows_geometrically(self):
+        self.send(b'small')
+        self.recv()
+        initial_capacity = self.sender._shm.size
+
+        large_data = os.urandom(initial_capacity + 1)
+        self.send(large_data)
+        self.assertEqual(self.recv(), large_data)
+        self.assertGreaterEqual(self.sender._shm.size, 2 * initial_capacity)
+
+    def test_fallback_to_lock_file_when_shared_memory_is_full(self):
+        self.send(b'small')
+        self.recv()
+        large_data = os.urandom(2 * self.sender._shm.size)
+
+        with patch('lib_comfyui.ipc.strategies.get_available_shared_memory_size', return_value=len(large_data) // 2):
+            self.send(large_data)
+
+        self.assertEqual(os.path.getsize(self.lock_path), SharedMemoryIpcStrategy.locator.size + len(large_data))
+        self.assertEqual(self.recv(), large_data)
+        self.assertIsNone(self.recv())
+
+        self.send(b'small')
+        self.assertEqual(self.recv(), b'small')
+
+    def test_clear(self):
+        self.send(b'test_value')
+        with open(self.lock_path, 'rb+') as lock_file:
+            self.receiver.clear(lock_file)
+
+        self.assertIsNone(self.recv())
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'unix domain sockets are not available on this platform')
+class TestMemoryMappedFileIpcStrategy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.directory, 'lock')
+        open(self.lock_path, 'wb').close()
+        self.sender = MemoryMappedFileIpcStrategy('strategies_test', directory=self.directory)
+        self.receiver = MemoryMappedFileIpcStrategy('strategies_test', directory=self.directory)
+
+    def tearDown(self) -> None:
+        del self.sender, self.receiver
+        shutil.rmtree(self.directory)
+
+    def send(self, data):
+        with open(self.lock_path, 'wb+') as lock_file:
+            self.sender.set_data(lock_file, data)
+
+    def recv(self):
+        with open(self.lock_path, 'rb+') as lock_file:
+            if self.receiver.is_empty(lock_file):
+                return None
+
+            with self.receiver.get_data(lock_file) as data:
+                return bytes(data)
+
+    def test_send_and_receive(self):
+        self.assertIsNone(self.recv())
+        self.send(b'test_value')
+        self.assertEqual(self.recv(), b'test_value')
+        self.assertIsNone(self.recv())
+
+    def test_receives_memoryview_of_file(self):
+        self.send(b'test_value')
+        with open(self.lock_path, 'rb+') as lock_file:
+            with self.receiver.get_data(lock_file) as data:
+                self.assertIsInstance(data, memoryview)
+                self.assertEqual(data, b'test_value')
+
+    def test_file_is_reused(self):
+        self.send(b'data1')
+        self.recv()
+        inode = os.stat(self.sender._path).st_ino
+
+        self.send(b'data2')
+        self.assertEqual(self.recv(), b'data2')
+        self.assertEqual(os.stat(self.sender._path).st_ino, inode)
+        self.assertEqual(self.receiver._mapping_inode, inode)
+
+    def test_file_grows_geometrically(self):
+        self.send(b'small')
+        self.recv()
+        initial_capacity = len(self.sender._mapping)
+
+        large_data = os.urandom(initial_capacity + 1)
+        self.send(large_data)
+        self.assertEqual(self.recv(), large_data)
+        self.assertGreaterEqual(len(self.sender._mapping), 2 * initial_capacity)
+
+    def test_fallback_to_lock_file_when_directory_is_full(self):
+        large_data = os.urandom(2 * MemoryMappedFileIpcStrategy.initial_capacity)
+
+        with patch('lib_comfyui.ipc.strategies.get_available_size', return_value=len(large_data) // 2):
+            self.send(large_data)
+
+        self.assertEqual(os.path.getsize(self.lock_path), len(large_data))
+        self.assertEqual(self.recv(), large_data)
+        self.assertIsNone(self.recv())
+
+        self.send(b'small')
+        self.assertEqual(self.recv(), b'small')
+        self.assertEqual(os.path.getsize(self.lock_path), 0)
+
+    def test_file_is_removed_with_sender(self):
+        self.send(b'data')
+        with open(self.lock_path, 'rb+') as lock_file:
+            self.assertFalse(self.receiver.is_empty(lock_file))
+
+        path = self.sender._path
+        del self.sender
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.recv(), b'data')
+        self.sender = MemoryMappedFileIpcStrategy('strategies_test', directory=self.directory)
+
+
+class TestUnixSocketIpcStrategy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.sender = UnixSocketIpcStrategy('strategies_test', self.directory)
+        self.receiver = UnixSocketIpcStrategy('strategies_test', self.directory)
+
+    def tearDown(self) -> None:
+        del self.sender, self.receiver
+        shutil.rmtree(self.directory)
+
+    def recv(self, timeout=5):
+        with self.receiver.recv(timeout) as data:
+            return bytes(data)
+
+    def send_in_background(self, *values):
+        thread = threading.Thread(target=lambda: [self.sender.send(value) for value in values])
+        thread.start()
+        return thread
+
+    def test_send_and_receive(self):
+        thread = self.send_in_background(b'test_value')
+        self.assertEqual(self.recv(), b'test_value')
+        thread.join()
+
+    def test_messages_are_queued(self):
+        thread = self.send_in_background(b'data1', b'data2')
+        self.assertEqual(self.recv(), b'data1')
+        self.assertEqual(self.recv(), b'data2')
+        thread.join()
+
+    def test_large_message(self):
+        large_data = os.urandom(16 * 1024 * 1024)
+        thread = self.send_in_background(large_data)
+        self.assertEqual(self.recv(), large_data)
+        thread.join()
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.recv(timeout=0.2)
+
+    def test_reconnect_after_receiver_restart(self):
+        thread = self.send_in_background(b'data1')
+        self.assertEqual(self.recv(), b'data1')
+        thread.join()
+
+        del self.receiver
+        self.receiver = UnixSocketIpcStrategy('strategies_test', self.directory)
+        thread = self.send_in_background(b'data2')
+        self.assertEqual(self.recv(), b'data2')
+        thread.join()
+
+    def test_recv_async(self):
+        thread = self.send_in_background(b'data1', b'data2')
+
+        async def recv():
+            return [bytes(await self.receiver.recv_async(5)) for _ in range(2)]
+
+        self.assertEqual(asyncio.run(recv()), [b'data1', b'data2'])
+        thread.join()
+
+    def test_interrupted_recv_resumes_partial_frame(self):
+        with self.assertRaises(TimeoutError):
+            self.recv(timeout=0.01)
+
+        data = os.urandom(1024)
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(os.path.join(self.directory, 'strategies_test.sock'))
+        connection.sendall(UnixSocketIpcStrategy.frame_header.pack(len(data)) + data[:100])
+        with self.assertRaises(TimeoutError):
+            asyncio.run(self.receiver.recv_async(0.2))
+
+        connection.sendall(data[100:])
+        self.assertEqual(self.recv(), data)
+        connection.close()
+
+    def test_send_times_out_without_receiver(self):
+        sender = UnixSocketIpcStrategy('strategies_test_no_receiver', self.directory, connect_timeout=0.2)
+        with self.assertRaises(TimeoutError):
+            sender.send(b'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
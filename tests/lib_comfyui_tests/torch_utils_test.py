@@ -0,0 +1,47 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import torch
+from lib_comfyui import torch_utils
+
+
+class TestCompactImages(unittest.TestCase):
+    def test_8_bit_images_round_trip_exactly(self):
+        image = torch.randint(0, 256, (2, 8, 8, 3), dtype=torch.uint8) / 255
+        latent = torch.randn(2, 4, 1, 1)
+        compacted = torch_utils.compact_images((image, latent, 'text'), ('IMAGE', 'LATENT', 'STRING'))
+
+        self.assertEqual(compacted[0].dtype, torch.uint8)
+        self.assertIs(compacted[1], latent)
+        self.assertEqual(compacted[2], 'text')
+
+        expanded = torch_utils.expand_images(compacted, ('IMAGE', 'LATENT', 'STRING'))
+        self.assertEqual(expanded[0].dtype, torch.float32)
+        self.assertTrue(torch.equal(expanded[0], image))
+        self.assertIs(expanded[1], latent)
+
+    def test_high_precision_images_are_quantized_to_the_nearest_value(self):
+        image = torch.tensor([-0.1, 0.5, 0.999, 1.2])
+        compacted, = torch_utils.compact_images((image,), ('IMAGE',))
+        self.assertEqual(compacted.tolist(), [0, 128, 255, 255])
+
+    def test_expand_leaves_float_images(self):
+        image = torch.rand(1, 2, 2, 3)
+        expanded, = torch_utils.expand_images((image,), ('IMAGE',))
+        self.assertIs(expanded, image)
+
+    def test_dict_values_are_matched_by_key(self):
+        image = torch.rand(1, 2, 2, 3)
+        mask = torch.rand(1, 2, 2)
+        # the first input of the node is not connected
+        outputs = {'2': image, '1': mask}
+        compacted = torch_utils.compact_images(outputs, {'0': 'IMAGE', '1': 'MASK', '2': 'IMAGE'})
+
+        self.assertEqual(list(compacted.keys()), ['2', '1'])
+        self.assertEqual(compacted['2'].dtype, torch.uint8)
+        self.assertIs(compacted['1'], mask)
+
+
+if __name__ == '__main__':
+    unittest.main()
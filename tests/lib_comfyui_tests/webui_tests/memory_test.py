@@ -0,0 +1,84 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import time
+from unittest.mock import patch
+from lib_comfyui.webui import memory
+
+
+class TestMemoryReclaimer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.rss = 1000
+        self.unused_reserved = 0
+
+    def create_reclaimer(self, **kwargs):
+        return memory.MemoryReclaimer(
+            get_unused_reserved_bytes=lambda: self.unused_reserved,
+            get_rss_bytes=lambda: self.rss,
+            **kwargs,
+        )
+
+    def test_disabled_thresholds_never_reclaim(self):
+        reclaimer = self.create_reclaimer()
+        with patch('gc.collect') as collect:
+            for _ in range(100):
+                self.assertIsNone(reclaimer.after_call())
+
+        collect.assert_not_called()
+        self.assertEqual(reclaimer.get_stats()['checks'], 100)
+        self.assertEqual(reclaimer.get_stats()['reclaims'], 0)
+
+    def test_calls_threshold(self):
+        reclaimer = self.create_reclaimer(max_calls=3)
+        reasons = [reclaimer.after_call() for _ in range(7)]
+        self.assertEqual(reasons, [None, None, 'calls', None, None, 'calls', None])
+
+    def test_seconds_threshold(self):
+        reclaimer = self.create_reclaimer(max_seconds=0.05)
+        self.assertIsNone(reclaimer.after_call())
+        time.sleep(0.06)
+        self.assertEqual(reclaimer.after_call(), 'seconds')
+        self.assertIsNone(reclaimer.after_call())
+
+    def test_unused_reserved_bytes_threshold(self):
+        reclaimer = self.create_reclaimer(max_unused_reserved_bytes=100)
+        self.unused_reserved = 99
+        self.assertIsNone(reclaimer.after_call())
+        self.unused_reserved = 100
+        self.assertEqual(reclaimer.after_call(), 'unused_reserved_bytes')
+
+    def test_rss_growth_is_measured_from_the_last_reclaim(self):
+        reclaimer = self.create_reclaimer(max_rss_growth_bytes=500)
+        self.assertIsNone(reclaimer.after_call())
+        self.rss = 1499
+        self.assertIsNone(reclaimer.after_call())
+        self.rss = 1500
+        self.assertEqual(reclaimer.after_call(), 'rss_growth_bytes')
+        self.rss = 1900
+        self.assertIsNone(reclaimer.after_call())
+        self.rss = 2000
+        self.assertEqual(reclaimer.after_call(), 'rss_growth_bytes')
+
+    def test_real_rss_growth_on_cpu(self):
+        reclaimer = memory.MemoryReclaimer(max_rss_growth_bytes=64 * 1024 ** 2)
+        reclaimer.after_call()
+        # calloc'ed pages would not count until touched
+        buffer = b'\x01' * (128 * 1024 ** 2)
+        self.assertEqual(reclaimer.after_call(), 'rss_growth_bytes')
+        del buffer
+
+    def test_stats(self):
+        reclaimer = self.create_reclaimer(max_calls=2)
+        for _ in range(4):
+            reclaimer.after_call()
+
+        stats = reclaimer.get_stats()
+        self.assertEqual(stats['checks'], 4)
+        self.assertEqual(stats['reclaims'], 2)
+        self.assertEqual(stats['reclaims_by_reason'], {'calls': 2})
+        self.assertGreater(stats['reclaim_ms'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
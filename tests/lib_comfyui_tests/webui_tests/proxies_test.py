@@ -0,0 +1,411 @@
+import unittest
+from tests.utils import setup_test_env
+setup_test_env()
+
+import pickle
+import sys
+import threading
+import time
+import types
+import torch
+from unittest.mock import MagicMock, patch
+from lib_comfyui import ipc, global_state
+from lib_comfyui.webui import proxies
+
+
+class TestConditioningCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = proxies.ConditioningCache(max_entries=2)
+        self.sent = proxies.SentConditioning(max_entries=2)
+        self.webui_kwargs = []
+        self.patches = [
+            patch.object(proxies, 'conditioning_cache', self.cache),
+            patch.object(proxies, 'sent_conditioning', self.sent),
+            patch.object(proxies.Model, 'sd_model_apply', self.fake_sd_model_apply),
+        ]
+        for p in self.patches:
+            p.start()
+
+        self.model = proxies.Model()
+        self.model.device = torch.device('cpu')
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def fake_sd_model_apply(self, x, t, **kwargs):
+        # what the webui receives
+        kwargs = pickle.loads(pickle.dumps(kwargs))
+        self.webui_kwargs.append(kwargs)
+        kwargs = {k: self.cache.resolve(v, 'cpu') for k, v in kwargs.items()}
+        return x + kwargs['c_crossattn'].sum()
+
+    def apply_model(self, c_crossattn):
+        return self.model.apply_model(torch.zeros(1), torch.zeros(1), c_crossattn=c_crossattn, transformer_options={})
+
+    def test_conditioning_is_sent_once(self):
+        cond = torch.randn(2, 77, 768)
+        for _ in range(3):
+            self.assertTrue(torch.allclose(self.apply_model(cond.clone()), cond.sum().reshape(1)))
+
+        self.assertIsNotNone(self.webui_kwargs[0]['c_crossattn'].tensor)
+        self.assertTrue(all(kwargs['c_crossattn'].tensor is None for kwargs in self.webui_kwargs[1:]))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_stats_are_published_as_gauges(self):
+        ipc.metrics.reset()
+        cond = torch.randn(2, 77, 768)
+        self.apply_model(cond)
+        self.apply_model(cond)
+        gauges = ipc.metrics.get_snapshot()['gauges']
+        ipc.metrics.reset()
+        self.assertEqual(gauges['conditioning_cache_hits'], 1)
+        self.assertEqual(gauges['conditioning_cache_misses'], 1)
+
+    def test_different_conditioning_is_not_confused(self):
+        cond = torch.randn(2, 77, 768)
+        other_cond = cond.clone()
+        other_cond[0, 0, 0] += 1
+
+        self.apply_model(cond)
+        self.assertTrue(torch.allclose(self.apply_model(other_cond), other_cond.sum().reshape(1)))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_evicted_conditioning_is_sent_again(self):
+        conds = [torch.randn(2, 77, 768) for _ in range(3)]
+        for cond in conds:
+            self.apply_model(cond)
+
+        self.cache.clear()
+        self.assertTrue(torch.allclose(self.apply_model(conds[2]), conds[2].sum().reshape(1)))
+        self.assertEqual(self.cache.get_stats(), {'hits': 0, 'misses': 4, 'entries': 1})
+
+    def test_lru_eviction(self):
+        conds = [torch.randn(4) for _ in range(3)]
+        references = [proxies.CachedTensor(str(i), cond) for i, cond in enumerate(conds)]
+        for reference in references:
+            self.cache.resolve(reference, 'cpu')
+
+        with self.assertRaises(proxies.ConditioningCacheMiss):
+            self.cache.resolve(proxies.CachedTensor('0'), 'cpu')
+        self.assertTrue(torch.equal(self.cache.resolve(proxies.CachedTensor('2'), 'cpu'), conds[2]))
+
+
+class TestAttributeCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = proxies.AttributeCache(uncached_attributes=['mutable'])
+        self.sd_model_generation = global_state.sd_model_generation
+
+    def tearDown(self) -> None:
+        global_state.sd_model_generation = self.sd_model_generation
+
+    def test_attributes_are_fetched_once_per_checkpoint(self):
+        fetch = MagicMock(side_effect=['first', 'second'])
+        self.assertEqual(self.cache.get('dtype', fetch), 'first')
+        self.assertEqual(self.cache.get('dtype', fetch), 'first')
+        self.assertEqual(fetch.call_count, 1)
+
+        global_state.sd_model_generation += 1
+        self.assertEqual(self.cache.get('dtype', fetch), 'second')
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_uncached_attributes(self):
+        fetch = MagicMock(side_effect=['first', 'second'])
+        self.assertEqual(self.cache.get('mutable', fetch), 'first')
+        self.assertEqual(self.cache.get('mutable', fetch), 'second')
+
+    def test_model_proxy_caches_attributes(self):
+        with patch.object(proxies.Model, 'attribute_cache', proxies.AttributeCache()), \
+             patch.object(proxies.Model, 'sd_model_getattr', side_effect=lambda item: {'device': torch.device('cpu'), 'dtype': torch.float16}[item]) as sd_model_getattr:
+            model = proxies.Model()
+            for _ in range(3):
+                self.assertEqual(model.dtype, torch.float16)
+                self.assertEqual(model.device, torch.device('cpu'))
+
+        self.assertEqual(sd_model_getattr.call_count, 2)
+
+
+class TestComfyModelConfigCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.global_state = types.SimpleNamespace(sd_model_generation=0)
+        self.patches = [
+            patch.object(proxies, 'global_state', self.global_state),
+            patch.object(proxies, 'comfy_model_config_cache', proxies.AttributeCache()),
+            patch.object(proxies, 'sd_model_config_cache', proxies.AttributeCache()),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def test_config_is_resolved_once_per_checkpoint(self):
+        with patch.object(ipc, 'current_process_id', 'comfyui'), \
+             patch.object(proxies, 'sd_model_get_config', return_value='v1-inference.yaml') as sd_model_get_config, \
+             patch.object(proxies, 'parse_comfy_model_config', side_effect=lambda path: {'path': path}):
+            for _ in range(3):
+                self.assertEqual(proxies.get_comfy_model_config(), {'path': 'v1-inference.yaml'})
+
+            self.global_state.sd_model_generation += 1
+            proxies.get_comfy_model_config()
+
+        self.assertEqual(sd_model_get_config.call_count, 2)
+
+    def test_callers_get_their_own_copy(self):
+        config = {'unet_config': {'adm_in_channels': None}}
+        with patch.object(proxies, 'parse_comfy_model_config', return_value=config):
+            modified_config = proxies.load_comfy_model_config('v1-inference.yaml')
+            modified_config['unet_config']['adm_in_channels'] = 768
+            self.assertEqual(proxies.load_comfy_model_config('v1-inference.yaml'), {'unet_config': {'adm_in_channels': None}})
+
+    def test_webui_finds_config_once_per_checkpoint(self):
+        with patch.object(proxies, 'find_sd_model_config', return_value='v1-inference.yaml') as find_sd_model_config:
+            for _ in range(3):
+                self.assertEqual(proxies.sd_model_get_config(), 'v1-inference.yaml')
+
+            self.global_state.sd_model_generation += 1
+            proxies.sd_model_get_config()
+
+        self.assertEqual(find_sd_model_config.call_count, 2)
+
+
+class TestTextEncoderCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.context = (0, 1)
+        self.cache = proxies.TextEncoderCache(max_entries=2)
+        self.patches = [
+            patch.object(proxies, 'text_encoder_cache', self.cache),
+            patch.object(self.cache, 'get_context', lambda: self.context),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def test_prompts_are_encoded_once(self):
+        token_weight_pairs = [[(49406, 1.0), (320, 1.1), (49407, 1.0)]]
+        with patch.object(proxies.Clip, 'encode_with_weights', side_effect=lambda pairs: (torch.randn(1, 77, 768), None)) as encode_with_weights:
+            cond, _ = proxies.Clip.sd_clip_encode_token_weights(token_weight_pairs)
+            cached_cond, _ = proxies.Clip.sd_clip_encode_token_weights([list(pairs) for pairs in token_weight_pairs])
+
+        self.assertIs(cached_cond, cond)
+        self.assertEqual(encode_with_weights.call_count, 1)
+        self.assertEqual(self.cache.get_stats(), {'hits': 1, 'misses': 1, 'entries': 1})
+
+    def test_prompts_are_tokenized_once(self):
+        with patch.object(proxies.ClipWrapper, 'tokenize_with_weights', return_value=[[(49406, 1.0)]]) as tokenize_with_weights:
+            proxies.ClipWrapper.sd_clip_tokenize_with_weights('a prompt')
+            proxies.ClipWrapper.sd_clip_tokenize_with_weights('a prompt')
+            proxies.ClipWrapper.sd_clip_tokenize_with_weights('a prompt', return_word_ids=True)
+
+        self.assertEqual(tokenize_with_weights.call_count, 2)
+
+    def test_checkpoint_or_clip_skip_change_invalidates(self):
+        compute = MagicMock(side_effect=range(10))
+        self.assertEqual(self.cache.get('prompt', compute), 0)
+        self.context = (1, 1)
+        self.assertEqual(self.cache.get('prompt', compute), 1)
+        self.context = (1, 2)
+        self.assertEqual(self.cache.get('prompt', compute), 2)
+        self.assertEqual(self.cache.get('prompt', compute), 2)
+        self.assertEqual(self.cache.get_stats(), {'hits': 1, 'misses': 3, 'entries': 1})
+
+    def test_stats_are_published_as_gauges(self):
+        ipc.metrics.reset()
+        compute = MagicMock(side_effect=range(10))
+        self.cache.get('prompt', compute)
+        self.cache.get('prompt', compute)
+        gauges = ipc.metrics.get_snapshot()['gauges']
+        ipc.metrics.reset()
+        self.assertEqual(gauges['text_encoder_cache_hits'], 1)
+        self.assertEqual(gauges['text_encoder_cache_misses'], 1)
+
+    def test_context_includes_emphasis_and_embeddings(self):
+        embedding_db = types.SimpleNamespace(word_embeddings={'style': object()}, embedding_dirs={'embeddings': types.SimpleNamespace(mtime=1.)})
+        modules = types.ModuleType('modules')
+        modules.shared = types.SimpleNamespace(opts=types.SimpleNamespace(CLIP_stop_at_last_layers=1, emphasis='Original'))
+        modules.sd_hijack = types.SimpleNamespace(model_hijack=types.SimpleNamespace(embedding_db=embedding_db))
+        with patch.dict(sys.modules, {'modules': modules, 'modules.shared': modules.shared, 'modules.sd_hijack': modules.sd_hijack}):
+            context = proxies.TextEncoderCache.get_context()
+            self.assertEqual(proxies.TextEncoderCache.get_context(), context)
+
+            modules.shared.opts.emphasis = 'No norm'
+            emphasis_context = proxies.TextEncoderCache.get_context()
+            self.assertNotEqual(emphasis_context, context)
+
+            # reloading an embedding creates a new object
+            embedding_db.word_embeddings = {'style': object()}
+            embeddings_context = proxies.TextEncoderCache.get_context()
+            self.assertNotEqual(embeddings_context, emphasis_context)
+
+            embedding_db.embedding_dirs['embeddings'].mtime = 2.
+            self.assertNotEqual(proxies.TextEncoderCache.get_context(), embeddings_context)
+
+    def test_lru_eviction(self):
+        compute = MagicMock(side_effect=range(10))
+        for key in ('a', 'b', 'a', 'c'):
+            self.cache.get(key, compute)
+
+        self.assertEqual(self.cache.get('a', compute), 0)
+        self.assertEqual(self.cache.get('b', compute), 3)
+
+
+class FakeCondStageModel:
+    id_start = 49406
+    id_end = 49407
+    id_pad = 49407
+
+    def __init__(self):
+        self.embedding = torch.nn.Embedding(49408, 8)
+        self.wrapped = types.SimpleNamespace(max_length=77)
+        self.encode_calls = 0
+
+    def encode_with_transformers(self, tokens):
+        self.encode_calls += 1
+        # attention mixes the positions of a chunk, never different chunks
+        return self.embedding(tokens).cumsum(dim=1)
+
+    def process_tokens(self, remade_batch_tokens, batch_multipliers):
+        # webui implementation, without the emphasis option
+        tokens = torch.asarray(remade_batch_tokens)
+        if self.id_end != self.id_pad:
+            for batch_pos in range(len(remade_batch_tokens)):
+                index = remade_batch_tokens[batch_pos].index(self.id_end)
+                tokens[batch_pos, index + 1:tokens.shape[1]] = self.id_pad
+
+        z = self.encode_with_transformers(tokens)
+        batch_multipliers = torch.asarray(batch_multipliers)
+        original_mean = z.mean()
+        z = z * batch_multipliers.reshape(batch_multipliers.shape + (1,)).expand(z.shape)
+        new_mean = z.mean()
+        return z * (original_mean / new_mean)
+
+    def tokenize_line(self, text):
+        words = text.split()
+        chunks = []
+        for i in range(0, max(len(words), 1), 75):
+            chunk_words = words[i:i + 75]
+            tokens = [self.id_start] + [100 + len(word) for word in chunk_words] + [self.id_end] * (76 - len(chunk_words))
+            multipliers = [1.0] + [1.1 if word.startswith('(') else 1.0 for word in chunk_words] + [1.0] * (76 - len(chunk_words))
+            chunks.append(types.SimpleNamespace(tokens=tokens, multipliers=multipliers))
+
+        return chunks, len(words)
+
+
+class TestClipEncoding(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cond_stage_model = FakeCondStageModel()
+        modules = types.ModuleType('modules')
+        modules.shared = types.SimpleNamespace(sd_model=types.SimpleNamespace(cond_stage_model=self.cond_stage_model))
+        modules.devices = types.SimpleNamespace(device='cpu')
+        self.patches = [
+            patch.dict(sys.modules, {'modules': modules}),
+            patch.object(proxies, 'text_encoder_cache', proxies.TextEncoderCache()),
+            patch.object(proxies.TextEncoderCache, 'get_context', staticmethod(lambda: None)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+
+    def encode_per_chunk(self, token_weight_pairs_list):
+        conds = [
+            self.cond_stage_model.process_tokens([[pair[0] for pair in pairs]], [[pair[1] for pair in pairs]])
+            for pairs in token_weight_pairs_list
+        ]
+        return torch.hstack(conds)
+
+    def test_long_prompt_is_encoded_in_one_pass(self):
+        prompt = ' '.join(f'(word{i}' if i % 7 == 0 else f'w{i}' for i in range(200))
+        token_weight_pairs = proxies.ClipWrapper.sd_clip_tokenize_with_weights(prompt)
+        self.assertEqual(len(token_weight_pairs), 3)
+
+        with torch.no_grad():
+            expected = self.encode_per_chunk(token_weight_pairs)
+            self.cond_stage_model.encode_calls = 0
+            cond, _ = proxies.Clip.sd_clip_encode_token_weights(token_weight_pairs)
+
+        self.assertEqual(self.cond_stage_model.encode_calls, 1)
+        self.assertEqual(cond.shape, (1, 3 * 77, 8))
+        self.assertTrue(torch.allclose(cond, expected, atol=1e-5))
+
+    def test_sd2_padding(self):
+        self.cond_stage_model.id_pad = 0
+        token_weight_pairs = proxies.ClipWrapper.sd_clip_tokenize_with_weights('a (short prompt')
+        with torch.no_grad():
+            expected = self.encode_per_chunk(token_weight_pairs)
+            cond, _ = proxies.Clip.sd_clip_encode_token_weights(token_weight_pairs)
+
+        self.assertTrue(torch.allclose(cond, expected, atol=1e-5))
+
+    def test_word_ids(self):
+        prompt = ' '.join(f'w{i}' for i in range(80))
+        token_weight_pairs = proxies.ClipWrapper.sd_clip_tokenize_with_weights(prompt, return_word_ids=True)
+
+        self.assertEqual([pair[2] for pair in token_weight_pairs[0][:3]], [0, 1, 2])
+        self.assertEqual(token_weight_pairs[1][0][2], 77)
+        self.assertEqual(token_weight_pairs[1][-1][2], 0)
+
+
+class TestVaeChunks(unittest.TestCase):
+    def setUp(self) -> None:
+        self.chunk_sizes = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def fake_decode(self, samples, scale=1):
+        with self.lock:
+            self.chunk_sizes.append(len(samples))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return samples.repeat_interleave(2, dim=-1) * scale
+
+    def test_whole_batch_when_disabled(self):
+        samples = torch.arange(24, dtype=torch.float32).reshape(6, 2, 2)
+        res = proxies.call_in_chunks(self.fake_decode, samples, chunk_size=0, device='cpu')
+        self.assertEqual(self.chunk_sizes, [6])
+        self.assertTrue(torch.equal(res, samples.repeat_interleave(2, dim=-1)))
+
+    def test_chunks_are_assembled_in_order(self):
+        samples = torch.arange(28, dtype=torch.float32).reshape(7, 2, 2)
+        res = proxies.call_in_chunks(self.fake_decode, samples, 3, chunk_size=2, device='cpu')
+        self.assertEqual(sorted(self.chunk_sizes), [1, 2, 2, 2])
+        self.assertTrue(torch.equal(res, samples.repeat_interleave(2, dim=-1) * 3))
+
+    def test_next_chunk_is_sent_during_compute(self):
+        samples = torch.zeros(8, 2, 2)
+        proxies.call_in_chunks(self.fake_decode, samples, chunk_size=2, device='cpu')
+        self.assertEqual(self.max_running, proxies.vae_chunks_in_flight)
+
+    def test_error_is_raised(self):
+        def fail(samples):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            proxies.call_in_chunks(fail, torch.zeros(4, 1), chunk_size=1, device='cpu')
+
+    def test_chunk_size_is_reported(self):
+        vae = proxies.Vae()
+        vae.device = torch.device('cpu')
+        ipc.metrics.reset()
+        with patch.object(proxies, 'global_state', types.SimpleNamespace(vae_chunk_size=2)):
+            res = vae.send_in_chunks(self.fake_decode, 'decode', torch.zeros(5, 1))
+
+        self.assertEqual(res.shape, (5, 2))
+        gauges = ipc.metrics.get_snapshot()['gauges']
+        ipc.metrics.reset()
+        self.assertEqual(gauges['vae_decode_chunk_size'], 2)
+        self.assertEqual(gauges['vae_decode_chunks'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
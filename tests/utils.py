@@ -2,6 +2,7 @@ import os
 import pickle
 import subprocess
 import sys
+import tempfile
 
 
 def setup_test_env():
@@ -9,6 +10,26 @@ def setup_test_env():
     if extension_root not in sys.path:
         sys.path.append(extension_root)
 
+
+def remove_ipc_payload_files(*names, directory=None):
+    directory = tempfile.gettempdir() if directory is None else directory
+    for name in names:
+        for path in (f'ipc_payload_{name}', f'ipc_payload_{name}.doorbell'):
+            try:
+                os.unlink(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+
+def remove_callback_files(name):
+    from lib_comfyui.ipc.callback import default_max_workers
+    remove_ipc_payload_files(*(
+        f'{payload}_{name}_{slot_index}'
+        for payload in ('args', 'res')
+        for slot_index in range(default_max_workers)
+    ))
+
+
 def worker_args(*args, **kwargs):
     return args, kwargs
 